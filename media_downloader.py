@@ -11,18 +11,51 @@ from loguru import logger
 import random
 from typing import AsyncGenerator, Optional
 from rich.logging import RichHandler
-from tqdm.asyncio import tqdm
+from pyrogram.file_id import FileId
 
 from module.app import Application, ChatDownloadConfig, DownloadStatus, TaskNode
 from module.bot import start_download_bot, stop_download_bot
-from module.download_stat import update_download_status
-from module.get_chat_history_v2 import get_chat_history_v2
+from module.download_queue import (
+    DownloadQueue,
+    FairSharePolicy,
+    FifoPolicy,
+    create_policy,
+)
+from module.download_stat import (
+    finish_scan_progress,
+    get_scan_progress,
+    start_scan_progress,
+    update_chat_queue_stat,
+    update_download_status,
+    update_scan_progress,
+)
+from module.autoscaler import WorkerAutoscaler
+from module.bandwidth import download_limiter, upload_limiter
+from module.async_db import AsyncDB
+from module.chunk_writer import ChunkWriter
+from module.db_writer import DBWriter
+from module.file_finalizer import FileFinalizer
+from module.flow_control import ChunkPacer, FloodWaitBackoff
+from module.get_chat_history_v2 import (
+    ScanRangeTracker,
+    get_chat_history_parallel,
+    get_chat_history_v2,
+    get_messages_v2,
+    get_search_filter,
+    get_top_message_id,
+    split_id_range,
+    track_history,
+)
 from module.language import _t
+from module.scan_pipeline import HISTORY_PAGE_SIZE, ScanPipeline
+from module.status_index import StatusIndex
+from module.raw_message import ScanMessage, get_input_peer_id, load_message
 from module.pyrogram_extension import (
     HookClient,
     fetch_message,
     record_download_status,
     report_bot_download_status,
+    set_db_writer,
     set_max_concurrent_transmissions,
     set_meta_data,
     upload_telegram_chat,
@@ -33,17 +66,15 @@ from utils.format import (
     validate_title,
     process_string,
     find_files_in_dir,
-    find_missing_files,
-    merge_files_cat,
-    merge_files_write,
-    merge_files_shutil,
-    get_folder_files_size,
+    split_missing_ranges,
 )
+from utils.download_storage import CHUNK_SIZE, DownloadStorage, load_missing_ranges
+from utils.file_management import find_duplicate_candidates, manage_duplicate_file
 from utils.log import LogFilter
 from utils.meta import print_meta
 from utils.meta_data import MetaData
 
-from module.sqlmodel import Downloaded
+from module.sqlmodel import Downloaded, MessageCache, migrate_schema
 
 logging.basicConfig(
     level=logging.INFO,
@@ -58,9 +89,15 @@ APPLICATION_NAME = "media_downloader"
 app = Application(CONFIG_NAME, DATA_FILE_NAME, APPLICATION_NAME)
 
 queue_maxsize = 1000
-queue: asyncio.Queue = asyncio.Queue(maxsize=queue_maxsize)
+# fair 策略下每个会话最多占用的队列长度
+chat_queue_maxsize = 250
+queue: DownloadQueue = DownloadQueue(
+    maxsize=queue_maxsize, policy=FifoPolicy(), chat_maxsize=chat_queue_maxsize
+)
 
 RETRY_TIME_OUT = 3
+# 扫描进度的日志间隔
+SCAN_REPORT_INTERVAL = 30
 
 CHUNK_MIN = 10
 
@@ -73,61 +110,46 @@ logging.getLogger("pyrogram.client").addFilter(LogFilter())
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 
 db = Downloaded()
-
-
-def check_download_finish(media_size: int, download_path: str, ui_file_name: str, chunk_count: int) -> bool:
+message_cache_db = MessageCache()
+chunk_pacer = ChunkPacer()
+history_backoff = FloodWaitBackoff()
+file_finalizer = FileFinalizer()
+status_index = StatusIndex()
+db_writer = DBWriter(status_index=status_index)
+async_db = AsyncDB(db, status_index, db_writer)
+worker_autoscaler = WorkerAutoscaler(get_queue_depth=queue.qsize)
+
+
+def check_download_finish(
+    media_size: int, download_path: str, ui_file_name: str, chunk_size: int = CHUNK_SIZE
+) -> bool:
+    """Check if every chunk of a large download is on disk, from its manifest only"""
     # 类型检查
     if not isinstance(media_size, int) or not isinstance(download_path, str) or not isinstance(ui_file_name,
-                                                                                               str) or not isinstance(
-        chunk_count, int):
+                                                                                               str):
         raise TypeError("Invalid argument types")
 
     # 边界条件检查
-    if media_size <= 0 or chunk_count <= 0:
-        return False
-
-    try:
-        files_count, total_size, files_size = get_folder_files_size(download_path)
-    except Exception as e:
-        print(f"Error while getting folder size: {e}")
+    if media_size <= 0:
         return False
 
-    if files_count != chunk_count or total_size != media_size:
+    missing_ranges = load_missing_ranges(download_path, media_size, chunk_size)
+    if missing_ranges is None:
+        logger.debug(f"{ui_file_name}: chunk manifest missing or corrupt")
         return False
-    return True
-
+    return not missing_ranges
 
-def merge_chunkfile(folder_path: str, output_file: str, chunk_count: int, file_size: int, method: str):
-    # 验证路径有效性
-    if not os.path.isdir(folder_path):
-        raise ValueError(f"Folder path '{folder_path}' does not exist or is not a directory.")
-
-    # 创建输出文件夹
-    directory, _ = os.path.split(output_file)
-    os.makedirs(directory, exist_ok=True)
-
-    # 获取文件列表
-    file_list = os.listdir(folder_path)
-
-    # 检查文件数量是否匹配
-    if chunk_count != len(file_list):
-        return False
-
-    # 根据方法选择合并方式
-    if method == 'cat':
-        merge_files_cat(folder_path, output_file)
-    elif method == 'write':
-        merge_files_write(folder_path, output_file)
-    elif method == 'shutil':
-        merge_files_shutil(folder_path, output_file)
-    else:
-        raise ValueError(f"Invalid method '{method}'. Supported methods are 'cat', 'write', and 'shutil'.")
-
-    # 检查文件是否存在且大小正确
-    while not _is_exist(output_file) and os.path.getsize(output_file) != file_size:
-        time.sleep(1)
-    return True
 
+def _get_media_dc_id(message: pyrogram.types.Message) -> int:
+    """Data center that serves the media of the message, 0 if unknown"""
+    for media_type in ("audio", "video", "photo", "document"):
+        media = getattr(message, media_type, None)
+        if media:
+            try:
+                return FileId.decode(media.file_id).dc_id
+            except Exception:
+                return 0
+    return 0
 
 
 def _check_timeout(retry: int, _: int):
@@ -157,10 +179,10 @@ class Msg_file_Status(Enum):
     File_Aka_Exist = 2  # 文件系统中等价文件存在
 
 
-def _get_msg_db_status(msg_dict: dict):
+async def _get_msg_db_status(msg_dict: dict):
     msg_chat_id = msg_dict.get('chat_id')
     try:
-        msg_db_status = db.getStatus(msg_chat_id, msg_dict.get('message_id'))
+        msg_db_status = await async_db.get_status(msg_chat_id, msg_dict.get('message_id'))
     except Exception as e:
         logger.error(
             f"[{e}].",
@@ -168,7 +190,7 @@ def _get_msg_db_status(msg_dict: dict):
         )
 
     if msg_db_status == 0:  #数据库里没这条数据
-        db_files = db.get_similar_files(msg_dict, similar_set, sizerange_min, [1, 2])  #看看是否有等价内容数据 4因为依附于1 暂时不管
+        db_files = await async_db.get_similar_files(msg_dict, similar_set, sizerange_min, [1, 2])  #看看是否有等价内容数据 4因为依附于1 暂时不管
         if db_files and len(db_files) >= 1:
             for db_file in db_files:
                 if db_file.status == 1 or db_file.status == 4:  #等价存在
@@ -416,21 +438,22 @@ def _get_media_meta(
     return media_dict
 
 
-async def add_download_task(
+async def _classify_download_task(
         message: pyrogram.types.Message,
         node: TaskNode,
-):
+) -> Optional[dict]:
+    """Check the message against the database, its media meta if it has to be downloaded"""
     if message.empty:
-        return False
+        return None
 
     To_Down = False
 
     msg_dict = _get_media_meta(message)
-    msg_db_status = _get_msg_db_status(msg_dict)
+    msg_db_status = await _get_msg_db_status(msg_dict)
 
     if msg_db_status == Msg_db_Status.DB_Exist:  # 数据库有完成
         node.download_status[message.id] = DownloadStatus.SuccessDownload
-        return
+        return None
 
         # 不再检查本地文件是否存在 相信数据库
         # msg_file_status = await _get_msg_file_status(msg_dict)
@@ -444,7 +467,7 @@ async def add_download_task(
     elif msg_db_status == Msg_db_Status.DB_Aka_Exist:  # 数据库有 标记为与其他等价
         # 文件有没有暂时不管
         node.download_status[message.id] = DownloadStatus.SkipDownload
-        return
+        return None
     elif msg_db_status == Msg_db_Status.DB_Downloading:  # 数据库标识为正在下载
 
         msg_file_status = await _get_msg_file_status(msg_dict)
@@ -452,14 +475,14 @@ async def add_download_task(
             # 文件存在
             node.download_status[message.id] = DownloadStatus.SkipDownload
             msg_dict['status'] = 1
-            db.insert_into_db(msg_dict)  # 补写入数据库
-            return
+            db_writer.put(msg_dict)  # 补写入数据库
+            return None
         else:
             # 文件没了
             To_Down = True  # 重新下载
     elif msg_db_status == Msg_db_Status.DB_Aka_Downloading:  # 数据库有其他等价文件在下载
         node.download_status[message.id] = DownloadStatus.SkipDownload
-        return
+        return None
     elif msg_db_status == Msg_db_Status.DB_No_Exist:  # 数据库没有
         To_Down = True
 
@@ -474,16 +497,40 @@ async def add_download_task(
         #     To_Down = True
     elif msg_db_status == Msg_db_Status.DB_Passed:  #标记为人为跳过
         node.download_status[message.id] = DownloadStatus.SkipDownload
-        return
+        return None
 
     if not To_Down:
         node.download_status[message.id] = DownloadStatus.SkipDownload
-        return
+        return None
+
+    # 加入队列前就标记为下载中 之后的等价文件不再重复下载 未加入队列时需 release
+    db_writer.reserve({**msg_dict, 'status': 2})
+    return msg_dict
+
 
+async def _enqueue_download_task(
+        message: pyrogram.types.Message,
+        node: TaskNode,
+        msg_dict: dict,
+):
+    """Queue a message accepted by `_classify_download_task`"""
     node.download_status[message.id] = DownloadStatus.Downloading
-    await queue.put((message, node))
-    msg_dict['status'] = 2  # 写入数据库 记录进入下载队列
-    db.insert_into_db(msg_dict)
+    chat_config = app.chat_download_config.get(node.chat_id)
+    try:
+        await queue.put(
+            (message, node),
+            size=msg_dict.get('media_size') or 0,
+            chat_id=node.chat_id,
+            priority=chat_config.priority if chat_config else 0,
+            interactive=node.bot is not None,  # 机器人发起的任务优先于后台扫描
+        )
+    except BaseException:
+        # 没有加入队列 撤销 _classify_download_task 的预留
+        db_writer.release(msg_dict.get('chat_id'), msg_dict.get('message_id'))
+        raise
+    update_chat_queue_stat(queue.get_stats())
+    msg_dict['status'] = 2  # 写入数据库 记录进入下载队列 不等待提交
+    db_writer.put(msg_dict)
 
     if not msg_dict.get('chat_username') or msg_dict.get('chat_username') == '':
         show_chat_username = str(msg_dict.get('chat_id'))
@@ -495,6 +542,17 @@ async def add_download_task(
     return True
 
 
+async def add_download_task(
+        message: pyrogram.types.Message,
+        node: TaskNode,
+):
+    msg_dict = await _classify_download_task(message, node)
+    if msg_dict is None:
+        return False
+
+    return await _enqueue_download_task(message, node, msg_dict)
+
+
 async def save_msg_to_file(
     app, chat_id: Union[int, str], message: pyrogram.types.Message
 ):
@@ -568,28 +626,61 @@ async def download_task(
     )
 
 
-def save_chunk_to_file(chunk, file_path, file_name):
-    try:
-        # 创建目录
-        os.makedirs(file_path, exist_ok=True)
-
-        # 文件路径
-        file_url = os.path.join(file_path, file_name)
-
-        # 确保文件为空或不存在
-        with open(file_url, "wb") as f:
-            f.truncate(0)  # 清空文件
-            f.write(chunk)
-
-        # 检查文件大小是否正确
-        if os.path.getsize(file_url) == len(chunk):
-            return True
-        else:
-            return False
-
-    except Exception as e:
-        print(f"Error occurred: {e}")
-        return False
+async def _download_segment(
+        client: pyrogram.client.Client,
+        message: pyrogram.types.Message,
+        writer: ChunkWriter,
+        pending_ranges: list,
+        progress: dict,
+        media_size: int,
+        message_id: int,
+        ui_file_name: str,
+        task_start_time: float,
+        node: TaskNode,
+        dc_id: int,
+):
+    """Download pending chunk ranges of one file until none is left"""
+    while pending_ranges:
+        start_id, end_id = pending_ranges.pop(0)
+        chunk_it = start_id
+        await chunk_pacer.acquire(dc_id)
+        async for chunk in client.stream_media(message, offset=start_id, limit=end_id - start_id + 1):
+            await download_limiter.consume(len(chunk), node.chat_id)  # 超出限速时暂缓读取下一块
+            await writer.put(chunk_it, chunk)  # 写入队列满时才等待
+            chunk_it += 1
+            chunk_pacer.on_success(dc_id)
+            progress["down_byte"] = min(media_size, progress["down_byte"] + len(chunk))
+            await update_download_status(progress["down_byte"], media_size, message_id, ui_file_name,
+                                         task_start_time,
+                                         node, client)
+            if chunk_it <= end_id:  # 按数据中心的速率领取下一个块的请求
+                await chunk_pacer.acquire(dc_id)
+
+
+async def _download_small_file(
+        client: pyrogram.client.Client,
+        message: pyrogram.types.Message,
+        part_file: str,
+        media_size: int,
+        message_id: int,
+        ui_file_name: str,
+        task_start_time: float,
+        node: TaskNode,
+        dc_id: int,
+):
+    """Download a file in one stream, FloodWait and BadRequest are raised"""
+    down_byte = 0
+    with open(part_file, "wb") as f:
+        await chunk_pacer.acquire(dc_id)
+        async for chunk in client.stream_media(message):
+            await download_limiter.consume(len(chunk), node.chat_id)  # 超出限速时暂缓读取下一块
+            await app.loop.run_in_executor(app.executor, f.write, chunk)
+            chunk_pacer.on_success(dc_id)
+            down_byte = min(media_size, down_byte + len(chunk))
+            await update_download_status(down_byte, media_size, message_id, ui_file_name,
+                                         task_start_time, node, client)
+            if down_byte < media_size:  # 按数据中心的速率领取下一个块的请求
+                await chunk_pacer.acquire(dc_id)
 
 
 @record_download_status
@@ -606,7 +697,7 @@ async def download_media(
                                      time.time(),
                                      node, client)
         media_dict['status'] = 1
-        db.insert_into_db(media_dict)
+        await db_writer.write(media_dict)
 
         return DownloadStatus.SuccessDownload, media_dict.get('filename')
 
@@ -626,6 +717,7 @@ async def download_media(
         show_chat_username = str(media_dict.get('chat_id'))
 
     ui_file_name = file_name.split('/')[-1]
+    dc_id = _get_media_dc_id(message)
 
     if app.hide_file_name:
         ui_file_name = f"****{os.path.splitext(file_name.split('/')[0])}"
@@ -634,27 +726,18 @@ async def download_media(
         try:
             temp_file_path = os.path.dirname(temp_file_name)
             chunk_dir = f"{temp_file_path}/{message_id}_chunk"
+            part_file = os.path.join(temp_file_path, f"{message_id}.part")
+            storage = None
 
             if media_size < 1024 * 1024 * CHUNK_MIN:  # 小于CHUNK_MIN M的就用单一文件下载
-                chunk_count = 1
-                chunk_filename = os.path.join(chunk_dir, "00000000")
-                if os.path.exists(chunk_dir):
+                if os.path.exists(chunk_dir):  # 旧版分块目录 小文件直接重新下载
                     shutil.rmtree(chunk_dir)
 
-                os.makedirs(chunk_dir, exist_ok=True)
+                os.makedirs(temp_file_path, exist_ok=True)
                 try:
-                    await client.download_media(
-                        message,
-                        file_name=chunk_filename,
-                        progress=update_download_status,
-                        progress_args=(
-                            message_id,
-                            ui_file_name,
-                            task_start_time,
-                            node,
-                            client,
-                        ),
-                    )
+                    # 与分块下载一样直接读取 FloodWait 由这里交给 chunk_pacer
+                    await _download_small_file(client, message, part_file, media_size, message_id,
+                                               ui_file_name, task_start_time, node, dc_id)
                 except pyrogram.errors.exceptions.bad_request_400.BadRequest:
                     logger.warning(
                         f"[{show_chat_username}]{message_id}: {_t('file reference expired, refetching')}..."
@@ -668,40 +751,52 @@ async def download_media(
                             f"{_t('file reference expired for 3 retries, download skipped.')}"
                         )
                 except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
+                    chunk_pacer.on_flood_wait(dc_id, wait_err.value)
                     await asyncio.sleep(wait_err.value)
                     logger.warning(f"[{show_chat_username}]: FlowWait ", message_id, wait_err.value)
                     _check_timeout(retry, message_id)
                 except Exception as e:
                     logger.exception(f"{e}")
                     pass
-            else:  #大文件 采用分快下载模式
-                if not os.path.exists(chunk_dir):
-                    os.makedirs(chunk_dir, exist_ok=True)
-                else:
-                    temp_file = os.path.join(chunk_dir, '00000000.temp')
-                    temp_file_end = os.path.join(chunk_dir, '00000000')
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                    if os.path.exists(temp_file_end) and os.path.getsize(temp_file_end) > 1024 * 1024:
-                        os.remove(temp_file_end)
-                chunk_count = int(media_size / 1024 / 1024) + 1
-                chunks_to_down = find_missing_files(chunk_dir, chunk_count)
-                if chunks_to_down and len(chunks_to_down) >= 1:  # 至少有一批
-                    for start_id, end_id in chunks_to_down:  # 遍历缺失的文件批次
-                        down_byte = int(start_id) * 1024 * 1024
-                        chunk_it = start_id
-                        try:
-                            async for chunk in client.stream_media(message, offset=start_id,
-                                                                   limit=end_id - start_id + 1):
-                                chunk_filename = f"{str(int(chunk_it)).zfill(8)}"
-                                chunk_it += 1
-                                down_byte += len(chunk)
-                                save_chunk_to_file(chunk, chunk_dir, chunk_filename)
-                                await update_download_status(down_byte, media_size, message_id, ui_file_name,
-                                                             task_start_time,
-                                                             node, client)
-                                await asyncio.sleep(RETRY_TIME_OUT)
-                        except pyrogram.errors.exceptions.bad_request_400.BadRequest:
+                download_finished = _is_exist(part_file) and os.path.getsize(part_file) == media_size
+            else:  #大文件 采用分快下载模式 预分配文件后按偏移写入
+                storage = DownloadStorage(part_file, media_size, hash_algorithm=app.content_hash_algorithm)
+                # 打开预分配文件和写入都放到线程池 磁盘卡顿不阻塞事件循环
+                await app.loop.run_in_executor(app.executor, storage.open)
+                writer = ChunkWriter(storage, app.max_pending_write_chunks)
+                try:
+                    if os.path.isdir(chunk_dir):  # 兼容旧版分块目录 导入已下载的块
+                        await app.loop.run_in_executor(app.executor, storage.import_chunk_dir, chunk_dir)
+                    chunks_to_down = storage.missing_ranges()
+                    if chunks_to_down and len(chunks_to_down) >= 1:  # 至少有一批
+                        # 多段并发下载 每段领取一批缺失的块
+                        segments = app.get_download_segments(_type)
+                        chunks_to_down = split_missing_ranges(chunks_to_down, segments)
+                        down_progress = {"down_byte": storage.downloaded_bytes()}
+                        results = await asyncio.gather(
+                            *[
+                                _download_segment(client, message, writer, chunks_to_down, down_progress,
+                                                  media_size, message_id, ui_file_name, task_start_time, node,
+                                                  dc_id)
+                                for _ in range(min(segments, len(chunks_to_down)))
+                            ],
+                            return_exceptions=True,
+                        )
+                        errors = [result for result in results if isinstance(result, Exception)]
+                        try:  # 等待写入队列落盘
+                            await writer.close()
+                        except Exception as err:
+                            errors.append(err)
+                        flood_waits = [
+                            err for err in errors if isinstance(err, pyrogram.errors.exceptions.flood_420.FloodWait)
+                        ]
+                        if flood_waits:
+                            wait_err = max(flood_waits, key=lambda err: err.value)
+                            # 降低该数据中心的速率 并在等待结束前暂停其请求
+                            chunk_pacer.on_flood_wait(dc_id, wait_err.value)
+                            logger.warning(f"[{show_chat_username}]: FlowWait ", message_id, wait_err.value)
+                            _check_timeout(retry, message_id)
+                        elif any(isinstance(err, pyrogram.errors.exceptions.bad_request_400.BadRequest) for err in errors):
                             logger.warning(
                                 f"[{show_chat_username}]{message_id}: {_t('file reference expired, refetching')}..."
                             )
@@ -713,35 +808,53 @@ async def download_media(
                                     f"[{show_chat_username}]{message_id}]: "
                                     f"{_t('file reference expired for 3 retries, download skipped.')}"
                                 )
-                        except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
-                            await asyncio.sleep(wait_err.value)
-                            logger.warning(f"[{show_chat_username}]: FlowWait ", message_id, wait_err.value)
-                            _check_timeout(retry, message_id)
-                        except Exception as e:
-                            logger.exception(f"{e}")
-                            pass
+                        for err in errors:
+                            if not isinstance(err, (pyrogram.errors.exceptions.flood_420.FloodWait,
+                                                    pyrogram.errors.exceptions.bad_request_400.BadRequest)):
+                                logger.opt(exception=err).error(f"{err}")
+                finally:
+                    try:
+                        await writer.close()
+                    except Exception:
+                        pass  # 写入错误已在上面记录
+                    storage.close()
+                download_finished = check_download_finish(
+                    media_size, part_file, ui_file_name, storage.chunk_size
+                )
 
             #判断一下是否下载完成
-            if chunk_dir and os.path.exists(chunk_dir):  #chunk_dir存在
-                if check_download_finish(media_size, chunk_dir, ui_file_name, chunk_count):  # 大小数量一致
-                    try:
-                        if merge_chunkfile(folder_path=chunk_dir, output_file=file_name, chunk_count=chunk_count,
-                                           file_size=media_size, method='shutil'):
-                            # await asyncio.sleep(RETRY_TIME_OUT)
-                            if _is_exist(file_name) and os.path.getsize(file_name) == media_size:
-                                shutil.rmtree(chunk_dir)
+            if download_finished:
+                try:
+                    # 校验并移动文件在独立的线程池中完成 不阻塞其他下载
+                    content_hash = await file_finalizer.submit(
+                        part_file, media_size, file_name, storage, app.content_hash_algorithm
+                    )
+                    media_dict['content_hash'] = content_hash
+                    candidates = await app.loop.run_in_executor(
+                        app.executor, find_duplicate_candidates, file_name
+                    )
+                    if candidates:
+                        # 同名副本用数据库中的摘要比较 摘要不同的不再读取
+                        stored_hashes = await async_db.get_hashes_by_path(candidates)
+                        kept_file = await app.loop.run_in_executor(
+                            app.executor, manage_duplicate_file, file_name, content_hash, stored_hashes
+                        )
+                        if kept_file != file_name:
+                            logger.info(f"{file_name} {_t('has the same content as')} {kept_file}")
+                            file_name = kept_file
+                            media_dict['file_fullname'] = kept_file
+                    same_file = await async_db.get_path_by_hash(content_hash, file_name)
+                    if same_file:  # 内容完全相同的文件已存在
+                        logger.info(f"{file_name} {_t('has the same content as')} {same_file}")
 
-                            media_dict['status'] = 1
-                            db.insert_into_db(media_dict)
+                    media_dict['status'] = 1
+                    await db_writer.write(media_dict)  # 提交后才算完成
 
-                            logger.success(f"完成下载{file_name}...剩余：{queue.qsize()}")
+                    logger.success(f"完成下载{file_name}...剩余：{queue.qsize()}")
 
-                            return DownloadStatus.SuccessDownload, file_name
-                    except Exception as e:
-                        logger.exception(f"Failed to merge files: {e}")
-                        pass
-            else:
-                pass
+                    return DownloadStatus.SuccessDownload, file_name
+                except Exception as e:
+                    logger.exception(f"Failed to move downloaded file: {e}")
         except pyrogram.errors.exceptions.bad_request_400.BadRequest:
             logger.warning(
                 f"[{show_chat_username}]{message_id}: {_t('file reference expired, refetching')}..."
@@ -808,10 +921,18 @@ def _check_config() -> bool:
 async def worker(client: pyrogram.client.Client):
     """Work for download task"""
     while app.is_running:
+        if worker_autoscaler.should_retire():
+            break
+
         try:
-            item = await queue.get()
-            message = item[0]
-            node: TaskNode = item[1]
+            entry = await queue.get_entry()
+        except Exception as e:
+            logger.exception(f"{e}")
+            continue
+
+        try:
+            message = entry.item[0]
+            node: TaskNode = entry.item[1]
 
             if node.is_stop_transmission:
                 continue
@@ -822,6 +943,9 @@ async def worker(client: pyrogram.client.Client):
                 await download_task(client, message, node)
         except Exception as e:
             logger.exception(f"{e}")
+        finally:
+            await queue.task_done(entry)
+            update_chat_queue_stat(queue.get_stats())
 
 
 def need_skip_message(message, chat_download_config):
@@ -846,6 +970,31 @@ def need_skip_message(message, chat_download_config):
         logger.exception(f"{e}")
 
 
+async def _get_retry_messages(
+        client: pyrogram.Client, real_chat_id, message_ids: list
+) -> List[ScanMessage]:
+    """Messages to retry, from the message cache if there, the others from Telegram"""
+    if not app.message_cache:
+        return await get_messages_v2(client, real_chat_id, message_ids)
+
+    peer_id = get_input_peer_id(await client.resolve_peer(real_chat_id))
+    cached = await async_db.run(message_cache_db.get_messages, peer_id, message_ids)
+    messages = [load_message(client, data) for data in cached.values()]
+    missing = [message_id for message_id in message_ids if message_id not in cached]
+    if missing:
+        messages += await get_messages_v2(client, real_chat_id, missing)
+    if cached:
+        logger.info(f"[{real_chat_id}]{_t('Messages read from cache')}: {len(cached)}/{len(message_ids)}")
+    return sorted(messages, key=lambda message: message.id)
+
+
+def _cache_messages(rows: list):
+    """Save scanned messages to the message cache"""
+    if app.message_cache and rows:
+        # 由写入线程写入 不阻塞事件循环
+        db_writer.call(message_cache_db.put_messages, list(rows))
+
+
 async def download_chat_task(
         client: pyrogram.Client,
         chat_download_config: ChatDownloadConfig,
@@ -863,64 +1012,152 @@ async def download_chat_task(
         if chat_download_config.ids_to_retry:
             retry_ids = list(chat_download_config.ids_to_retry)
             logger.info(f"[{node.chat_id}]{_t('Downloading files failed during last run')}...")
-            downloading_messages = Optional[AsyncGenerator["types.Message", None]]
             batch_size = 200
             for i in range(0, len(retry_ids), batch_size):
                 batch_files = retry_ids[i:i + batch_size]
+                downloading_messages = []
                 try:
-                    downloading_messages = await client.get_messages(  # type: ignore
-                        chat_id=real_chat_id, message_ids=batch_files
+                    downloading_messages = await _get_retry_messages(
+                        client, real_chat_id, batch_files
                     )
                 except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
-                    await asyncio.sleep(wait_err.value)
+                    history_backoff.on_flood_wait(wait_err.value)
+                    await history_backoff.wait()
                 except Exception as e:
                     logger.exception(f"{e}")
 
                 if downloading_messages and len(downloading_messages) > 0:
+                    cache_rows = []
                     try:
                         for message in downloading_messages:
                             if need_skip_message(message, chat_download_config):  # 不在下载范围内
                                 node.download_status[message.id] = DownloadStatus.SkipDownload
-                                msg = db.getMsg(node.chat_id, message.id, 2)
-                                msg.status = 5
-                                msg.save()
-                                logger.info(f"[{node.chat_id}]{msg.filename}文件已被频道删除，跳过")
+                                msg = await async_db.get_msg(node.chat_id, message.id, 2)
+                                if msg:
+                                    # 与其他记录一样由 db_writer 写入 提交后更新 status_index
+                                    db_writer.put({**msg.to_media_dict(), 'status': 5})
+                                    logger.info(f"[{node.chat_id}]{msg.filename}文件已被频道删除，跳过")
                                 continue
                             else:
-                                await add_download_task(message, node)
+                                full_message = await message.parse()
+                                cache_rows.append(message.to_cache(full_message))
+                                await add_download_task(full_message, node)
 
                         await asyncio.sleep(RETRY_TIME_OUT)
                     except pyrogram.errors.exceptions.flood_420.FloodWait as wait_err:
                         await asyncio.sleep(wait_err.value)
                     except Exception as e:
                         logger.exception(f"{e}")
+                    finally:
+                        _cache_messages(cache_rows)
 
                 await asyncio.sleep(RETRY_TIME_OUT)
 
         """Download all task"""
-        messages_iter = get_chat_history_v2(
-            client,
-            real_chat_id,
-            limit=node.limit,
-            max_id=node.end_offset_id,
-            offset_id=chat_download_config.last_read_message_id,
-            reverse=True,
-        )
-        message_line = tqdm(messages_iter)
-
-        async for message in message_line:  # type: ignore
-
-            if message.chat.username:
-                message_line.set_description("[%s]" % f"{message.chat.username}][{node.chat_id}")
-            else:
-                message_line.set_description("[%s]" % f"{node.chat_id}")
-
+        messages_iter = None
+        tracker = None
+        # 过滤条件只接受某类媒体时 由服务端筛选 不再读取全部历史消息
+        search_filter = get_search_filter(app.get_scan_media_types(chat_download_config))
+        if search_filter is not None:
+            logger.info(f"[{node.chat_id}]{_t('Searching history for')} {search_filter.QUALNAME}")
+        if app.scan_partitions > 1 and not node.limit:
+            # 大频道按消息id分段同时扫描 请求速率由 history_backoff 统一控制
+            top_id = node.end_offset_id or await get_top_message_id(
+                client, real_chat_id, backoff=history_backoff
+            )
+            ranges = split_id_range(
+                chat_download_config.last_read_message_id + 1,
+                top_id,
+                app.scan_partitions,
+                app.scan_partition_min_messages,
+            )
+            if len(ranges) > 1:
+                tracker = ScanRangeTracker(ranges)
+                node.scan_tracker = tracker
+                logger.info(f"[{node.chat_id}]{_t('Scanning in ranges')}: {ranges}")
+                messages_iter = get_chat_history_parallel(
+                    client,
+                    real_chat_id,
+                    ranges,
+                    ordered=app.scan_partition_ordered,
+                    buffer=app.scan_prefetch_pages * HISTORY_PAGE_SIZE,
+                    backoff=history_backoff,
+                    read_ahead=app.history_read_ahead_pages,
+                    tracker=tracker,
+                    search_filter=search_filter,
+                    lightweight=app.history_fast_decode,
+                )
 
+        if messages_iter is None:
+            messages_iter = get_chat_history_v2(
+                client,
+                real_chat_id,
+                limit=node.limit,
+                max_id=node.end_offset_id,
+                offset_id=chat_download_config.last_read_message_id,
+                reverse=True,
+                backoff=history_backoff,
+                read_ahead=app.history_read_ahead_pages,
+                search_filter=search_filter,
+                lightweight=app.history_fast_decode,
+            )
+            # 单段扫描按id升序读取 同样只记录连续处理完的位置
+            start_id = chat_download_config.last_read_message_id + 1
+            tracker = ScanRangeTracker([(start_id, max(start_id, node.end_offset_id or 0))])
+            node.scan_tracker = tracker
+            messages_iter = track_history(messages_iter, tracker)
+        start_scan_progress(node.chat_id)
+
+        def message_done(message):
+            tracker.on_done(message.id)
+
+        # 通过过滤的消息存入缓存 重启后重试时不必再请求
+        cache_rows = []
+
+        # 翻页、过滤、数据库检查、加入队列分阶段并行 队列满时仍继续翻页
+        async def filter_message(message):
+            update_scan_progress(node.chat_id, message.id)
             if need_skip_message(message, chat_download_config):  # 不在下载范围内
                 node.download_status[message.id] = DownloadStatus.SkipDownload
-                continue
-            else:
-                await add_download_task(message, node)
+                message_done(message)
+                return None
+            if isinstance(message, ScanMessage):
+                # 只有通过过滤的消息才完整解析
+                scan_message, message = message, await message.parse()
+                if app.message_cache:
+                    cache_rows.append(scan_message.to_cache(message))
+                    if len(cache_rows) >= HISTORY_PAGE_SIZE:
+                        _cache_messages(cache_rows)
+                        cache_rows.clear()
+            return message
+
+        # 已预留 尚未交给 enqueue_message 的记录 扫描中止时撤销
+        reserved = {}
+
+        async def classify_message(message):
+            msg_dict = await _classify_download_task(message, node)
+            if not msg_dict:
+                message_done(message)
+                return None
+            reserved[message.id] = msg_dict
+            return message, msg_dict
+
+        async def enqueue_message(item):
+            reserved.pop(item[0].id, None)
+            await _enqueue_download_task(item[0], node, item[1])
+            message_done(item[0])
+
+        try:
+            await ScanPipeline(
+                messages_iter,
+                [filter_message, classify_message, enqueue_message],
+                prefetch=app.scan_prefetch_pages * HISTORY_PAGE_SIZE,
+            ).run()
+        finally:
+            finish_scan_progress(node.chat_id)
+            _cache_messages(cache_rows)
+            for msg_dict in reserved.values():
+                db_writer.release(msg_dict.get('chat_id'), msg_dict.get('message_id'))
 
         chat_download_config.need_check = True
         chat_download_config.total_task = node.total_task
@@ -932,20 +1169,46 @@ async def download_chat_task(
         logger.exception(f"{e}")
 
 
+async def _report_scan_progress():
+    """Log the progress of the running history scans"""
+    while True:
+        await asyncio.sleep(SCAN_REPORT_INTERVAL)
+        for chat_id, progress in list(get_scan_progress().items()):
+            if progress["finished"]:
+                continue
+            speed = progress["scanned"] / max(time.time() - progress["start_time"], 1)
+            logger.info(
+                f"[{chat_id}]{_t('scanned')} {progress['scanned']} "
+                f"({speed:.1f}/s), {_t('at message')} {progress['last_message_id']}"
+            )
+
+
 async def download_all_chat(client: pyrogram.Client):
     """Download All chat"""
     start_time = time.time()
     logger.info(f"开始读取全部Chat...")
-    for key, value in app.chat_download_config.items():
-        value.node = TaskNode(chat_id=key)
-        try:
-            await download_chat_task(client, value, value.node)
-        except Exception as e:
-            logger.warning(f"Download {key} error: {e}")
-        finally:
-            value.need_check = True
-            app.update_config()
-            logger.info(f"{_t('update config')}......")
+    # 同时扫描 max_scan_chat_task 个频道 FloodWait 由 history_backoff 共享
+    semaphore = asyncio.Semaphore(max(1, app.max_scan_chat_task))
+
+    async def scan_chat(key, value):
+        async with semaphore:
+            value.node = TaskNode(chat_id=key)
+            try:
+                await download_chat_task(client, value, value.node)
+            except Exception as e:
+                logger.warning(f"Download {key} error: {e}")
+            finally:
+                value.need_check = True
+                app.update_config()
+                logger.info(f"[{key}]{_t('update config')}......")
+
+    reporter = asyncio.ensure_future(_report_scan_progress())
+    try:
+        await asyncio.gather(
+            *[scan_chat(key, value) for key, value in list(app.chat_download_config.items())]
+        )
+    finally:
+        reporter.cancel()
 
     logger.info(f"读取全部Chat完毕...")
     while queue.qsize() >0:
@@ -998,7 +1261,11 @@ async def stop_server(client: pyrogram.Client):
 
 def main():
     """Main function of the downloader."""
-    tasks = []
+    # 旧数据库原地升级 补列 建索引 建缓存表
+    # 升级失败时不启动 写入依赖新表结构 (唯一索引 新增列)
+    if not migrate_schema():
+        logger.error("Database upgrade failed. Exiting.")
+        return
     if app.proxies:
         proxy = random.choice(app.proxies)
     client = HookClient(
@@ -1008,20 +1275,47 @@ def main():
         proxy= proxy,
         workdir=app.session_file_path,
         start_timeout=app.start_timeout,
+        media_sessions_per_dc=app.media_sessions_per_dc,
+        media_session_strategy=app.media_session_strategy,
     )
     try:
         app.pre_run()
+        if app.message_cache:
+            # 在写入线程中清理 不推迟启动
+            db_writer.call(
+                message_cache_db.evict, app.message_cache_max_age_days, app.message_cache_max_rows
+            ).add_done_callback(
+                lambda future: logger.info(f"{_t('Message cache evicted')}: {future.result()}")
+            )
         init_web(app)
 
         set_max_concurrent_transmissions(client, app.max_concurrent_transmissions)
+        chunk_pacer.configure(app.initial_chunk_rate, app.max_chunk_rate)
+        file_finalizer.set_max_task(app.max_finalize_task)
+        db_writer.configure(app.db_write_batch_size, app.db_write_flush_interval / 1000)
+        db_writer.start()
+        set_db_writer(db_writer)
+        if not app.db_status_index:
+            async_db.status_index = None
+        history_backoff.set_rate(app.history_requests_per_second)
+        queue.set_policy(create_policy(app.download_queue_policy, app.download_queue_aging))
+        download_limiter.configure(app.download_bandwidth_limit, app.bandwidth_schedule)
+        upload_limiter.configure(app.upload_bandwidth_limit, app.bandwidth_schedule)
+        for key, value in app.chat_download_config.items():
+            download_limiter.configure_chat(key, value.download_bandwidth_limit, value.bandwidth_schedule)
+            upload_limiter.configure_chat(key, value.upload_bandwidth_limit, value.bandwidth_schedule)
+        if isinstance(queue.policy, FairSharePolicy):
+            for key, value in app.chat_download_config.items():
+                queue.policy.set_chat_share(key, value.weight, value.max_in_flight)
 
         app.loop.run_until_complete(start_server(client))
         logger.success(_t("Successfully started (Press Ctrl+C to stop)"))
 
         app.loop.create_task(download_all_chat(client))
-        for _ in range(app.max_download_task):
-            task = app.loop.create_task(worker(client))
-            tasks.append(task)
+        worker_autoscaler.configure(
+            app.min_download_task, app.max_download_task, app.download_task_autoscale_interval
+        )
+        worker_autoscaler.start(app.loop, lambda: worker(client))
 
         if app.bot_token:
             app.loop.run_until_complete(
@@ -1041,8 +1335,10 @@ def main():
         if app.bot_token:
             app.loop.run_until_complete(stop_download_bot())
         app.loop.run_until_complete(stop_server(client))
-        for task in tasks:
-            task.cancel()
+        worker_autoscaler.stop()
+        file_finalizer.shutdown()
+        db_writer.stop()
+        async_db.shutdown()
         logger.info(_t("Stopped!"))
         logger.info(f"{_t('update config')}......")
         app.update_config()
@@ -8,7 +8,7 @@ from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional, Union
+from typing import List, Optional, Set, Union
 import collections
 from loguru import logger
 from ruamel import yaml
@@ -16,6 +16,7 @@ from ruamel.yaml.comments import CommentedSeq, CommentedMap
 from module.cloud_drive import CloudDrive, CloudDriveConfig
 from module.filter import Filter
 from module.language import Language, set_language
+from utils.content_hash import HASH_ALGORITHMS
 from utils.format import replace_date_time, validate_title
 from utils.meta_data import MetaData
 
@@ -179,6 +180,8 @@ class TaskNode:
         self.download_status: dict = {}
         self.upload_status: dict = {}
         self.upload_stat_dict: dict = {}
+        # 扫描时记录已连续处理到的消息id
+        self.scan_tracker = None
 
     def skip_msg_id(self, msg_id: int):
         """Skip if message id out of range"""
@@ -311,6 +314,12 @@ class ChatDownloadConfig:
         self.finish_task: int = 0
         self.need_check: bool = False
         self.upload_telegram_chat_id: Union[int, str] = None
+        self.priority: int = 0
+        self.weight: float = 1.0
+        self.max_in_flight: int = 0
+        self.download_bandwidth_limit = 0
+        self.upload_bandwidth_limit = 0
+        self.bandwidth_schedule: list = []
         self.node: TaskNode = TaskNode(0)
 
 
@@ -404,6 +413,37 @@ class Application:
         self.web_host: str = "0.0.0.0"
         self.web_port: int = 5000
         self.max_download_task: int = 5
+        self.min_download_task: int = 5
+        self.download_task_autoscale_interval: float = 10.0
+        self.scan_prefetch_pages: int = 2
+        self.max_scan_chat_task: int = 3
+        self.history_read_ahead_pages: int = 1
+        self.scan_partitions: int = 1
+        self.scan_partition_min_messages: int = 10000
+        self.scan_partition_ordered: bool = False
+        self.history_requests_per_second: float = 0.0
+        self.history_search_filter: bool = True
+        self.history_fast_decode: bool = True
+        self.message_cache: bool = True
+        self.message_cache_max_age_days: float = 30.0
+        self.message_cache_max_rows: int = 500000
+        self.db_write_batch_size: int = 200
+        self.db_write_flush_interval: float = 200.0
+        self.db_status_index: bool = True
+        self.download_segments: dict = {}
+        self.max_download_segments: int = 4
+        self.initial_chunk_rate: float = 1.0
+        self.max_chunk_rate: float = 20.0
+        self.media_sessions_per_dc: int = 1
+        self.media_session_strategy: str = "least_loaded"
+        self.max_pending_write_chunks: int = 8
+        self.max_finalize_task: int = 2
+        self.content_hash_algorithm: str = "crc32"
+        self.download_queue_policy: str = "fifo"
+        self.download_queue_aging: float = 1.0
+        self.download_bandwidth_limit = 0
+        self.upload_bandwidth_limit = 0
+        self.bandwidth_schedule: list = []
         self.language = Language.EN
         self.after_upload_telegram_delete: bool = True
         self.web_login_secret: str = ""
@@ -516,6 +556,99 @@ class Application:
         self.max_download_task = _config.get(
             "max_download_task", self.max_download_task
         )
+        # 未配置下限时 工作协程数量固定为 max_download_task
+        self.min_download_task = get_config(
+            _config, "min_download_task", self.max_download_task, int
+        )
+        self.download_task_autoscale_interval = float(
+            _config.get(
+                "download_task_autoscale_interval", self.download_task_autoscale_interval
+            )
+        )
+        self.scan_prefetch_pages = get_config(
+            _config, "scan_prefetch_pages", self.scan_prefetch_pages, int
+        )
+        self.max_scan_chat_task = get_config(
+            _config, "max_scan_chat_task", self.max_scan_chat_task, int
+        )
+        self.history_read_ahead_pages = get_config(
+            _config, "history_read_ahead_pages", self.history_read_ahead_pages, int
+        )
+        self.scan_partitions = get_config(
+            _config, "scan_partitions", self.scan_partitions, int
+        )
+        self.scan_partition_min_messages = get_config(
+            _config, "scan_partition_min_messages", self.scan_partition_min_messages, int
+        )
+        self.scan_partition_ordered = get_config(
+            _config, "scan_partition_ordered", self.scan_partition_ordered, bool
+        )
+        self.history_requests_per_second = float(
+            _config.get("history_requests_per_second", self.history_requests_per_second)
+        )
+        self.history_search_filter = get_config(
+            _config, "history_search_filter", self.history_search_filter, bool
+        )
+        self.history_fast_decode = get_config(
+            _config, "history_fast_decode", self.history_fast_decode, bool
+        )
+        self.message_cache = get_config(_config, "message_cache", self.message_cache, bool)
+        self.message_cache_max_age_days = float(
+            _config.get("message_cache_max_age_days", self.message_cache_max_age_days)
+        )
+        self.message_cache_max_rows = get_config(
+            _config, "message_cache_max_rows", self.message_cache_max_rows, int
+        )
+        self.db_write_batch_size = get_config(
+            _config, "db_write_batch_size", self.db_write_batch_size, int
+        )
+        self.db_write_flush_interval = float(
+            _config.get("db_write_flush_interval", self.db_write_flush_interval)
+        )
+        self.db_status_index = get_config(_config, "db_status_index", self.db_status_index, bool)
+
+        self.download_segments = get_config(
+            _config, "download_segments", self.download_segments, dict
+        )
+        self.max_download_segments = get_config(
+            _config, "max_download_segments", self.max_download_segments, int
+        )
+        self.initial_chunk_rate = float(
+            _config.get("initial_chunk_rate", self.initial_chunk_rate)
+        )
+        self.max_chunk_rate = float(_config.get("max_chunk_rate", self.max_chunk_rate))
+        self.media_sessions_per_dc = get_config(
+            _config, "media_sessions_per_dc", self.media_sessions_per_dc, int
+        )
+        self.media_session_strategy = get_config(
+            _config, "media_session_strategy", self.media_session_strategy, str
+        )
+        self.max_pending_write_chunks = get_config(
+            _config, "max_pending_write_chunks", self.max_pending_write_chunks, int
+        )
+        self.max_finalize_task = get_config(
+            _config, "max_finalize_task", self.max_finalize_task, int
+        )
+        self.content_hash_algorithm = _config.get(
+            "content_hash_algorithm", self.content_hash_algorithm
+        )
+        if self.content_hash_algorithm not in HASH_ALGORITHMS:
+            self.content_hash_algorithm = None
+        self.download_queue_policy = get_config(
+            _config, "download_queue_policy", self.download_queue_policy, str
+        )
+        self.download_queue_aging = float(
+            _config.get("download_queue_aging", self.download_queue_aging)
+        )
+        self.download_bandwidth_limit = _config.get(
+            "download_bandwidth_limit", self.download_bandwidth_limit
+        )
+        self.upload_bandwidth_limit = _config.get(
+            "upload_bandwidth_limit", self.upload_bandwidth_limit
+        )
+        self.bandwidth_schedule = _config.get(
+            "bandwidth_schedule", self.bandwidth_schedule
+        ) or []
 
         self.max_concurrent_transmissions = self.max_download_task * 5
 
@@ -591,6 +724,18 @@ class Application:
                     self.chat_download_config[item["chat_id"]].download_filter = item.get("download_filter", "")
                     self.chat_download_config[item["chat_id"]].upload_telegram_chat_id = item.get("upload_telegram_chat_id", None)
                     self.chat_download_config[item["chat_id"]].group = item.get("group")
+                    self.chat_download_config[item["chat_id"]].priority = item.get("priority", 0)
+                    self.chat_download_config[item["chat_id"]].weight = float(item.get("weight", 1.0))
+                    self.chat_download_config[item["chat_id"]].max_in_flight = item.get("max_in_flight", 0)
+                    self.chat_download_config[item["chat_id"]].download_bandwidth_limit = item.get(
+                        "download_bandwidth_limit", 0
+                    )
+                    self.chat_download_config[item["chat_id"]].upload_bandwidth_limit = item.get(
+                        "upload_bandwidth_limit", 0
+                    )
+                    self.chat_download_config[item["chat_id"]].bandwidth_schedule = item.get(
+                        "bandwidth_schedule", []
+                    )
         elif _config.get("chat_id"):
             # Compatible with lower versions
             self._chat_id = _config["chat_id"]
@@ -727,6 +872,30 @@ class Application:
 
         return res
 
+    def get_download_segments(self, media_type: str) -> int:
+        """Get how many ranges of one large file are downloaded at once.
+
+        Parameters
+        ----------
+        media_type: str
+            see config.yaml media_types
+
+        Returns
+        -------
+        int
+            `download_segments` of the media type (or its `default`),
+            capped by `max_download_segments`
+        """
+        segments = self.download_segments.get(
+            media_type, self.download_segments.get("default", 1)
+        )
+        try:
+            segments = int(segments)
+        except (TypeError, ValueError):
+            segments = 1
+
+        return max(1, min(segments, self.max_download_segments))
+
     def get_file_name(
         self, message_id: int, file_name: Optional[str], caption: Optional[str]
     ) -> str:
@@ -806,6 +975,23 @@ class Application:
 
         return True
 
+    def get_scan_media_types(self, download_config: ChatDownloadConfig) -> Optional[Set[str]]:
+        """
+        Media types the download filter of the chat can accept.
+
+        Args:
+            download_config (ChatDownloadConfig): The download configuration object.
+
+        Returns:
+            Optional[Set[str]]: None if the whole history has to be read.
+        """
+        if not self.history_search_filter:
+            return None
+        # 扫描时只下载这几种媒体 见 need_skip_message
+        return self.download_filter.implied_media_types(
+            download_config.download_filter, ["audio", "document", "photo", "video"]
+        )
+
     # pylint: disable = R0912
     def update_config(self, immediate: bool = True):
         """update config
@@ -828,8 +1014,6 @@ class Application:
             max_try = 0
 
             for _idx, _value in value.node.download_status.items():
-                if _idx > max_try:
-                    max_try = _idx  # 记录最后一个下载id
                 if  DownloadStatus.SuccessDownload == _value or DownloadStatus.SkipDownload == _value: #成功或需要跳过的从老retry列表删除
                     if _idx in unfinished_ids:
                         unfinished_ids.remove(_idx)
@@ -839,6 +1023,10 @@ class Application:
 
             self.chat_download_config[key].ids_to_retry = list(unfinished_ids)
 
+            if value.node.scan_tracker is not None:
+                # 只记录连续处理完的最后一个id 之前的消息可能尚未处理
+                max_try = value.node.scan_tracker.watermark()
+
 
 
             if idx >= len(self.app_data.get("chat")):
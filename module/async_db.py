@@ -0,0 +1,181 @@
+"""Awaitable access to the download records"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from module.db_writer import DBWriter
+from module.sqlmodel import Downloaded, get_similar_records
+from module.status_index import StatusIndex
+
+
+class AsyncDB:
+    """Run `Downloaded` queries on a dedicated thread
+
+    Queries like `get_similar_files` take long enough on a big database
+    to stall every download when called from a coroutine. Here they run
+    on one thread with its own connection, in WAL mode reads do not wait
+    for `DBWriter`. `get_status` calls made in the same loop iteration
+    are answered by one `get_status_many` query per chat, or by
+    `status_index` without a query when it is set. `get_status` and
+    `get_similar_files` also look at the records of `writer` not
+    committed yet.
+    """
+
+    def __init__(
+        self, model: Downloaded = None, status_index: StatusIndex = None, writer: DBWriter = None
+    ):
+        self.model = model or Downloaded()
+        self.status_index = status_index
+        self.writer = writer
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Dict[int, Dict[int, List[asyncio.Future]]] = {}
+        self._flush_scheduled = False
+        self.request_count = 0
+        self.query_count = 0
+        self.index_hit_count = 0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Call `func` on the database thread"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db_reader")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    async def get_status_many(self, chat_id: int, message_ids: List[int]) -> Dict[int, int]:
+        """
+        Status of several messages of a chat.
+
+        Parameters
+        ----------
+        chat_id: int
+            Chat id
+
+        message_ids: List[int]
+            Message ids
+
+        Returns
+        -------
+        Dict[int, int]
+            Status by message id, 0 for messages without a record
+        """
+        self.query_count += 1
+        statuses = await self.run(self.model.get_status_many, chat_id, message_ids)
+        return {message_id: statuses.get(message_id, 0) for message_id in message_ids}
+
+    async def get_status(self, chat_id: int, message_id: int) -> int:
+        """Status of a message like `Downloaded.getStatus`, batched with concurrent calls"""
+        if self.writer is not None:
+            # 尚未提交的记录为准
+            status = self.writer.get_pending_status(chat_id, message_id)
+            if status is not None:
+                return status
+        if self.status_index is not None and chat_id:
+            try:
+                await self.status_index.load(chat_id, self._get_chat_statuses)
+            except Exception as e:
+                logger.error(
+                    f"[{e}].",
+                    exc_info=True,
+                )
+            status = self.status_index.get(chat_id, message_id)
+            if status is not None:
+                self.index_hit_count += 1
+                return status
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(chat_id, {}).setdefault(message_id, []).append(future)
+        self.request_count += 1
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_soon(self._flush)
+        return await future
+
+    async def _get_chat_statuses(self, chat_id: int) -> list:
+        return await self.run(self.model.get_chat_statuses, chat_id)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, {}
+        for chat_id, waiters in pending.items():
+            asyncio.ensure_future(self._resolve(chat_id, waiters))
+
+    async def _resolve(self, chat_id: int, waiters: Dict[int, List[asyncio.Future]]):
+        try:
+            statuses = await self.get_status_many(chat_id, list(waiters))
+        except Exception as e:
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for message_id, futures in waiters.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(statuses[message_id])
+
+    async def get_similar_files(
+        self, msg_dict: dict, similar_min: float, sizerange_min: float, status: list = None
+    ) -> Optional[list]:
+        """See `Downloaded.get_similar_files`, records not committed yet included"""
+        pending = self.writer.get_pending() if self.writer is not None else []
+        files = await self.run(
+            self.model.get_similar_files, msg_dict, similar_min, sizerange_min, status
+        )
+        if self.writer is None:
+            return files
+        # 查询期间提交的记录可能不在结果中 查询前后的未提交记录都要看
+        records = {}
+        for record in pending + self.writer.get_pending():
+            try:
+                records[(record['chat_id'], record['message_id'])] = Downloaded(
+                    **{field.name: value for field, value in Downloaded._media_row(record).items()}
+                )
+            except KeyError:
+                continue
+        found = {(file.chat_id, file.message_id) for file in files or []}
+        records = [record for key, record in records.items() if key not in found]
+        if not records:
+            return files
+        try:
+            similar = get_similar_records(msg_dict, records, similar_min, sizerange_min, status)
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return files
+        return (files or []) + similar if similar else files
+
+    async def get_path_by_hash(self, content_hash: str, exclude_path: str = None) -> Optional[str]:
+        """See `Downloaded.get_path_by_hash`"""
+        return await self.run(self.model.get_path_by_hash, content_hash, exclude_path)
+
+    async def get_hashes_by_path(self, file_paths: List[str]) -> Dict[str, str]:
+        """See `Downloaded.get_hashes_by_path`"""
+        return await self.run(self.model.get_hashes_by_path, file_paths)
+
+    async def get_msg(self, chat_id: int, message_id: int, status: int = 1) -> Optional[Downloaded]:
+        """See `Downloaded.getMsg`"""
+        return await self.run(self.model.getMsg, chat_id, message_id, status)
+
+    def get_stats(self) -> dict:
+        """Status requests, the queries answering them and the index hits"""
+        return {
+            "requests": self.request_count,
+            "queries": self.query_count,
+            "index_hits": self.index_hit_count,
+        }
+
+    def shutdown(self):
+        """Close the connection of the database thread and stop it"""
+        if self._executor is None:
+            return
+        self._executor.submit(Downloaded._meta.database.close).result()
+        self._executor.shutdown()
+        self._executor = None
@@ -0,0 +1,217 @@
+"""Throughput driven number of download workers"""
+
+import asyncio
+import time
+from typing import Callable, Coroutine, Optional, Set
+
+from loguru import logger
+
+from module.download_stat import get_flood_wait_count, get_transferred_bytes
+from utils.format import format_byte
+
+
+class WorkerAutoscaler:
+    """Add or retire download workers between `min_workers` and `max_workers`
+
+    Every `interval` seconds the throughput of the last interval, the
+    number of `FloodWait` and the queue depth are checked:
+
+    * a `FloodWait` retires a quarter of the workers
+    * a worker added in the last interval that did not raise the
+      throughput by `min_gain` is retired again, and no worker is added
+      for `hold_rounds` intervals
+    * an empty queue retires one worker
+    * more queued files than workers adds one worker
+
+    Workers retire themselves between two downloads, see `should_retire`.
+    """
+
+    # pylint: disable = R0902,R0913
+    def __init__(
+        self,
+        min_workers: int = 5,
+        max_workers: int = 5,
+        interval: float = 10.0,
+        min_gain: float = 0.05,
+        hold_rounds: int = 6,
+        get_queue_depth: Callable[[], int] = lambda: 0,
+        get_transferred: Callable[[], int] = lambda: get_transferred_bytes("download"),
+        get_flood_waits: Callable[[], int] = get_flood_wait_count,
+    ):
+        """
+        Parameters
+        ----------
+        min_workers: int
+            Workers kept at least, also the number started with
+
+        max_workers: int
+            Upper limit of the workers
+
+        interval: float
+            Seconds between two decisions
+
+        min_gain: float
+            Relative throughput gain a new worker has to bring
+
+        hold_rounds: int
+            Intervals without adding workers after a useless one
+
+        get_queue_depth: Callable[[], int]
+            Number of queued files
+
+        get_transferred: Callable[[], int]
+            Bytes downloaded since start
+
+        get_flood_waits: Callable[[], int]
+            FloodWait seen since start
+        """
+        self.get_queue_depth = get_queue_depth
+        self.get_transferred = get_transferred
+        self.get_flood_waits = get_flood_waits
+        self.min_gain = min_gain
+        self.hold_rounds = hold_rounds
+        self.configure(min_workers, max_workers, interval)
+        self.tasks: Set[asyncio.Task] = set()
+        self._live = 0
+        self._hold = 0
+        self._throughput_before_add: Optional[float] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._worker_factory: Optional[Callable[[], Coroutine]] = None
+
+    def configure(self, min_workers: int, max_workers: int, interval: float = None):
+        """Set the bounds, the target starts at the lower bound"""
+        self.max_workers = max(1, max_workers)
+        self.min_workers = max(1, min(min_workers, self.max_workers))
+        if interval is not None:
+            self.interval = max(1.0, interval)
+        self.target = self.min_workers
+
+    @property
+    def enabled(self) -> bool:
+        """If the number of workers may change"""
+        return self.min_workers < self.max_workers
+
+    def _spawn(self, loop: asyncio.AbstractEventLoop, worker_factory: Callable[[], Coroutine]):
+        task = loop.create_task(worker_factory())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        self._live += 1
+
+    def start(self, loop: asyncio.AbstractEventLoop, worker_factory: Callable[[], Coroutine]):
+        """
+        Start `min_workers` workers, and the monitor if enabled.
+
+        Parameters
+        ----------
+        loop: asyncio.AbstractEventLoop
+            Loop running the workers
+
+        worker_factory: Callable[[], Coroutine]
+            Creates the coroutine of one worker, which calls
+            `should_retire` before taking the next file
+        """
+        self._worker_factory = worker_factory
+        for _ in range(self.target):
+            self._spawn(loop, worker_factory)
+        if self.enabled:
+            self._monitor = loop.create_task(self._run(loop))
+
+    def should_retire(self) -> bool:
+        """Called by a worker between downloads, True if it has to stop"""
+        if self._live > self.target:
+            self._live -= 1
+            return True
+        return False
+
+    def decide(self, throughput: float, flood_waits: int, queue_depth: int) -> Optional[str]:
+        """
+        Update the target from the metrics of the last interval.
+
+        Parameters
+        ----------
+        throughput: float
+            Bytes per second downloaded in the interval
+
+        flood_waits: int
+            FloodWait seen in the interval
+
+        queue_depth: int
+            Files waiting in the queue
+
+        Returns
+        -------
+        Optional[str]
+            Reason of the change, None if the target is kept
+        """
+        throughput_before_add = self._throughput_before_add
+        self._throughput_before_add = None
+        if self._hold > 0:
+            self._hold -= 1
+
+        if flood_waits > 0 and self.target > self.min_workers:
+            self.target = max(self.min_workers, self.target - max(1, self.target // 4))
+            self._hold = self.hold_rounds
+            return "FloodWait"
+
+        if (
+            throughput_before_add is not None
+            and throughput < throughput_before_add * (1 + self.min_gain)
+            and self.target > self.min_workers
+        ):
+            self.target -= 1
+            self._hold = self.hold_rounds
+            return "no throughput gain"
+
+        if queue_depth == 0 and self.target > self.min_workers:
+            self.target -= 1
+            return "queue empty"
+
+        if queue_depth > self.target and self.target < self.max_workers and not self._hold:
+            self.target += 1
+            self._throughput_before_add = throughput
+            return "queue backlog"
+
+        return None
+
+    async def _run(self, loop: asyncio.AbstractEventLoop):
+        last_time = time.monotonic()
+        last_transferred = self.get_transferred()
+        last_flood_waits = self.get_flood_waits()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                cur_time = time.monotonic()
+                transferred = self.get_transferred()
+                flood_waits = self.get_flood_waits()
+                throughput = (transferred - last_transferred) / max(cur_time - last_time, 1e-3)
+                queue_depth = self.get_queue_depth()
+                new_flood_waits = flood_waits - last_flood_waits
+                last_time, last_transferred, last_flood_waits = (
+                    cur_time,
+                    transferred,
+                    flood_waits,
+                )
+
+                old_target = self.target
+                reason = self.decide(throughput, new_flood_waits, queue_depth)
+                if reason is None:
+                    continue
+
+                logger.info(
+                    f"Download workers {old_target} -> {self.target} ({reason}): "
+                    f"throughput {format_byte(throughput)}/s, "
+                    f"FloodWait {new_flood_waits}, queued {queue_depth}"
+                )
+                while self._live < self.target:
+                    self._spawn(loop, self._worker_factory)
+            except Exception as e:
+                logger.error(f"[{e}].", exc_info=True)
+
+    def stop(self):
+        """Cancel the monitor and every worker"""
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for task in list(self.tasks):
+            task.cancel()
+        self._live = 0
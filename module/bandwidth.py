@@ -0,0 +1,334 @@
+"""Token bucket bandwidth limits for downloads and uploads"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from module.download_stat import update_bandwidth_stat
+from utils.format import get_byte_from_str
+
+# 令牌桶容量 相当于按限速传输的秒数
+BURST_SECONDS = 1.0
+# 重新计算时间段限速的间隔
+SCHEDULE_REFRESH_SECONDS = 1.0
+
+
+def parse_rate(value: Any) -> Optional[int]:
+    """
+    Bytes per second from the config.
+
+    Parameters
+    ----------
+    value: Any
+        A number of bytes, or a size like `512KB` or `10MB`, optionally
+        ending with `/s`. Empty or 0 means no limit
+
+    Returns
+    -------
+    Optional[int]
+        Bytes per second, 0 for no limit, None if the value is invalid
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, (int, float)):
+        return max(0, int(value))
+
+    rate_str = str(value).strip().upper()
+    if rate_str.endswith("/S"):
+        rate_str = rate_str[:-2]
+    if rate_str.isdigit():
+        return int(rate_str)
+    return get_byte_from_str(rate_str)
+
+
+def _parse_time(value: Any) -> int:
+    """Minute of the day from `HH:MM`"""
+    hour, minute = str(value).split(":")
+    return (int(hour) * 60 + int(minute)) % (24 * 60)
+
+
+def parse_schedule(schedule: Optional[list], direction: str) -> List[Tuple[int, int, int]]:
+    """
+    Time ranges with their own limit.
+
+    Parameters
+    ----------
+    schedule: list
+        Items like `{start: "09:00", end: "18:00", download: 2MB}`, a
+        range may cross midnight
+
+    direction: str
+        `download` or `upload`, items without a limit for the direction
+        are ignored
+
+    Returns
+    -------
+    List[Tuple[int, int, int]]
+        (start minute, end minute, bytes per second)
+    """
+    ranges = []
+    for item in schedule or []:
+        if not isinstance(item, dict) or item.get(direction) is None:
+            continue
+        try:
+            start = _parse_time(item["start"])
+            end = _parse_time(item["end"])
+        except Exception:
+            logger.warning(f"Invalid bandwidth schedule {item}")
+            continue
+        rate = parse_rate(item[direction])
+        if rate is None:
+            logger.warning(f"Invalid bandwidth limit {item[direction]}")
+            continue
+        ranges.append((start, end, rate))
+    return ranges
+
+
+def scheduled_rate(
+    ranges: List[Tuple[int, int, int]], default: int, now: datetime
+) -> int:
+    """Limit of the first range containing `now`, `default` outside"""
+    minute = now.hour * 60 + now.minute
+    for start, end, rate in ranges:
+        if start <= end:
+            if start <= minute < end:
+                return rate
+        elif minute >= start or minute < end:
+            return rate
+    return default
+
+
+class TokenBucket:
+    """Bytes per second with a burst of `burst_seconds` of the rate
+
+    A transfer takes its bytes at once and may leave the bucket in debt,
+    the caller then waits until the debt is paid back. So a chunk larger
+    than the bucket is still let through, at the limited average rate.
+    """
+
+    def __init__(self, rate: int = 0, burst_seconds: float = BURST_SECONDS):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = self.burst
+        self.last_time = time.monotonic()
+
+    @property
+    def burst(self) -> float:
+        """Capacity of the bucket"""
+        return self.rate * self.burst_seconds
+
+    def _refill(self):
+        cur_time = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (cur_time - self.last_time) * self.rate
+        )
+        self.last_time = cur_time
+
+    def set_rate(self, rate: int):
+        """Change the rate, 0 for no limit"""
+        self._refill()
+        self.rate = rate
+        self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, size: int) -> float:
+        """Take `size` bytes, return the seconds to wait before sending"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        self.tokens -= size
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class _LimitConfig:
+    """Configured limit, schedule and runtime override of one bucket"""
+
+    def __init__(self):
+        self.limit: int = 0
+        self.ranges: List[Tuple[int, int, int]] = []
+        self.override: Optional[int] = None
+        self.bucket = TokenBucket()
+
+    def current(self, now: datetime) -> int:
+        """Limit in force, the override wins over the schedule"""
+        if self.override is not None:
+            return self.override
+        return scheduled_rate(self.ranges, self.limit, now)
+
+
+class BandwidthLimiter:
+    """Global and per chat bandwidth limit of one direction
+
+    Every transfer waits for both the global bucket and the bucket of its
+    chat. Limits follow the time of day schedule and can be overridden at
+    runtime from the web page or the bot, the override is applied by the
+    event loop on the next transfer. The web page runs in its own thread,
+    so the chat configs are guarded by a lock.
+    """
+
+    def __init__(self, direction: str):
+        """
+        Parameters
+        ----------
+        direction: str
+            `download` or `upload`, also the key of the schedule items
+        """
+        self.direction = direction
+        self._global = _LimitConfig()
+        self._chats: Dict[Any, _LimitConfig] = {}
+        self._chats_lock = threading.Lock()
+        self._next_refresh: float = 0.0
+
+    def _get_chat(self, chat_id: Any) -> _LimitConfig:
+        with self._chats_lock:
+            config = self._chats.get(chat_id)
+            if config is None:
+                config = _LimitConfig()
+                self._chats[chat_id] = config
+            return config
+
+    def _all_configs(self) -> List[Tuple[Any, _LimitConfig]]:
+        # 复制一份 避免遍历时其他线程新增聊天
+        with self._chats_lock:
+            return [(None, self._global), *self._chats.items()]
+
+    def _parse_limit(self, limit: Any) -> int:
+        rate = parse_rate(limit)
+        if rate is None:
+            logger.warning(f"Invalid {self.direction} bandwidth limit {limit}")
+            return 0
+        return rate
+
+    def configure(self, limit: Any, schedule: list = None):
+        """Set the global limit and its schedule from the config"""
+        self._global.limit = self._parse_limit(limit)
+        self._global.ranges = parse_schedule(schedule, self.direction)
+        self._next_refresh = 0.0
+
+    def configure_chat(self, chat_id: Any, limit: Any, schedule: list = None):
+        """Set the limit and schedule of a chat from the config"""
+        config = self._get_chat(chat_id)
+        config.limit = self._parse_limit(limit)
+        config.ranges = parse_schedule(schedule, self.direction)
+        self._next_refresh = 0.0
+
+    def set_override(self, limit: Any, chat_id: Any = None) -> bool:
+        """
+        Override the limit at runtime.
+
+        Parameters
+        ----------
+        limit: Any
+            New limit, 0 for no limit, None to go back to the config
+
+        chat_id: Any
+            Chat to limit, None for the global limit
+
+        Returns
+        -------
+        bool
+            False if the limit is invalid
+        """
+        rate = None
+        if limit is not None:
+            rate = parse_rate(limit)
+            if rate is None:
+                return False
+        config = self._global if chat_id is None else self._get_chat(chat_id)
+        config.override = rate
+        self._next_refresh = 0.0
+        return True
+
+    def get_limit(self, chat_id: Any = None) -> int:
+        """Limit in force now, 0 for no limit"""
+        if chat_id is None:
+            config = self._global
+        else:
+            with self._chats_lock:
+                config = self._chats.get(chat_id)
+        return config.current(datetime.now()) if config else 0
+
+    def _refresh(self):
+        cur_time = time.monotonic()
+        if cur_time < self._next_refresh:
+            return
+        self._next_refresh = cur_time + SCHEDULE_REFRESH_SECONDS
+        now = datetime.now()
+        for _, config in self._all_configs():
+            rate = config.current(now)
+            if rate != config.bucket.rate:
+                config.bucket.set_rate(rate)
+
+    async def consume(self, size: int, chat_id: Any = None):
+        """Wait until `size` bytes of the chat may be transferred"""
+        if size <= 0:
+            return
+        self._refresh()
+        wait = self._global.bucket.reserve(size)
+        with self._chats_lock:
+            chat = self._chats.get(chat_id)
+        if chat is not None:
+            wait = max(wait, chat.bucket.reserve(size))
+        update_bandwidth_stat(self.direction, size, self._global.bucket.rate)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def get_stats(self) -> dict:
+        """Configured, overridden and current limit globally and per chat"""
+        now = datetime.now()
+
+        def _stat(config: _LimitConfig) -> dict:
+            return {
+                "limit": config.limit,
+                "override": config.override,
+                "current": config.current(now),
+            }
+
+        configs = self._all_configs()
+        return {
+            "global": _stat(configs[0][1]),
+            "chats": {chat_id: _stat(config) for chat_id, config in configs[1:]},
+        }
+
+
+def limit_progress(
+    limiter: BandwidthLimiter, chat_id: Any, progress: Callable
+) -> Callable:
+    """
+    Wrap a pyrogram progress callback so every reported byte passes the
+    limiter. pyrogram waits for the callback before the next part, so the
+    transfer itself is held back.
+
+    Parameters
+    ----------
+    limiter: BandwidthLimiter
+        The limiter of the direction
+
+    chat_id: Any
+        Chat of the transfer
+
+    progress: Callable
+        The wrapped callback, called with `(current, total, *args)`
+
+    Returns
+    -------
+    Callable
+        Callback for one transfer
+    """
+    transferred = {"size": 0}
+
+    async def _progress(current: int, total: int, *args):
+        await limiter.consume(current - transferred["size"], chat_id)
+        transferred["size"] = current
+        await progress(current, total, *args)
+
+    return _progress
+
+
+download_limiter = BandwidthLimiter("download")
+upload_limiter = BandwidthLimiter("upload")
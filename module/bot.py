@@ -23,6 +23,7 @@ from module.app import (
     TaskType,
     UploadStatus,
 )
+from module.bandwidth import download_limiter, upload_limiter
 from module.filter import Filter
 from module.get_chat_history_v2 import get_chat_history_v2
 from module.language import Language, _t
@@ -36,7 +37,7 @@ from module.pyrogram_extension import (
     set_meta_data,
     upload_telegram_chat_message,
 )
-from utils.format import replace_date_time, validate_title
+from utils.format import format_byte, replace_date_time, validate_title
 from utils.meta_data import MetaData
 #from utils.updates import get_latest_release
 
@@ -180,6 +181,7 @@ class DownloadBot:
                 ),
             ),
             types.BotCommand("set_language", _t("Set language")),
+            types.BotCommand("set_bandwidth", _t("Set bandwidth limit")),
             types.BotCommand("stop", _t("Stop bot download or forward")),
         ]
 
@@ -282,6 +284,13 @@ class DownloadBot:
                 & pyrogram.filters.user(self.allowed_user_ids),
             )
         )
+        self.bot.add_handler(
+            MessageHandler(
+                set_bandwidth,
+                filters=pyrogram.filters.command(["set_bandwidth"])
+                & pyrogram.filters.user(self.allowed_user_ids),
+            )
+        )
 
         self.bot.add_handler(
             MessageHandler(
@@ -381,6 +390,7 @@ async def send_help_str(client: pyrogram.Client, chat_id):
         f"/forward - {_t('Forward messages')}\n"
         f"/listen_forward - {_t('Listen for forwarded messages')}\n"
         f"/set_language - {_t('Set language')}\n"
+        f"/set_bandwidth - {_t('Set bandwidth limit')}\n"
         f"/stop - {_t('Stop bot download or forward')}\n\n"
         f"{_t('**Note**: 1 means the start of the entire chat')},"
         f"{_t('0 means the end of the entire chat')}\n"
@@ -439,6 +449,44 @@ async def set_language(client: pyrogram.Client, message: pyrogram.types.Message)
         )
 
 
+async def set_bandwidth(client: pyrogram.Client, message: pyrogram.types.Message):
+    """
+    Override the download or upload bandwidth limit at runtime.
+
+    Parameters:
+        client (pyrogram.Client): The pyrogram client.
+        message (pyrogram.types.Message): The message containing the command.
+
+    Returns:
+        None
+    """
+
+    msg = _t(
+        "Invalid command format. Please use /set_bandwidth download/upload 2MB/0/auto [chat_id]"
+    )
+    args = message.text.split()
+    if len(args) not in (3, 4) or args[1] not in ("download", "upload"):
+        await client.send_message(message.from_user.id, msg)
+        return
+
+    limiter = download_limiter if args[1] == "download" else upload_limiter
+    limit = None if args[2] == "auto" else args[2]
+    chat_id = None
+    if len(args) == 4:
+        chat_id = int(args[3]) if args[3].lstrip("-").isdigit() else args[3]
+
+    if not limiter.set_override(limit, chat_id):
+        await client.send_message(message.from_user.id, msg)
+        return
+
+    rate = limiter.get_limit(chat_id)
+    await client.send_message(
+        message.from_user.id,
+        f"{_t('Bandwidth limit set to')} "
+        f"{format_byte(rate) + '/s' if rate else _t('no limit')}",
+    )
+
+
 async def get_info(client: pyrogram.Client, message: pyrogram.types.Message):
     """
     Async function that retrieves information from a group message link.
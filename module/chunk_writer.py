@@ -0,0 +1,120 @@
+"""Write-behind stage between the network reader and the disk"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from utils.download_storage import DownloadStorage
+
+_write_executor = ThreadPoolExecutor(4, thread_name_prefix="chunk_writer")
+
+# 单次合并写入的上限
+MAX_COALESCE_BYTES = 8 * 1024 * 1024
+
+
+class ChunkWriter:
+    """Write chunks of one download in a thread pool
+
+    `put` only waits when `max_pending` chunks are already queued, so the
+    network reader keeps streaming while the disk is slow and is held back
+    once the writer falls behind. Queued chunks with consecutive ids are
+    written with a single positional write.
+    """
+
+    def __init__(
+        self,
+        storage: DownloadStorage,
+        max_pending: int = 8,
+        executor: ThreadPoolExecutor = None,
+    ):
+        """
+        Parameters
+        ----------
+        storage: DownloadStorage
+            The opened storage of the download
+
+        max_pending: int
+            Chunks that may wait for the disk before `put` blocks
+
+        executor: ThreadPoolExecutor
+            Pool running the writes, a shared pool by default
+        """
+        self.storage = storage
+        self.executor = executor or _write_executor
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, max_pending))
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+
+    def start(self):
+        """Start the writer task"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def put(self, chunk_id: int, data: bytes):
+        """Queue one chunk, waits while the queue is full"""
+        if self._error:
+            raise self._error
+        self.start()
+        await self._queue.put((chunk_id, data))
+
+    async def close(self):
+        """Write what is queued and stop, raise the first write error"""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        if self._error:
+            raise self._error
+
+    def _take_batch(self, first: Tuple[int, bytes]) -> Tuple[List[Tuple[int, bytes]], bool]:
+        """Take every chunk already queued without waiting"""
+        batch = [first]
+        stop = False
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    @staticmethod
+    def _coalesce(batch: List[Tuple[int, bytes]]) -> List[Tuple[int, List[bytes]]]:
+        """Group chunks into runs of consecutive ids"""
+        runs: List[Tuple[int, List[bytes]]] = []
+        run_size = 0
+        for chunk_id, data in sorted(batch, key=lambda item: item[0]):
+            if (
+                runs
+                and runs[-1][0] + len(runs[-1][1]) == chunk_id
+                and run_size + len(data) <= MAX_COALESCE_BYTES
+            ):
+                runs[-1][1].append(data)
+                run_size += len(data)
+            else:
+                runs.append((chunk_id, [data]))
+                run_size = len(data)
+        return runs
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._take_batch(first)
+            if self._error:
+                continue  # 已出错 只清空队列让读取方退出等待
+
+            try:
+                for start_id, chunks in self._coalesce(batch):
+                    if not await loop.run_in_executor(
+                        self.executor, self.storage.write_chunks, start_id, chunks
+                    ):
+                        raise IOError(
+                            f"Write chunks {start_id}-{start_id + len(chunks) - 1} "
+                            f"of '{self.storage.file_path}' failed"
+                        )
+            except Exception as e:
+                self._error = e
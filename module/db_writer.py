@@ -0,0 +1,323 @@
+"""Single writer thread committing download records in batches"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from module.sqlmodel import Downloaded
+from module.status_index import StatusIndex
+
+# 每批最多的记录数
+DB_BATCH_SIZE = 200
+# 第一条记录最多等待的时间 秒
+DB_FLUSH_INTERVAL = 0.2
+
+_STOP = object()
+
+
+class DBWriter:
+    """Write download records from one thread, many per transaction
+
+    `insert_into_db` runs one statement and, in autocommit mode, one
+    fsync per record, blocking the event loop. Records put here are
+    written by a dedicated thread with `upsert_many`, which commits once
+    `batch_size` records are waiting or `flush_interval` seconds after
+    the first one. A failed batch is written again record by record, so
+    only the faulty records are dropped. Other writes, like those of the
+    message cache, are queued with `call` and run in the same thread.
+    Every record gets a future resolved after its commit, await `write`
+    when the record has to be on disk before going on. Records reserved or
+    queued but not committed yet are returned by `get_pending`, so readers
+    can see them before they reach the database. A reservation that will
+    not be queued has to be given back with `release`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = DB_BATCH_SIZE,
+        flush_interval: float = DB_FLUSH_INTERVAL,
+        write_records: Callable[[List[dict]], Any] = None,
+        status_index: StatusIndex = None,
+    ):
+        """
+        Parameters
+        ----------
+        batch_size: int
+            Records committed together at most
+
+        flush_interval: float
+            Seconds a record waits for others before the commit
+
+        write_records: Callable[[List[dict]], Any]
+            Writes the records of a batch, `Downloaded.upsert_many` by default
+
+        status_index: StatusIndex
+            Updated once a record is committed
+        """
+        self.configure(batch_size, flush_interval)
+        self.write_records = write_records or Downloaded().upsert_many
+        self.status_index = status_index
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 已预留或已排队 尚未提交的记录
+        self._pending: Dict[Tuple[Any, Any], dict] = {}
+        # 已预留 尚未排队的记录
+        self._reserved: Set[Tuple[Any, Any]] = set()
+        self._pending_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.commit_count = 0
+        self.record_count = 0
+
+    def configure(self, batch_size: int, flush_interval: float):
+        """Change the batch limits, applies to the next batch"""
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+
+    def start(self):
+        """Start the writer thread, done by the first `put` as well"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db_writer", daemon=True)
+                self._thread.start()
+
+    def put(self, record: dict) -> Future:
+        """
+        Queue a record, thread safe.
+
+        Parameters
+        ----------
+        record: dict
+            Media dict as passed to `insert_into_db`, copied
+
+        Returns
+        -------
+        Future
+            True once committed, False if the record could not be written
+        """
+        self.start()
+        try:
+            # 提交后在这个事件循环里更新 status_index
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        record = dict(record)
+        key = (record.get('chat_id'), record.get('message_id'))
+        with self._pending_lock:
+            self._pending[key] = record
+            self._reserved.discard(key)
+        future: Future = Future()
+        self._queue.put((record, future))
+        return future
+
+    def reserve(self, record: dict):
+        """
+        Make a record visible to `get_pending` before it is queued.
+
+        Parameters
+        ----------
+        record: dict
+            Media dict, copied, replaced by the record `put` later
+        """
+        record = dict(record)
+        key = (record.get('chat_id'), record.get('message_id'))
+        with self._pending_lock:
+            self._pending[key] = record
+            self._reserved.add(key)
+
+    def release(self, chat_id: Any, message_id: Any):
+        """
+        Drop a reservation that will not be queued, thread safe.
+
+        Parameters
+        ----------
+        chat_id: Any
+            Chat of the reserved record
+
+        message_id: Any
+            Message of the reserved record, a record already queued with
+            `put` is kept
+        """
+        key = (chat_id, message_id)
+        with self._pending_lock:
+            if key in self._reserved:
+                self._reserved.discard(key)
+                self._pending.pop(key, None)
+
+    def get_pending(self) -> List[dict]:
+        """Records reserved or queued and not committed yet"""
+        with self._pending_lock:
+            return list(self._pending.values())
+
+    def get_pending_status(self, chat_id: int, message_id: int) -> Optional[int]:
+        """Status of a record reserved or queued, None without one"""
+        with self._pending_lock:
+            record = self._pending.get((chat_id, message_id))
+        return record.get('status') if record is not None else None
+
+    def call(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a write other than a download record, thread safe.
+
+        Parameters
+        ----------
+        func: Callable
+            Called on the writer thread with `args` and `kwargs`, after the
+            records queued before it
+
+        Returns
+        -------
+        Future
+            The result of `func`
+        """
+        self.start()
+        future: Future = Future()
+        self._queue.put((partial(func, *args, **kwargs), future))
+        return future
+
+    async def write(self, record: dict) -> Any:
+        """Queue a record and wait for its commit, False if it failed"""
+        return await asyncio.wrap_future(self.put(record))
+
+    def flush(self, timeout: float = None):
+        """Wait until every record queued so far is committed"""
+        if self._thread is None:
+            return
+        future: Future = Future()
+        self._queue.put((None, future))
+        future.result(timeout)
+
+    def stop(self, timeout: float = None):
+        """Commit the queued records and stop the thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def get_stats(self) -> dict:
+        """Records, commits and records waiting"""
+        return {
+            "records": self.record_count,
+            "commits": self.commit_count,
+            "pending": self._queue.qsize(),
+        }
+
+    def _next_batch(self) -> Tuple[List[Tuple[Any, Future]], bool]:
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        # flush 时不再等待
+        while len(batch) < self.batch_size and batch[-1][0] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _release(self, committed: List[dict], failed: List[dict]):
+        with self._pending_lock:
+            for record in committed + failed:
+                key = (record.get('chat_id'), record.get('message_id'))
+                # 排队期间又有新记录时保留新记录
+                if self._pending.get(key) is record:
+                    del self._pending[key]
+        if self.status_index is not None:
+            for record in committed:
+                self.status_index.set(record.get('chat_id'), record.get('message_id'), record.get('status'))
+
+    def _on_committed(self, committed: List[dict], failed: List[dict]):
+        # status_index 只在事件循环中使用
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._release, committed, failed)
+                return
+            except RuntimeError:  # 事件循环已关闭
+                pass
+        self._release(committed, failed)
+
+    def _write(self, records: List[dict]) -> bool:
+        try:
+            with Downloaded._meta.database.atomic():
+                self.write_records(records)
+        except Exception as e:
+            # 与 insert_into_db 一样只记录错误
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return False
+        self.commit_count += 1
+        self.record_count += len(records)
+        return True
+
+    def _call(self, calls: List[Tuple[Callable, Future]]):
+        results = []
+        try:
+            with Downloaded._meta.database.atomic():
+                for func, _ in calls:
+                    try:
+                        # 出错时只回滚这一次调用
+                        with Downloaded._meta.database.atomic():
+                            results.append((True, func()))
+                    except Exception as e:
+                        results.append((False, e))
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            results = [(False, e)] * len(calls)
+        for (_, future), (ok, result) in zip(calls, results):
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def _commit(self, batch: List[Tuple[Any, Future]]):
+        calls = [(item, future) for item, future in batch if callable(item)]
+        batch = [(item, future) for item, future in batch if not callable(item)]
+        records = [record for record, _ in batch if record is not None]
+        if not records or self._write(records):
+            failed = []
+        elif len(records) == 1:
+            failed = records
+        else:
+            # 整批失败时逐条重试 只丢弃出错的记录
+            failed = [record for record in records if not self._write([record])]
+
+        failed_ids = {id(record) for record in failed}
+        self._on_committed([record for record in records if id(record) not in failed_ids], failed)
+        if calls:
+            self._call(calls)
+        for record, future in batch:
+            future.set_result(id(record) not in failed_ids)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch:
+                self._commit(batch)
+        # 停止前写完剩余记录
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                self._commit([item])
+        Downloaded._meta.database.close()
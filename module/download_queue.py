@@ -0,0 +1,452 @@
+"""Download queue with pluggable scheduling policies"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+# 每个优先级等级相当于提前排队的秒数
+PRIORITY_LEVEL_SECONDS = 600
+# 机器人发起的任务提前排队的秒数
+INTERACTIVE_SECONDS = 24 * 3600
+# 权重为 1 的会话每轮可下载的字节数
+FAIR_SHARE_QUANTUM = 64 * 1024 * 1024
+
+
+class QueueEntry:
+    """One queued item and what the policies schedule it by"""
+
+    # pylint: disable = R0913
+    def __init__(
+        self,
+        item: Any,
+        size: int = 0,
+        chat_id: Any = None,
+        priority: int = 0,
+        interactive: bool = False,
+    ):
+        self.item = item
+        self.size = max(0, size or 0)
+        self.chat_id = chat_id
+        self.priority = priority or 0
+        self.interactive = interactive
+        self.enqueue_time = time.time()
+        self.seq = 0
+
+
+class SchedulePolicy(ABC):
+    """Order in which queued entries are handed out"""
+
+    @abstractmethod
+    def push(self, entry: QueueEntry):
+        """Add an entry"""
+
+    @abstractmethod
+    def pop(self) -> QueueEntry:
+        """Remove and return the next entry"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of queued entries"""
+
+    @abstractmethod
+    def peek(self) -> QueueEntry:
+        """The next entry without removing it"""
+
+    def pending(self, chat_id: Any = None) -> int:
+        """Entries of the chat counted against its bound, 0 if chats are not bounded"""
+        return 0
+
+    def ready(self) -> bool:
+        """If `pop` can hand out an entry now"""
+        return len(self) > 0
+
+    def on_done(self, entry: QueueEntry):
+        """The entry handed out by `pop` is finished"""
+
+    def drain(self) -> List[QueueEntry]:
+        """Remove and return every queued entry"""
+        entries = []
+        while len(self):
+            entries.append(self.pop())
+        return entries
+
+    def get_stats(self) -> dict:
+        """Per chat statistics, empty if the policy keeps none"""
+        return {}
+
+
+class FifoPolicy(SchedulePolicy):
+    """First in, first out"""
+
+    def __init__(self):
+        self._entries: List[QueueEntry] = []
+        self._head = 0
+
+    def push(self, entry: QueueEntry):
+        self._entries.append(entry)
+
+    def pop(self) -> QueueEntry:
+        entry = self._entries[self._head]
+        self._head += 1
+        if self._head > 1024 and self._head * 2 > len(self._entries):
+            del self._entries[: self._head]
+            self._head = 0
+        return entry
+
+    def peek(self) -> QueueEntry:
+        return self._entries[self._head]
+
+    def __len__(self) -> int:
+        return len(self._entries) - self._head
+
+
+class PriorityPolicy(SchedulePolicy):
+    """Small files, prioritized chats and bot tasks first, with aging
+
+    Every entry gets a penalty in seconds: its size in MB times
+    `seconds_per_mb`, minus `PRIORITY_LEVEL_SECONDS` per chat priority
+    level, minus `INTERACTIVE_SECONDS` for tasks started from the bot.
+    Waiting one second cancels one second of penalty, so every entry is
+    served at last. Since all entries age at the same rate the order is
+    `enqueue_time + penalty` and never changes after the push.
+    """
+
+    def __init__(self, seconds_per_mb: float = 1.0):
+        """
+        Parameters
+        ----------
+        seconds_per_mb: float
+            Waiting time that makes up for one MB of file size
+        """
+        self.seconds_per_mb = seconds_per_mb
+        self._heap: list = []
+
+    def penalty(self, entry: QueueEntry) -> float:
+        """Head start of other entries over this one, in seconds"""
+        penalty = entry.size / (1024 * 1024) * self.seconds_per_mb
+        penalty -= entry.priority * PRIORITY_LEVEL_SECONDS
+        if entry.interactive:
+            penalty -= INTERACTIVE_SECONDS
+        return penalty
+
+    def push(self, entry: QueueEntry):
+        heapq.heappush(
+            self._heap, (entry.enqueue_time + self.penalty(entry), entry.seq, entry)
+        )
+
+    def pop(self) -> QueueEntry:
+        return heapq.heappop(self._heap)[2]
+
+    def peek(self) -> QueueEntry:
+        return self._heap[0][2]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class _ChatShare:
+    """Queued entries and counters of one chat in `FairSharePolicy`"""
+
+    def __init__(self, policy: SchedulePolicy, weight: float, max_in_flight: int):
+        self.policy = policy
+        self.weight = weight
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        # 在优先通道中排队的任务数
+        self.interactive_queued = 0
+        self.deficit = 0.0
+        self.visited = False
+        self.served_bytes = 0
+        self.served_count = 0
+
+    def blocked(self) -> bool:
+        """If the chat reached its in-flight cap"""
+        return 0 < self.max_in_flight <= self.in_flight
+
+
+class FairSharePolicy(SchedulePolicy):
+    """Deficit round-robin by bytes across chats
+
+    Every chat with queued entries takes its turn in a ring. On its turn a
+    chat earns `quantum * weight` bytes of credit and hands out entries
+    while the credit covers their size, so over time every chat gets a
+    share of the downloaded bytes in proportion to its weight, however many
+    files the others queued. Chats at their `max_in_flight` cap are passed
+    over until one of their downloads is done. Entries of one chat are
+    ordered by the policy from `chat_policy`.
+
+    Tasks started from the bot skip the ring: they wait in one lane served
+    before any chat's turn, whatever their chat's credit or cap, and still
+    count as in flight for their chat.
+    """
+
+    def __init__(
+        self,
+        quantum: int = FAIR_SHARE_QUANTUM,
+        chat_policy: Callable[[], SchedulePolicy] = FifoPolicy,
+    ):
+        """
+        Parameters
+        ----------
+        quantum: int
+            Bytes credited to a chat of weight 1 on each turn
+
+        chat_policy: Callable[[], SchedulePolicy]
+            Creates the policy ordering the entries of one chat
+        """
+        self.quantum = max(1, quantum)
+        self.chat_policy = chat_policy
+        self._chats: Dict[Any, _ChatShare] = {}
+        self._ring: deque = deque()
+        self._interactive = chat_policy()
+        self._size = 0
+
+    def _get_chat(self, chat_id: Any) -> _ChatShare:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = _ChatShare(self.chat_policy(), 1.0, 0)
+            self._chats[chat_id] = chat
+        return chat
+
+    def set_chat_share(self, chat_id: Any, weight: float = 1.0, max_in_flight: int = 0):
+        """
+        Set the share of a chat.
+
+        Parameters
+        ----------
+        chat_id: Any
+            The chat
+
+        weight: float
+            Share of the bytes relative to other chats, default 1
+
+        max_in_flight: int
+            Downloads of the chat running at once, 0 for no limit
+        """
+        chat = self._get_chat(chat_id)
+        chat.weight = weight if weight > 0 else 1.0
+        chat.max_in_flight = max(0, max_in_flight)
+
+    def push(self, entry: QueueEntry):
+        chat = self._get_chat(entry.chat_id)
+        self._size += 1
+        if entry.interactive:
+            chat.interactive_queued += 1
+            self._interactive.push(entry)
+            return
+        if not len(chat.policy):
+            self._ring.append(entry.chat_id)
+        chat.policy.push(entry)
+
+    @staticmethod
+    def _serve(chat: _ChatShare, entry: QueueEntry):
+        chat.in_flight += 1
+        chat.served_bytes += entry.size
+        chat.served_count += 1
+
+    def pop(self) -> QueueEntry:
+        if len(self._interactive):
+            # 机器人发起的任务优先于所有会话的轮转
+            entry = self._interactive.pop()
+            chat = self._chats[entry.chat_id]
+            chat.interactive_queued -= 1
+            self._serve(chat, entry)
+            self._size -= 1
+            return entry
+
+        # 调用方已通过 ready() 确认至少有一个会话可以下载
+        while True:
+            chat_id = self._ring[0]
+            chat = self._chats[chat_id]
+            if chat.blocked():
+                chat.visited = False
+                self._ring.rotate(-1)
+                continue
+
+            if not chat.visited:
+                chat.deficit += self.quantum * chat.weight
+                chat.visited = True
+
+            entry = chat.policy.peek()
+            if entry.size > chat.deficit:
+                chat.visited = False
+                self._ring.rotate(-1)
+                continue
+
+            chat.policy.pop()
+            chat.deficit -= entry.size
+            self._serve(chat, entry)
+            self._size -= 1
+            if not len(chat.policy):
+                # 没有排队任务的会话不积累额度
+                self._ring.popleft()
+                chat.deficit = 0
+                chat.visited = False
+            return entry
+
+    def peek(self) -> QueueEntry:
+        if len(self._interactive):
+            return self._interactive.peek()
+        for chat_id in self._ring:
+            chat = self._chats[chat_id]
+            if not chat.blocked():
+                return chat.policy.peek()
+        raise IndexError("No chat can download now")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def pending(self, chat_id: Any = None) -> int:
+        chat = self._chats.get(chat_id)
+        return len(chat.policy) + chat.interactive_queued if chat else 0
+
+    def drain(self) -> List[QueueEntry]:
+        entries = self._interactive.drain()
+        for chat_id in self._ring:
+            entries.extend(self._chats[chat_id].policy.drain())
+        self._ring.clear()
+        self._size = 0
+        for chat in self._chats.values():
+            chat.interactive_queued = 0
+            chat.deficit = 0
+            chat.visited = False
+        return entries
+
+    def ready(self) -> bool:
+        return len(self._interactive) > 0 or any(not self._chats[chat_id].blocked() for chat_id in self._ring)
+
+    def on_done(self, entry: QueueEntry):
+        chat = self._chats.get(entry.chat_id)
+        if chat and chat.in_flight > 0:
+            chat.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            chat_id: {
+                "queued": len(chat.policy) + chat.interactive_queued,
+                "in_flight": chat.in_flight,
+                "served_bytes": chat.served_bytes,
+                "served_count": chat.served_count,
+                "weight": chat.weight,
+                "max_in_flight": chat.max_in_flight,
+            }
+            for chat_id, chat in self._chats.items()
+        }
+
+
+class DownloadQueue:
+    """Bounded queue handing out items in the order of its policy
+
+    It keeps the `put`/`get`/`qsize` interface of `asyncio.Queue`,
+    `put` waits while `maxsize` items are queued in total, or while
+    `chat_maxsize` items of the same chat are queued if the policy keeps
+    every chat on its own. Items taken with `get_entry` are handed back
+    with `task_done` once finished.
+    """
+
+    def __init__(self, maxsize: int = 0, policy: SchedulePolicy = None, chat_maxsize: int = 0):
+        self.maxsize = maxsize
+        self.chat_maxsize = chat_maxsize
+        self.policy = policy if policy is not None else FifoPolicy()
+        self._seq = itertools.count()
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # 延迟创建 绑定到实际运行的事件循环
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def set_policy(self, policy: SchedulePolicy):
+        """Replace the policy, queued entries are moved over"""
+        old_policy = self.policy
+        self.policy = policy
+        for entry in old_policy.drain():
+            policy.push(entry)
+
+    def qsize(self) -> int:
+        """Number of queued items"""
+        return len(self.policy)
+
+    def empty(self) -> bool:
+        """If no item is queued"""
+        return self.qsize() == 0
+
+    def full(self, chat_id: Any = None) -> bool:
+        """If `put` for the chat would wait"""
+        return 0 < self.maxsize <= len(self.policy) or (
+            0 < self.chat_maxsize <= self.policy.pending(chat_id)
+        )
+
+    # pylint: disable = R0913
+    async def put(
+        self,
+        item: Any,
+        size: int = 0,
+        chat_id: Any = None,
+        priority: int = 0,
+        interactive: bool = False,
+    ):
+        """Queue an item, wait while the queue is full
+
+        Parameters
+        ----------
+        item: Any
+            The queued item
+
+        size: int
+            Bytes the item will download
+
+        chat_id: Any
+            Chat the item belongs to
+
+        priority: int
+            Priority level of the chat, higher is served earlier
+
+        interactive: bool
+            If the item was requested from the bot
+        """
+        entry = QueueEntry(item, size, chat_id, priority, interactive)
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: not self.full(chat_id))
+            entry.seq = next(self._seq)
+            self.policy.push(entry)
+            condition.notify_all()
+
+    async def get_entry(self) -> QueueEntry:
+        """Wait for the next entry of the policy"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.policy.ready())
+            entry = self.policy.pop()
+            condition.notify_all()
+            return entry
+
+    async def get(self) -> Any:
+        """Wait for the next item of the policy"""
+        return (await self.get_entry()).item
+
+    async def task_done(self, entry: QueueEntry):
+        """The entry from `get_entry` is finished"""
+        condition = self._get_condition()
+        async with condition:
+            self.policy.on_done(entry)
+            condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """Per chat statistics of the policy"""
+        return self.policy.get_stats()
+
+
+def create_policy(name: str, seconds_per_mb: float = 1.0) -> SchedulePolicy:
+    """Policy by its name in the config, `fifo`, `priority` or `fair`, `fifo` if unknown"""
+    if name == "fair":
+        return FairSharePolicy(chat_policy=lambda: PriorityPolicy(seconds_per_mb))
+    if name == "priority":
+        return PriorityPolicy(seconds_per_mb)
+    return FifoPolicy()
@@ -20,6 +20,11 @@ _total_download_speed: int = 0
 _total_download_size: int = 0
 _last_download_time: float = time.time()
 _download_state: DownloadState = DownloadState.Downloading
+_chunk_rate: dict = {}
+_chat_queue_stat: dict = {}
+_bandwidth_stat: dict = {}
+_flood_wait_count: int = 0
+_scan_progress: dict = {}
 
 
 def get_download_result() -> dict:
@@ -32,6 +37,106 @@ def get_total_download_speed() -> int:
     return _total_download_speed
 
 
+def get_chunk_rate() -> dict:
+    """get chunk request rate of every data center"""
+    return _chunk_rate
+
+
+def update_chunk_rate(dc_id: int, rate: float):
+    """update chunk request rate of the data center"""
+    _chunk_rate[dc_id] = rate
+
+
+def get_flood_wait_count() -> int:
+    """get number of FloodWait seen by downloads since start"""
+    return _flood_wait_count
+
+
+# pylint: disable = W0603
+def add_flood_wait():
+    """count a FloodWait seen by a download"""
+    global _flood_wait_count
+    _flood_wait_count += 1
+
+
+def get_scan_progress() -> dict:
+    """get history scan progress of every chat"""
+    return _scan_progress
+
+
+def start_scan_progress(chat_id):
+    """a history scan of the chat starts"""
+    _scan_progress[chat_id] = {
+        "scanned": 0,
+        "last_message_id": 0,
+        "start_time": time.time(),
+        "finished": False,
+    }
+
+
+def update_scan_progress(chat_id, message_id: int):
+    """a message of the chat was scanned"""
+    progress = _scan_progress.get(chat_id)
+    if progress is None:
+        start_scan_progress(chat_id)
+        progress = _scan_progress[chat_id]
+    progress["scanned"] += 1
+    progress["last_message_id"] = max(progress["last_message_id"], message_id)
+
+
+def finish_scan_progress(chat_id):
+    """the history scan of the chat is over"""
+    if chat_id in _scan_progress:
+        _scan_progress[chat_id]["finished"] = True
+
+
+def get_chat_queue_stat() -> dict:
+    """get queue depth and served bytes of every chat"""
+    return _chat_queue_stat
+
+
+# pylint: disable = W0603
+def update_chat_queue_stat(stat: dict):
+    """update queue depth and served bytes of every chat"""
+    global _chat_queue_stat
+    _chat_queue_stat = stat
+
+
+def get_bandwidth_stat() -> dict:
+    """get transferred bytes, speed and limit of every direction"""
+    return _bandwidth_stat
+
+
+def get_transferred_bytes(direction: str) -> int:
+    """get bytes transferred in the direction since start"""
+    return _bandwidth_stat.get(direction, {}).get("total_bytes", 0)
+
+
+def update_bandwidth_stat(direction: str, size: int, limit: int):
+    """count bytes passed by the bandwidth limiter of the direction"""
+    cur_time = time.time()
+    stat = _bandwidth_stat.get(direction)
+    if stat is None:
+        stat = {
+            "total_bytes": 0,
+            "speed": 0,
+            "limit": 0,
+            "each_second_total": 0,
+            "last_stat_time": cur_time,
+        }
+        _bandwidth_stat[direction] = stat
+
+    stat["total_bytes"] += size
+    stat["each_second_total"] += size
+    stat["limit"] = limit
+    if cur_time - stat["last_stat_time"] >= 1.0:
+        stat["speed"] = int(
+            stat["each_second_total"] / (cur_time - stat["last_stat_time"])
+        )
+        stat["each_second_total"] = 0
+        stat["last_stat_time"] = cur_time
+
+
 def get_download_state() -> DownloadState:
     """get download state"""
     return _download_state
@@ -0,0 +1,107 @@
+"""Finalize stage moving finished downloads into place"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from utils.content_hash import hash_file
+from utils.download_storage import DownloadStorage, ensure_dir
+from utils.file_management import move_file
+
+
+class FileFinalizer:
+    """Verify and move finished downloads in a thread pool
+
+    Moving a file to another file system copies every byte, which must not
+    run on the event loop. The stage has its own pool, so at most
+    `max_task` files are finalized at once whatever the number of download
+    workers, and every submitted file is reported through a future.
+    """
+
+    def __init__(self, max_task: int = 2):
+        self.max_task = max(1, max_task)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def set_max_task(self, max_task: int):
+        """Change the concurrency limit, applies to the next pool"""
+        self.max_task = max(1, max_task)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.max_task, thread_name_prefix="file_finalizer"
+            )
+        return self._executor
+
+    @staticmethod
+    def _finalize(
+        storage: Optional[DownloadStorage],
+        part_file: str,
+        file_size: int,
+        output_file: str,
+        hash_algorithm: Optional[str],
+    ) -> Optional[str]:
+        if storage is not None:
+            return storage.finalize(output_file)
+
+        if os.path.getsize(part_file) != file_size:
+            raise ValueError(f"Download of '{part_file}' is not complete")
+        content_hash = hash_file(part_file, hash_algorithm) if hash_algorithm else None
+        ensure_dir(os.path.dirname(output_file))
+        move_file(part_file, output_file)
+        return content_hash
+
+    def submit(
+        self,
+        part_file: str,
+        file_size: int,
+        output_file: str,
+        storage: DownloadStorage = None,
+        hash_algorithm: str = None,
+    ) -> asyncio.Future:
+        """Queue a finished download
+
+        Parameters
+        ----------
+        part_file: str
+            The downloaded partial file
+
+        file_size: int
+            Expected size of the file
+
+        output_file: str
+            Destination of the file
+
+        storage: DownloadStorage
+            Storage of a chunked download, its manifest is verified and
+            removed as well, its content hash is used
+
+        hash_algorithm: str
+            Content hash of a file downloaded without storage, None for
+            no hash
+
+        Returns
+        -------
+        asyncio.Future
+            Resolves to the content hash (None without hash) or raises
+            the error of the move
+        """
+        return asyncio.get_running_loop().run_in_executor(
+            self._get_executor(),
+            self._finalize,
+            storage,
+            part_file,
+            file_size,
+            output_file,
+            hash_algorithm,
+        )
+
+    def shutdown(self):
+        """Wait for running moves and stop the pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
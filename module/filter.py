@@ -2,13 +2,16 @@
 
 import re
 from datetime import datetime
-from typing import Any, Optional, Tuple
+from typing import Any, Iterable, Optional, Set, Tuple
 
 from ply import lex, yacc
 
 from utils.format import get_byte_from_str
 from utils.meta_data import MetaData, NoneObj, ReString
 
+# 过滤表达式中的算术运算会把未知值当作0 无法判断
+_ARITHMETIC_TOKENS = {"+", "-", "*", "/"}
+
 
 # pylint: disable = R0904
 class BaseFilter:
@@ -27,7 +30,8 @@ class BaseFilter:
         # Build the lexer and parser
         # lex.lex(module=self)
         self.lexer = lex.lex(module=self)
-        self.yacc = yacc.yacc(module=self)
+        # 不生成 parsetab.py 与 parser.out
+        self.yacc = yacc.yacc(module=self, write_tables=False, debug=False)
 
     def reset(self):
         """Reset all symbol"""
@@ -414,6 +418,51 @@ class Filter:
             return False
         raise ValueError("meta data cannot be empty!")
 
+    def implied_media_types(
+        self, filter_str: Optional[str], media_types: Iterable[str]
+    ) -> Optional[Set[str]]:
+        """
+        Media types the filter can accept, whatever the other fields are.
+
+        Every field but `media_type` is left unknown, comparisons with an
+        unknown value are true and the filter has no negation, so a media
+        type the filter rejects this way is rejected for every message.
+
+        Parameters
+        ----------
+        filter_str: Optional[str]
+            The download filter, empty accepts every media type
+
+        media_types: Iterable[str]
+            Media types to check
+
+        Returns
+        -------
+        Optional[Set[str]]
+            The accepted media types, None if the filter cannot be analysed
+        """
+        media_types = set(media_types)
+        if not filter_str:
+            return media_types
+
+        filter_str = filter_str.replace("no_jap_kor", "").strip()
+        try:
+            self.filter.lexer.input(filter_str)
+            if any(token.type in _ARITHMETIC_TOKENS for token in self.filter.lexer):
+                return None
+
+            accepted = set()
+            for media_type in media_types:
+                self.filter.names = {name: NoneObj() for name in MetaData().data()}
+                self.filter.names["media_type"] = media_type
+                if self.filter.exec(filter_str):
+                    accepted.add(media_type)
+            return accepted
+        except Exception:
+            return None
+        finally:
+            self.filter.reset()
+
     def check_filter(self, filter_str: str) -> Tuple[bool, Optional[str]]:
         """check filter str"""
         try:
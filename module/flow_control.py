@@ -0,0 +1,147 @@
+"""Adaptive pacing of chunk requests"""
+
+import asyncio
+import time
+from typing import Dict
+
+from module.download_stat import add_flood_wait, update_chunk_rate
+
+
+class _DcPacer:
+    """Pacing state of one data center"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.next_time: float = 0.0
+        self.flood_wait_count: int = 0
+
+
+class ChunkPacer:
+    """AIMD pacer shared by every worker
+
+    Chunk requests to a data center are spaced by `1 / rate` seconds. The
+    rate grows additively while chunks arrive without `FloodWait` and is
+    cut multiplicatively when one is seen, so it settles near the highest
+    rate Telegram tolerates. Every data center keeps its own state.
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 1.0,
+        min_rate: float = 0.1,
+        max_rate: float = 20.0,
+        increase: float = 0.2,
+        decrease: float = 0.5,
+    ):
+        """
+        Parameters
+        ----------
+        initial_rate: float
+            Chunks per second a data center starts with
+
+        min_rate: float
+            Lower limit of the rate
+
+        max_rate: float
+            Upper limit of the rate
+
+        increase: float
+            Chunks per second added for every second without `FloodWait`
+
+        decrease: float
+            Factor applied to the rate on `FloodWait`
+        """
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._dc_pacers: Dict[int, _DcPacer] = {}
+
+    def configure(self, initial_rate: float = None, max_rate: float = None):
+        """Update the limits, data centers already seen keep their rate"""
+        if max_rate is not None and max_rate > 0:
+            self.max_rate = max_rate
+        if initial_rate is not None and initial_rate > 0:
+            self.initial_rate = initial_rate
+        self.min_rate = min(self.min_rate, self.max_rate)
+        self.initial_rate = max(self.min_rate, min(self.initial_rate, self.max_rate))
+
+    def _get_dc_pacer(self, dc_id: int) -> _DcPacer:
+        dc_pacer = self._dc_pacers.get(dc_id)
+        if dc_pacer is None:
+            dc_pacer = _DcPacer(self.initial_rate)
+            self._dc_pacers[dc_id] = dc_pacer
+            update_chunk_rate(dc_id, dc_pacer.rate)
+        return dc_pacer
+
+    def get_rate(self, dc_id: int) -> float:
+        """Current chunk rate of the data center"""
+        return self._get_dc_pacer(dc_id).rate
+
+    async def acquire(self, dc_id: int):
+        """Wait for the next chunk slot of the data center"""
+        dc_pacer = self._get_dc_pacer(dc_id)
+        now = time.monotonic()
+        slot = max(now, dc_pacer.next_time)
+        # 先占位再等待 并发的请求按顺序排开
+        dc_pacer.next_time = slot + 1.0 / dc_pacer.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def on_success(self, dc_id: int):
+        """A chunk arrived without `FloodWait`, increase the rate"""
+        dc_pacer = self._get_dc_pacer(dc_id)
+        # 每个块增加 increase / rate 约等于每秒增加 increase
+        dc_pacer.rate = min(self.max_rate, dc_pacer.rate + self.increase / dc_pacer.rate)
+        update_chunk_rate(dc_id, dc_pacer.rate)
+
+    def on_flood_wait(self, dc_id: int, wait_seconds: float):
+        """`FloodWait` was raised, cut the rate and hold the data center"""
+        dc_pacer = self._get_dc_pacer(dc_id)
+        dc_pacer.rate = max(self.min_rate, dc_pacer.rate * self.decrease)
+        dc_pacer.flood_wait_count += 1
+        add_flood_wait()
+        dc_pacer.next_time = max(dc_pacer.next_time, time.monotonic() + wait_seconds)
+        update_chunk_rate(dc_id, dc_pacer.rate)
+
+
+class FloodWaitBackoff:
+    """FloodWait pause and request rate shared by every task calling the same API
+
+    Telegram limits history requests per account, so when one scanner
+    gets `FloodWait` the others would get it as well. Every scanner waits
+    in `wait` before a request, a `FloodWait` seen by any of them holds all
+    until it is over. With a `rate` the requests of all scanners together
+    are also spaced by `1 / rate` seconds.
+    """
+
+    def __init__(self, rate: float = 0.0):
+        self.rate = rate
+        self.resume_time: float = 0.0
+        self.next_time: float = 0.0
+        self.flood_wait_count: int = 0
+
+    def set_rate(self, rate: float):
+        """Requests per second of all callers together, 0 for no limit"""
+        self.rate = max(0.0, rate)
+
+    def on_flood_wait(self, wait_seconds: float):
+        """`FloodWait` was raised, hold every caller"""
+        self.flood_wait_count += 1
+        self.resume_time = max(self.resume_time, time.monotonic() + wait_seconds)
+
+    async def wait(self):
+        """Wait until no `FloodWait` is pending and the next request slot"""
+        while True:
+            delay = self.resume_time - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        if self.rate > 0:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + 1.0 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
@@ -1,13 +1,49 @@
 """Rewrite pyrogram.get_chat_history"""
 
+import asyncio
+from bisect import bisect_right
+from collections import deque
 from datetime import datetime
-from typing import AsyncGenerator, Optional, Union
+from typing import AsyncGenerator, Iterable, List, Optional, Tuple, Union
 
 import pyrogram
+from pyrogram.errors import FloodWait
 
 # pylint: disable = W0611
 from pyrogram import raw, types, utils
 
+from module.flow_control import FloodWaitBackoff
+from module.raw_message import ScanMessage, decode_messages
+
+# messages.Search 能在服务端筛选的媒体类型组合
+_SEARCH_FILTERS = {
+    frozenset(["audio"]): raw.types.InputMessagesFilterMusic,
+    frozenset(["document"]): raw.types.InputMessagesFilterDocument,
+    frozenset(["photo"]): raw.types.InputMessagesFilterPhotos,
+    frozenset(["video"]): raw.types.InputMessagesFilterVideo,
+    frozenset(["photo", "video"]): raw.types.InputMessagesFilterPhotoVideo,
+}
+
+
+def get_search_filter(media_types: Optional[Iterable[str]]) -> Optional["raw.base.MessagesFilter"]:
+    """
+    Server side filter returning only messages of the media types.
+
+    Parameters
+    ----------
+    media_types: Optional[Iterable[str]]
+        Media types that can be downloaded, see `Filter.implied_media_types`
+
+    Returns
+    -------
+    Optional[raw.base.MessagesFilter]
+        None if no single filter matches, then the whole history is read
+    """
+    if media_types is None:
+        return None
+    search_filter = _SEARCH_FILTERS.get(frozenset(media_types))
+    return search_filter() if search_filter else None
+
 
 async def get_chunk_v2(
     *,
@@ -18,28 +54,64 @@ async def get_chunk_v2(
     max_id: int = 0,
     from_message_id: int = 0,
     from_date: datetime = utils.zero_datetime(),
-    reverse: bool = False
+    reverse: bool = False,
+    backoff: FloodWaitBackoff = None,
+    search_filter: "raw.base.MessagesFilter" = None,
+    lightweight: bool = False,
 ):
-    """get chunk"""
+    """get chunk
+
+    With `backoff` a `FloodWait` is not slept by pyrogram but shared with
+    every other caller of the same backoff. With `search_filter` only the
+    matching messages are requested, by `messages.Search`. With
+    `lightweight` the messages are `ScanMessage`, parsed only on demand.
+    """
     from_message_id = from_message_id or (1 if reverse else 0)
 
-    messages = await utils.parse_messages(
-        client,
-        await client.invoke(
-            raw.functions.messages.GetHistory(
-                peer=await client.resolve_peer(chat_id),
-                offset_id=from_message_id,
-                offset_date=utils.datetime_to_timestamp(from_date),
-                add_offset=offset * (-1 if reverse else 1) - (limit if reverse else 0),
-                limit=limit,
-                max_id=max_id,
-                min_id=0,
-                hash=0,
-            ),
-            sleep_threshold=60,
-        ),
-        replies=0,
-    )
+    while True:
+        if backoff:
+            await backoff.wait()
+        try:
+            add_offset = offset * (-1 if reverse else 1) - (limit if reverse else 0)
+            if search_filter is not None:
+                query = raw.functions.messages.Search(
+                    peer=await client.resolve_peer(chat_id),
+                    q="",
+                    filter=search_filter,
+                    min_date=0,
+                    max_date=0,
+                    offset_id=from_message_id,
+                    add_offset=add_offset,
+                    limit=limit,
+                    max_id=max_id,
+                    min_id=0,
+                    hash=0,
+                )
+            else:
+                query = raw.functions.messages.GetHistory(
+                    peer=await client.resolve_peer(chat_id),
+                    offset_id=from_message_id,
+                    offset_date=utils.datetime_to_timestamp(from_date),
+                    add_offset=add_offset,
+                    limit=limit,
+                    max_id=max_id,
+                    min_id=0,
+                    hash=0,
+                )
+            result = await client.invoke(query, sleep_threshold=0 if backoff else 60)
+            break
+        except FloodWait as e:
+            if not backoff:
+                raise
+            backoff.on_flood_wait(e.value)
+
+    if lightweight:
+        messages = decode_messages(client, result)
+    else:
+        messages = await utils.parse_messages(client, result, replies=0)
+    if search_filter is not None and max_id:
+        # GetHistory 的 max_id 不包含在内 Search 按相同方式处理
+        messages = [message for message in messages if message.id < max_id]
 
     if reverse:
         messages.reverse()
@@ -47,7 +119,13 @@ async def get_chunk_v2(
     return messages
 
 
-# pylint: disable = C0301
+def _discard_result(task: asyncio.Task):
+    """Retrieve the result of a dropped read-ahead request"""
+    if not task.cancelled():
+        task.exception()
+
+
+# pylint: disable = C0301,R0913,R0914
 async def get_chat_history_v2(
     self: pyrogram.Client,
     chat_id: Union[int, str],
@@ -57,33 +135,307 @@ async def get_chat_history_v2(
     offset_id: int = 0,
     offset_date: datetime = utils.zero_datetime(),
     reverse: bool = False,
+    backoff: FloodWaitBackoff = None,
+    read_ahead: int = 0,
+    search_filter: "raw.base.MessagesFilter" = None,
+    lightweight: bool = False,
 ) -> Optional[AsyncGenerator["types.Message", None]]:
-    """Get messages from a chat history."""
+    """Get messages from a chat history.
+
+    Scanners sharing a `backoff` all pause on a `FloodWait` of any of them.
+    With a `search_filter` from `get_search_filter` only the messages of
+    its media types are read. With `lightweight` `ScanMessage` are yielded,
+    call their `parse` for the full message.
+
+    With `read_ahead` the next pages are requested in the background as
+    soon as a page arrives, while it is consumed. The first page ahead
+    starts at the last message of the page just received, further ones
+    skip whole pages from there, messages already yielded are dropped.
+    Requests still running when the consumer stops are cancelled.
+    """
     current = 0
     total = limit or (1 << 31) - 1
     limit = min(100, total)
+    read_ahead = max(0, read_ahead)
 
-    while True:
-        messages = await get_chunk_v2(
-            client=self,
-            chat_id=chat_id,
-            limit=limit,
-            offset=offset,
-            max_id=max_id + 1 if max_id else 0,
-            from_message_id=offset_id,
-            from_date=offset_date,
-            reverse=reverse,
+    def request_page(anchor_id: int, skip_pages: int) -> asyncio.Task:
+        task = asyncio.ensure_future(
+            get_chunk_v2(
+                client=self,
+                chat_id=chat_id,
+                limit=limit,
+                offset=offset + skip_pages * limit,
+                max_id=max_id + 1 if max_id else 0,
+                from_message_id=anchor_id,
+                from_date=offset_date,
+                reverse=reverse,
+                backoff=backoff,
+                search_filter=search_filter,
+                lightweight=lightweight,
+            )
         )
+        task.add_done_callback(_discard_result)
+        return task
+
+    pending: deque = deque()
+    requested = received = 0
+    # 后续页面从 anchor_id 起算 anchor_page 为其后第一页的序号
+    anchor_id, anchor_page = offset_id, 0
+    last_id = None
+    try:
+        while True:
+            if not pending:
+                pending.append(request_page(anchor_id, requested - anchor_page))
+                requested += 1
 
-        if not messages:
-            return
+            messages = await pending.popleft()
+            received += 1
 
-        offset_id = messages[-1].id + (1 if reverse else 0)
+            if not messages:
+                return
 
-        for message in messages:
-            yield message
+            anchor_id = messages[-1].id + (1 if reverse else 0)
+            anchor_page = received
+            while requested < received + read_ahead:
+                pending.append(request_page(anchor_id, requested - anchor_page))
+                requested += 1
 
-            current += 1
+            for message in messages:
+                if last_id is not None and (
+                    message.id <= last_id if reverse else message.id >= last_id
+                ):
+                    continue  # 预读页与上一页重叠
+                last_id = message.id
+                yield message
 
-            if current >= total:
-                return
+                current += 1
+
+                if current >= total:
+                    return
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def get_top_message_id(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    backoff: FloodWaitBackoff = None,
+) -> int:
+    """Id of the newest message of the chat, 0 for an empty chat"""
+    messages = await get_chunk_v2(client=client, chat_id=chat_id, limit=1, backoff=backoff)
+    return messages[0].id if messages else 0
+
+
+def split_id_range(
+    min_id: int, max_id: int, partitions: int, min_size: int = 1
+) -> List[Tuple[int, int]]:
+    """
+    Split `[min_id, max_id]` into disjoint ranges of about the same size.
+
+    Parameters
+    ----------
+    min_id: int
+        First id, included
+
+    max_id: int
+        Last id, included
+
+    partitions: int
+        Number of ranges wanted
+
+    min_size: int
+        Ids a range covers at least, fewer ranges are made for small spans
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        Ranges in ascending order, empty if `max_id < min_id`
+    """
+    span = max_id - min_id + 1
+    if span <= 0:
+        return []
+    partitions = max(1, min(partitions, span // max(1, min_size)))
+    size = -(-span // partitions)
+    return [
+        (start, min(start + size - 1, max_id)) for start in range(min_id, max_id + 1, size)
+    ]
+
+
+class ScanRangeTracker:
+    """Highest id below which every message of a scan is done
+
+    Messages of the ranges are done out of order, so the highest done id
+    is no safe checkpoint. Each range is read oldest first, the watermark
+    stops below its lowest message read but not done yet, and only passes
+    a range once all of its messages were read and marked done.
+    """
+
+    def __init__(self, ranges: List[Tuple[int, int]]):
+        self.ranges = ranges
+        self._starts = [start for start, _ in ranges]
+        self._pending: List[set] = [set() for _ in ranges]
+        self._last_read = [start - 1 for start, _ in ranges]
+        self._exhausted = [False] * len(ranges)
+
+    def _index(self, message_id: int) -> int:
+        return max(0, bisect_right(self._starts, message_id) - 1)
+
+    def on_read(self, idx: int, message_id: int):
+        """Message `message_id` of range `idx` was handed out"""
+        self._pending[idx].add(message_id)
+        self._last_read[idx] = max(self._last_read[idx], message_id)
+
+    def on_exhausted(self, idx: int):
+        """Range `idx` has no more messages"""
+        self._exhausted[idx] = True
+
+    def on_done(self, message_id: int):
+        """The message was processed"""
+        self._pending[self._index(message_id)].discard(message_id)
+
+    def watermark(self) -> int:
+        """Every message up to this id is done"""
+        mark = self.ranges[0][0] - 1 if self.ranges else 0
+        for idx, (_, end) in enumerate(self.ranges):
+            pending = self._pending[idx]
+            if self._exhausted[idx] and not pending:
+                mark = end
+                continue
+            if pending:
+                return max(mark, min(pending) - 1)
+            return max(mark, self._last_read[idx])
+        return mark
+
+
+async def track_history(
+    messages: AsyncGenerator["types.Message", None], tracker: ScanRangeTracker
+) -> AsyncGenerator["types.Message", None]:
+    """Report the messages of a single range scan, oldest first, to `tracker`"""
+    async for message in messages:
+        tracker.on_read(0, message.id)
+        yield message
+
+
+# pylint: disable = R0913
+async def get_chat_history_parallel(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    ranges: List[Tuple[int, int]],
+    ordered: bool = False,
+    buffer: int = 1000,
+    backoff: FloodWaitBackoff = None,
+    read_ahead: int = 0,
+    tracker: ScanRangeTracker = None,
+    search_filter: "raw.base.MessagesFilter" = None,
+    lightweight: bool = False,
+) -> AsyncGenerator["types.Message", None]:
+    """
+    Walk the id ranges of one chat at the same time, oldest first in each.
+
+    Parameters
+    ----------
+    ranges: List[Tuple[int, int]]
+        Disjoint ranges in ascending order, from `split_id_range`
+
+    ordered: bool
+        Yield in id order, later ranges stop reading once their buffer is
+        full until the ranges before them are done. By default messages
+        are yielded as they arrive
+
+    buffer: int
+        Messages buffered per range (ordered) or in total
+
+    backoff: FloodWaitBackoff
+        FloodWait and request rate shared by the ranges
+
+    read_ahead: int
+        Read-ahead pages of every range, see `get_chat_history_v2`
+
+    tracker: ScanRangeTracker
+        Told which range each message came from and when a range ends
+
+    search_filter: raw.base.MessagesFilter
+        Read only matching messages, see `get_chat_history_v2`
+
+    lightweight: bool
+        Yield `ScanMessage`, see `get_chat_history_v2`
+    """
+    if ordered:
+        queues = [asyncio.Queue(maxsize=max(1, buffer)) for _ in ranges]
+    else:
+        queues = [asyncio.Queue(maxsize=max(1, buffer))] * len(ranges)
+
+    async def walk(idx: int, start: int, end: int):
+        try:
+            async for message in get_chat_history_v2(
+                client,
+                chat_id,
+                max_id=end,
+                offset_id=start,
+                reverse=True,
+                backoff=backoff,
+                read_ahead=read_ahead,
+                search_filter=search_filter,
+                lightweight=lightweight,
+            ):
+                await queues[idx].put((idx, message))
+            await queues[idx].put((idx, None))
+        except Exception as e:
+            await queues[idx].put((idx, e))
+
+    tasks = [
+        asyncio.ensure_future(walk(idx, start, end))
+        for idx, (start, end) in enumerate(ranges)
+    ]
+    try:
+        order = range(len(ranges)) if ordered else [0]
+        remaining = len(ranges)
+        for queue_idx in order:
+            while remaining:
+                idx, item = await queues[queue_idx].get()
+                if isinstance(item, Exception):
+                    raise item
+                if item is None:
+                    remaining -= 1
+                    if tracker:
+                        tracker.on_exhausted(idx)
+                    if ordered:
+                        break
+                    continue
+                if tracker:
+                    tracker.on_read(idx, item.id)
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_messages_v2(
+    client: pyrogram.Client,
+    chat_id: Union[int, str],
+    message_ids: List[int],
+) -> List[ScanMessage]:
+    """
+    Get messages by id, like `client.get_messages` but undecoded.
+
+    Parameters
+    ----------
+    chat_id: Union[int, str]
+        Chat of the messages
+
+    message_ids: List[int]
+        At most 200 ids
+
+    Returns
+    -------
+    List[ScanMessage]
+        The messages, deleted ones are empty
+    """
+    peer = await client.resolve_peer(chat_id)
+    ids = [raw.types.InputMessageID(id=message_id) for message_id in message_ids]
+    if isinstance(peer, raw.types.InputPeerChannel):
+        query = raw.functions.channels.GetMessages(channel=peer, id=ids)
+    else:
+        query = raw.functions.messages.GetMessages(id=ids)
+    return decode_messages(client, await client.invoke(query, sleep_threshold=0))
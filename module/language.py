@@ -194,6 +194,11 @@ translations = {
         "Ссылка на файл истекла после 3 попыток, загрузка пропущена",
         "Посилання на файл минуло після 3 спроб, завантаження пропущено",
     ],
+    "has the same content as": [
+        "与以下文件内容相同",
+        "имеет то же содержимое, что и",
+        "має той самий вміст, що й",
+    ],
     "Timeout Error occurred when downloading Message": [
         "下载消息超时错误",
         "Ошибка времени ожидания при скачивании сообщения",
@@ -257,6 +262,29 @@ translations = {
         "Остановить загрузку или пересылку ботом",
         "Зупинити завантаження або пересилання ботом",
     ],
+    "Set bandwidth limit": [
+        "设置带宽限制",
+        "Установить ограничение скорости",
+        "Встановити обмеження швидкості",
+    ],
+    "Invalid command format. Please use /set_bandwidth download/upload 2MB/0/auto [chat_id]": [
+        "无效的命令格式。请使用 /set_bandwidth download/upload 2MB/0/auto [chat_id]",
+        "Неверный формат команды. Пожалуйста, используйте /set_bandwidth download/upload 2MB/0/auto [chat_id]",
+        "Невірний формат команди. Будь ласка, використовуйте /set_bandwidth download/upload 2MB/0/auto [chat_id]",
+    ],
+    "Bandwidth limit set to": [
+        "带宽限制设置为",
+        "Ограничение скорости установлено на",
+        "Обмеження швидкості встановлено на",
+    ],
+    "no limit": ["不限制", "без ограничения", "без обмеження"],
+    "scanned": ["已扫描", "просканировано", "проскановано"],
+    "at message": ["当前消息", "на сообщении", "на повідомленні"],
+    "Scanning in ranges": ["分段扫描", "Сканирование по диапазонам", "Сканування за діапазонами"],
+    "Searching history for": ["按类型搜索历史消息", "Поиск в истории по типу", "Пошук в історії за типом"],
+    "Messages read from cache": ["从缓存读取的消息", "Сообщения из кэша", "Повідомлення з кешу"],
+    "Message cache evicted": ["清理过期消息缓存", "Удалено из кэша сообщений", "Видалено з кешу повідомлень"],
+    "Status index loaded": ["已加载下载状态索引", "Загружен индекс статусов", "Завантажено індекс статусів"],
 }
 
 
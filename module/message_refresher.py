@@ -0,0 +1,116 @@
+"""Coalesce refetches of messages with expired file references"""
+
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+import pyrogram
+
+# 等待同一会话其他刷新请求的时间
+REFRESH_WINDOW = 0.5
+# get_messages 单次最多的消息数
+MAX_REFRESH_BATCH = 200
+
+
+class _RefreshBatch:
+    """Pending refreshes of one chat"""
+
+    def __init__(self):
+        self.waiters: Dict[int, List[asyncio.Future]] = {}
+        self.flush_task: asyncio.Task = None
+
+
+class MessageRefresher:
+    """Refetch messages with one `get_messages` per chat and window
+
+    After a long pause many queued downloads find their file reference
+    expired at once. Instead of one round trip per message, requests of
+    the same chat are collected for `window` seconds, or until
+    `max_batch` ids are pending, and fetched together. Every waiter gets
+    its own message from the result, or the error of the request.
+    """
+
+    def __init__(self, window: float = REFRESH_WINDOW, max_batch: int = MAX_REFRESH_BATCH):
+        """
+        Parameters
+        ----------
+        window: float
+            Seconds to wait for more requests of the same chat
+
+        max_batch: int
+            Ids fetched with one request, at most 200
+        """
+        self.window = window
+        self.max_batch = max(1, min(max_batch, MAX_REFRESH_BATCH))
+        self._batches: Dict[Tuple[int, Any], _RefreshBatch] = {}
+
+    async def refresh(
+        self, client: pyrogram.Client, chat_id: Any, message_id: int
+    ) -> pyrogram.types.Message:
+        """
+        Fetch the message again.
+
+        Parameters
+        ----------
+        client: pyrogram.Client
+            Client the message is fetched with
+
+        chat_id: Any
+            Chat of the message
+
+        message_id: int
+            Id of the message
+
+        Returns
+        -------
+        pyrogram.types.Message
+            The message as returned by `get_messages`
+        """
+        key = (id(client), chat_id)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = _RefreshBatch()
+            self._batches[key] = batch
+            batch.flush_task = asyncio.get_running_loop().create_task(
+                self._flush_later(key, client, chat_id, batch)
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.setdefault(message_id, []).append(future)
+        if len(batch.waiters) >= self.max_batch:
+            # 已满 不再等待窗口结束
+            batch.flush_task.cancel()
+            self._take(key, batch)
+            asyncio.get_running_loop().create_task(self._flush(client, chat_id, batch))
+        return await future
+
+    def _take(self, key: Tuple[int, Any], batch: _RefreshBatch):
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+
+    async def _flush_later(
+        self, key: Tuple[int, Any], client: pyrogram.Client, chat_id: Any, batch: _RefreshBatch
+    ):
+        await asyncio.sleep(self.window)
+        self._take(key, batch)
+        await self._flush(client, chat_id, batch)
+
+    @staticmethod
+    async def _flush(client: pyrogram.Client, chat_id: Any, batch: _RefreshBatch):
+        message_ids = list(batch.waiters)
+        try:
+            messages = await client.get_messages(chat_id=chat_id, message_ids=message_ids)
+            by_id = dict(zip(message_ids, messages))
+            for message_id, futures in batch.waiters.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(by_id.get(message_id))
+        except asyncio.CancelledError:
+            for futures in batch.waiters.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as e:
+            for futures in batch.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
@@ -1,6 +1,8 @@
 """Pyrogram ext"""
 
 import asyncio
+import functools
+import inspect
 import os
 import secrets
 import struct
@@ -9,7 +11,7 @@ from datetime import datetime
 from functools import wraps
 from io import BytesIO, StringIO
 from mimetypes import MimeTypes
-from typing import Callable, Iterable, List, Optional, Union
+from typing import AsyncGenerator, Callable, Iterable, List, Optional, Union
 
 import pyrogram
 from loguru import logger
@@ -19,7 +21,9 @@ from pyrogram.file_id import (
     FILE_REFERENCE_FLAG,
     PHOTO_TYPES,
     WEB_LOCATION_FLAG,
+    FileId,
     FileType,
+    ThumbnailSource,
     b64_decode,
     rle_decode,
 )
@@ -33,9 +37,14 @@ from module.app import (
     UploadProgressStat,
     UploadStatus,
 )
+from module.bandwidth import limit_progress, upload_limiter
+from module.db_writer import DBWriter
 from module.download_stat import get_download_result
 from module.language import Language, _t
+from module.message_refresher import MessageRefresher
 from module.send_media_group_v2 import cache_media, send_media_group_v2
+from module.session_pool import MediaSessionPool
+from module.sqlmodel import MessageCache
 from utils.format import (
     create_progress_bar,
     extract_info_from_link,
@@ -341,6 +350,7 @@ async def _upload_signal_message(
             if app.hide_file_name
             else file_name
         )
+    upload_progress = limit_progress(upload_limiter, node.chat_id, update_upload_stat)
 
     if message.video:
         # Download thumbnail
@@ -357,7 +367,7 @@ async def _upload_signal_message(
                 duration=message.video.duration,
                 caption=message.caption or "",
                 parse_mode=pyrogram.enums.ParseMode.HTML,
-                progress=update_upload_stat,
+                progress=upload_progress,
                 progress_args=(
                     message.id,
                     ui_file_name,
@@ -377,7 +387,7 @@ async def _upload_signal_message(
             upload_telegram_chat_id,
             file_name,
             caption=message.caption,
-            progress=update_upload_stat,
+            progress=upload_progress,
             progress_args=(message.id, ui_file_name, time.time(), node, upload_user),
         )
     elif message.document:
@@ -385,7 +395,7 @@ async def _upload_signal_message(
             upload_telegram_chat_id,
             file_name,
             caption=message.caption,
-            progress=update_upload_stat,
+            progress=upload_progress,
             progress_args=(message.id, ui_file_name, time.time(), node, upload_user),
         )
     elif message.voice:
@@ -393,7 +403,7 @@ async def _upload_signal_message(
             upload_telegram_chat_id,
             file_name,
             caption=message.caption,
-            progress=update_upload_stat,
+            progress=upload_progress,
             progress_args=(message.id, ui_file_name, time.time(), node, upload_user),
         )
     elif message.video_note:
@@ -401,7 +411,7 @@ async def _upload_signal_message(
             upload_telegram_chat_id,
             file_name,
             caption=message.caption,
-            progress=update_upload_stat,
+            progress=upload_progress,
             progress_args=(message.id, ui_file_name, time.time(), node, upload_user),
         )
     elif message.text:
@@ -517,7 +527,9 @@ async def forward_multi_media(
                 client,
                 node.upload_telegram_chat_id,  # type: ignore
                 media_obj,
-                progress=update_upload_stat,
+                progress=limit_progress(
+                    upload_limiter, node.chat_id, update_upload_stat
+                ),
                 progress_args=(
                     message.id,
                     ui_file_name,
@@ -784,19 +796,34 @@ def set_max_concurrent_transmissions(
         )
 
 
+_message_refresher = MessageRefresher()
+_message_cache = MessageCache()
+_db_writer: Optional[DBWriter] = None
+
+
+def set_db_writer(writer: DBWriter):
+    """Write the message cache through `writer` instead of on the event loop"""
+    global _db_writer
+    _db_writer = writer
+
+
 async def fetch_message(client: pyrogram.Client, message: pyrogram.types.Message):
     """
     This function retrieves a message from a specified chat using the Pyrogram library.
+    Refetches of the same chat arriving within a short window are sent as
+    one `get_messages` request.
      Args:
         client (pyrogram.Client): A client instance created using Pyrogram.
         message (pyrogram.types.Message): A message instance returned from Pyrogram.
      Returns:
         pyrogram.types.Message: A message object retrieved from the specified chat.
     """
-    return await client.get_messages(
-        chat_id=message.chat.id,
-        message_ids=message.id,
-    )
+    # 缓存的消息文件引用已旧 下次重新请求
+    if _db_writer is not None:
+        _db_writer.call(_message_cache.forget, message.chat.id, message.id)
+    else:
+        _message_cache.forget(message.chat.id, message.id)
+    return await _message_refresher.refresh(client, message.chat.id, message.id)
 
 
 async def retry(func: Callable, args: tuple = (), max_attempts=3, wait_second=15):
@@ -917,7 +944,8 @@ def set_meta_data(
     meta_data.media_width = getattr(media_obj, "width", None)
     meta_data.media_height = getattr(media_obj, "height", None)
     meta_data.media_duration = getattr(media_obj, "duration", None)
-    meta_data.file_extension = get_extension(
+    # 扫描时的 ScanMedia 没有 file_id 扩展名已算好
+    meta_data.file_extension = getattr(media_obj, "file_extension", None) or get_extension(
         media_obj.file_id, getattr(media_obj, "mime_type", ""), False
     )
 
@@ -1010,8 +1038,15 @@ class HookClient(pyrogram.Client):
                 self.START_TIME_OUT = value
             kwargs.pop("start_timeout")
 
+        media_sessions_per_dc = kwargs.pop("media_sessions_per_dc", 1) or 1
+        media_session_strategy = kwargs.pop("media_session_strategy", "least_loaded")
+
         super().__init__(name, **kwargs)
 
+        self.media_session_pool = MediaSessionPool(
+            self, media_sessions_per_dc, media_session_strategy
+        )
+
     async def connect(
         self,
     ) -> bool:
@@ -1076,6 +1111,139 @@ class HookClient(pyrogram.Client):
 
             return self
 
+    async def disconnect(self):
+        """Stop the media session pool and disconnect the client"""
+        await self.media_session_pool.stop()
+        await super().disconnect()
+
+    @staticmethod
+    def _get_file_location(file_id: FileId):
+        """Input location of the file, see `pyrogram.Client.get_file`"""
+        file_type = file_id.file_type
+
+        if file_type == FileType.CHAT_PHOTO:
+            if file_id.chat_id > 0:
+                peer = pyrogram.raw.types.InputPeerUser(
+                    user_id=file_id.chat_id, access_hash=file_id.chat_access_hash
+                )
+            elif file_id.chat_access_hash == 0:
+                peer = pyrogram.raw.types.InputPeerChat(chat_id=-file_id.chat_id)
+            else:
+                peer = pyrogram.raw.types.InputPeerChannel(
+                    channel_id=pyrogram.utils.get_channel_id(file_id.chat_id),
+                    access_hash=file_id.chat_access_hash,
+                )
+
+            return pyrogram.raw.types.InputPeerPhotoFileLocation(
+                peer=peer,
+                photo_id=file_id.media_id,
+                big=file_id.thumbnail_source == ThumbnailSource.CHAT_PHOTO_BIG,
+            )
+
+        if file_type == FileType.PHOTO:
+            return pyrogram.raw.types.InputPhotoFileLocation(
+                id=file_id.media_id,
+                access_hash=file_id.access_hash,
+                file_reference=file_id.file_reference,
+                thumb_size=file_id.thumbnail_size,
+            )
+
+        return pyrogram.raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=file_id.thumbnail_size,
+        )
+
+    async def get_file(
+        self,
+        file_id: FileId,
+        file_size: int = 0,
+        limit: int = 0,
+        offset: int = 0,
+        progress: Callable = None,
+        progress_args: tuple = (),
+    ) -> Optional[AsyncGenerator[bytes, None]]:
+        """Stream a file through a session of the media session pool
+
+        Unlike `pyrogram.Client.get_file` the session is not opened and
+        closed for every call. Errors are raised to the caller, pyrogram
+        does not sleep through short `FloodWait`s, so every wait reaches
+        the chunk pacer. CDN redirects are left to pyrogram.
+        """
+        # pylint: disable = R0912
+        async with self.get_file_semaphore:
+            location = self._get_file_location(file_id)
+            current = 0
+            total = abs(limit) or (1 << 31) - 1
+            chunk_size = 1024 * 1024
+            offset_bytes = abs(offset) * chunk_size
+
+            pooled = await self.media_session_pool.acquire(file_id.dc_id)
+            failed = False
+            cdn_redirect = False
+            try:
+                r = await pooled.session.invoke(
+                    pyrogram.raw.functions.upload.GetFile(
+                        location=location, offset=offset_bytes, limit=chunk_size
+                    ),
+                    sleep_threshold=0,
+                )
+
+                if isinstance(r, pyrogram.raw.types.upload.FileCdnRedirect):
+                    cdn_redirect = True
+                elif isinstance(r, pyrogram.raw.types.upload.File):
+                    while True:
+                        chunk = r.bytes
+
+                        yield chunk
+
+                        current += 1
+                        offset_bytes += chunk_size
+
+                        if progress:
+                            func = functools.partial(
+                                progress,
+                                min(offset_bytes, file_size)
+                                if file_size != 0
+                                else offset_bytes,
+                                file_size,
+                                *progress_args,
+                            )
+
+                            if inspect.iscoroutinefunction(progress):
+                                await func()
+                            else:
+                                await self.loop.run_in_executor(self.executor, func)
+
+                        if len(chunk) < chunk_size or current >= total:
+                            break
+
+                        r = await pooled.session.invoke(
+                            pyrogram.raw.functions.upload.GetFile(
+                                location=location, offset=offset_bytes, limit=chunk_size
+                            ),
+                            sleep_threshold=0,
+                        )
+            except (
+                pyrogram.StopTransmission,
+                pyrogram.errors.exceptions.flood_420.FloodWait,
+                pyrogram.errors.exceptions.bad_request_400.BadRequest,
+            ):
+                raise
+            except Exception:
+                # 不能吞掉错误 否则截断的数据像正常结束的文件
+                failed = True
+                raise
+            finally:
+                await self.media_session_pool.release(pooled, failed)
+
+        if cdn_redirect:
+            async for chunk in super().get_file(
+                file_id, file_size, limit, offset, progress, progress_args
+            ):
+                yield chunk
+
 
 async def forward_messages(
     client: pyrogram.Client,
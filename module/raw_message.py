@@ -0,0 +1,311 @@
+"""Read the fields the history scan needs straight from raw messages"""
+
+import inspect
+import time
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import pyrogram
+from pyrogram import raw, types, utils
+
+from module.pyrogram_extension import _guess_extension
+
+# 未能识别 mime_type 时的扩展名 与 get_extension 一致
+_DEFAULT_EXTENSIONS = {"audio": "mp3", "video": "mp4", "document": "zip"}
+# types.Message 中文字作为 caption 的媒体
+_CAPTION_MEDIA = (
+    raw.types.MessageMediaPhoto,
+    raw.types.MessageMediaDocument,
+    raw.types.MessageMediaGeo,
+    raw.types.MessageMediaContact,
+    raw.types.MessageMediaVenue,
+    raw.types.MessageMediaGame,
+    raw.types.MessageMediaPoll,
+    raw.types.MessageMediaDice,
+)
+
+
+@lru_cache(maxsize=None)
+def _optional_fields(cls: type) -> Tuple[str, ...]:
+    return tuple(
+        name
+        for name, param in inspect.signature(cls.__init__).parameters.items()
+        if param.default is None
+    )
+
+
+def _write_tl(obj: raw.core.TLObject) -> bytes:
+    """Serialize an object read from Telegram
+
+    An absent optional vector is read as [], but written with its flag
+    unset and its content present, so it is set to None while writing.
+    """
+    emptied = []
+
+    def strip(value):
+        if isinstance(value, list):
+            for item in value:
+                strip(item)
+        elif isinstance(value, raw.core.TLObject):
+            optional = _optional_fields(type(value))
+            for name in value.__slots__:
+                attr = getattr(value, name, None)
+                if attr == [] and name in optional:
+                    emptied.append((value, name))
+                    setattr(value, name, None)
+                else:
+                    strip(attr)
+
+    strip(obj)
+    try:
+        return obj.write()
+    finally:
+        for value, name in emptied:
+            setattr(value, name, [])
+
+
+class ScanMedia:
+    """Media fields of a raw document or photo"""
+
+    def __init__(
+        self,
+        media_type: str,
+        file_size: Optional[int] = None,
+        file_name: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        duration: Optional[int] = None,
+    ):
+        self.file_id = None
+        self.file_size = file_size
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.duration = duration
+        if media_type == "photo":
+            self.file_extension = "jpg"
+        else:
+            self.file_extension = (
+                mime_type and _guess_extension(mime_type)
+            ) or _DEFAULT_EXTENSIONS[media_type]
+
+
+class ScanUser:
+    """Sender of a raw message"""
+
+    def __init__(self, user: raw.types.User):
+        self.id = user.id
+        self.username = user.username
+
+
+def _parse_photo(photo: raw.base.Photo) -> Optional[ScanMedia]:
+    if not isinstance(photo, raw.types.Photo):
+        return None
+    largest = None
+    for size in photo.sizes:
+        if isinstance(size, raw.types.PhotoSize):
+            file_size = size.size
+        elif isinstance(size, raw.types.PhotoSizeProgressive):
+            file_size = max(size.sizes)
+        else:
+            continue
+        if largest is None or file_size >= largest[0]:
+            largest = (file_size, size.w, size.h)
+    if largest is None:
+        return None
+    return ScanMedia("photo", file_size=largest[0], width=largest[1], height=largest[2])
+
+
+def _parse_document(document: raw.base.Document) -> Optional[tuple]:
+    """Media type and fields of a document, the same choice as `types.Message`"""
+    if not isinstance(document, raw.types.Document):
+        return None
+    attributes = {type(i): i for i in document.attributes}
+    file_name = getattr(attributes.get(raw.types.DocumentAttributeFilename), "file_name", None)
+
+    if (
+        raw.types.DocumentAttributeAnimated in attributes
+        or raw.types.DocumentAttributeSticker in attributes
+    ):
+        return None
+
+    video = attributes.get(raw.types.DocumentAttributeVideo)
+    if video:
+        if video.round_message:
+            return None
+        return "video", ScanMedia(
+            "video",
+            file_size=document.size,
+            file_name=file_name,
+            mime_type=document.mime_type,
+            width=video.w,
+            height=video.h,
+            duration=video.duration,
+        )
+
+    audio = attributes.get(raw.types.DocumentAttributeAudio)
+    if audio:
+        if audio.voice:
+            return None
+        return "audio", ScanMedia(
+            "audio",
+            file_size=document.size,
+            file_name=file_name,
+            mime_type=document.mime_type,
+            duration=audio.duration,
+        )
+
+    return "document", ScanMedia(
+        "document", file_size=document.size, file_name=file_name, mime_type=document.mime_type
+    )
+
+
+# pylint: disable = R0902
+class ScanMessage:
+    """Fields of a raw message read by the scan filter
+
+    Has the attributes of `types.Message` used by `need_skip_message` and
+    `set_meta_data`. Only messages passing the filter are turned into a
+    `types.Message` with `parse`, the others cost no users, chats,
+    entities or file ids.
+    """
+
+    def __init__(
+        self,
+        client: pyrogram.Client,
+        message: raw.base.Message,
+        users: Dict[int, raw.base.User],
+        chats: Dict[int, raw.base.Chat],
+    ):
+        self._client = client
+        self._message = message
+        self._users = users
+        self._chats = chats
+
+        self.id = message.id
+        self.empty = isinstance(message, raw.types.MessageEmpty)
+        self.date = None
+        self.caption = None
+        self.from_user = None
+        self.reply_to_message_id = None
+        self.media_group_id = None
+        self.audio = self.video = self.photo = self.document = None
+        if not isinstance(message, raw.types.Message):
+            return
+
+        self.date = utils.timestamp_to_datetime(message.date)
+        self.media_group_id = message.grouped_id
+        if message.reply_to:
+            self.reply_to_message_id = message.reply_to.reply_to_msg_id
+
+        user_id = utils.get_raw_peer_id(message.from_id) or utils.get_raw_peer_id(
+            message.peer_id
+        )
+        user = users.get(user_id)
+        if isinstance(user, raw.types.User):
+            self.from_user = ScanUser(user)
+
+        media = message.media
+        if isinstance(media, raw.types.MessageMediaPhoto):
+            self.photo = _parse_photo(media.photo)
+        elif isinstance(media, raw.types.MessageMediaDocument):
+            parsed = _parse_document(media.document)
+            if parsed:
+                setattr(self, parsed[0], parsed[1])
+
+        if isinstance(media, _CAPTION_MEDIA):
+            self.caption = message.message or None
+
+    @property
+    def chat_id(self) -> int:
+        """Chat id of the message, like `types.Message.chat.id`"""
+        return utils.get_peer_id(self._message.peer_id)
+
+    def dump(self) -> bytes:
+        """The raw message with the users and chats it refers to, see `load_message`"""
+        message = self._message
+        peers = [message.peer_id, message.from_id]
+        if isinstance(message, raw.types.Message) and message.fwd_from:
+            peers.append(message.fwd_from.from_id)
+        peer_ids = {utils.get_raw_peer_id(peer) for peer in peers if peer}
+        if getattr(message, "via_bot_id", None):
+            peer_ids.add(message.via_bot_id)
+        result = raw.types.messages.Messages(
+            messages=[message],
+            chats=[chat for chat_id, chat in self._chats.items() if chat_id in peer_ids],
+            users=[user for user_id, user in self._users.items() if user_id in peer_ids],
+        )
+        return _write_tl(result)
+
+    def to_cache(self, message: "types.Message") -> dict:
+        """Row of `MessageCache`, `message` is the parsed message"""
+        media_type, media = "", None
+        for media_type in ("audio", "video", "photo", "document"):
+            media = getattr(message, media_type, None)
+            if media:
+                break
+        return {
+            "chat_id": self.chat_id,
+            "message_id": self.id,
+            "media_type": media_type if media else None,
+            "file_id": getattr(media, "file_id", None),
+            "file_unique_id": getattr(media, "file_unique_id", None),
+            "file_name": getattr(media, "file_name", None),
+            "mime_type": getattr(media, "mime_type", None),
+            "media_size": getattr(media, "file_size", None),
+            "media_duration": getattr(media, "duration", None),
+            "media_width": getattr(media, "width", None),
+            "media_height": getattr(media, "height", None),
+            "caption": self.caption,
+            "message_date": self._message.date if self.date else None,
+            "raw": self.dump(),
+            "cached_at": int(time.time()),
+        }
+
+    async def parse(self) -> "types.Message":
+        """The full message, as returned by `get_messages`"""
+        # pylint: disable = W0212
+        return await types.Message._parse(
+            self._client, self._message, self._users, self._chats, replies=0
+        )
+
+
+def decode_messages(
+    client: pyrogram.Client, result: raw.base.messages.Messages
+) -> List[ScanMessage]:
+    """
+    Wrap the messages of a `GetHistory` or `Search` result.
+
+    Parameters
+    ----------
+    client: pyrogram.Client
+        Client the messages are parsed with later
+
+    result: raw.base.messages.Messages
+        Raw result of the request
+
+    Returns
+    -------
+    List[ScanMessage]
+        The messages, newest first like `utils.parse_messages`
+    """
+    users = {i.id: i for i in result.users}
+    chats = {i.id: i for i in result.chats}
+    return [ScanMessage(client, message, users, chats) for message in result.messages]
+
+
+def load_message(client: pyrogram.Client, data: bytes) -> ScanMessage:
+    """The message saved by `ScanMessage.dump`"""
+    return decode_messages(client, raw.core.TLObject.read(BytesIO(data)))[0]
+
+
+def get_input_peer_id(peer: raw.base.InputPeer) -> int:
+    """Chat id of a resolved peer, like `types.Chat.id`"""
+    if isinstance(peer, raw.types.InputPeerChannel):
+        return utils.get_channel_id(peer.channel_id)
+    if isinstance(peer, raw.types.InputPeerChat):
+        return -peer.chat_id
+    return getattr(peer, "user_id", 0)
@@ -0,0 +1,86 @@
+"""Staged pipeline for scanning chat history"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+# 每一页的消息数
+HISTORY_PAGE_SIZE = 100
+
+_DONE = object()
+
+Stage = Callable[[Any], Awaitable[Optional[Any]]]
+
+
+class ScanPipeline:
+    """Run a source and stages as tasks connected by bounded queues
+
+    The source is read by its own task into a buffer of `prefetch` items,
+    so paging goes on while later stages wait, for example for room in the
+    download queue. Every stage runs in one task, takes the output of the
+    previous stage and keeps the order; returning None drops the item. The
+    first error cancels every task and is raised from `run`.
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator,
+        stages: List[Stage],
+        prefetch: int,
+        buffer: int = HISTORY_PAGE_SIZE,
+    ):
+        """
+        Parameters
+        ----------
+        source: AsyncIterator
+            Items to process, like the messages of `get_chat_history_v2`
+
+        stages: List[Stage]
+            Coroutine functions applied in order
+
+        prefetch: int
+            Items read ahead from the source
+
+        buffer: int
+            Items waiting between two stages
+        """
+        self.source = source
+        self.stages = stages
+        self.prefetch = max(1, prefetch)
+        self.buffer = max(1, buffer)
+
+    async def _read(self, output: asyncio.Queue):
+        async for item in self.source:
+            await output.put(item)
+        await output.put(_DONE)
+
+    @staticmethod
+    async def _process(stage: Stage, source: asyncio.Queue, output: Optional[asyncio.Queue]):
+        while True:
+            item = await source.get()
+            if item is _DONE:
+                break
+            result = await stage(item)
+            if result is not None and output is not None:
+                await output.put(result)
+        if output is not None:
+            await output.put(_DONE)
+
+    async def run(self):
+        """Process every item of the source"""
+        queues = [asyncio.Queue(maxsize=self.prefetch)]
+        queues += [asyncio.Queue(maxsize=self.buffer) for _ in self.stages[1:]]
+        tasks = [asyncio.ensure_future(self._read(queues[0]))]
+        for idx, stage in enumerate(self.stages):
+            output = queues[idx + 1] if idx + 1 < len(queues) else None
+            tasks.append(asyncio.ensure_future(self._process(stage, queues[idx], output)))
+
+        try:
+            # 任意一个阶段出错就停止全部阶段
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
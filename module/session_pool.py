@@ -0,0 +1,167 @@
+"""Pool of media sessions per data center"""
+
+import asyncio
+from typing import Dict, List
+
+import pyrogram
+from loguru import logger
+from pyrogram.session import Auth, Session
+
+MAX_SESSION_FAILURES = 3
+
+
+class PooledSession:
+    """Media session of the pool with its load and health"""
+
+    def __init__(self, dc_id: int, session: Session):
+        self.dc_id = dc_id
+        self.session = session
+        self.in_flight: int = 0
+        self.requests: int = 0
+        self.failures: int = 0
+
+    @property
+    def healthy(self) -> bool:
+        """If the session did not fail too many times in a row"""
+        return self.failures < MAX_SESSION_FAILURES
+
+
+class MediaSessionPool:
+    """Up to `size` media sessions per data center
+
+    Sessions are opened lazily, only when every open session of the data
+    center is busy, and are handed out round robin or to the least loaded
+    one. A session that fails `MAX_SESSION_FAILURES` times in a row is
+    stopped and replaced on demand.
+    """
+
+    def __init__(self, client: pyrogram.Client, size: int = 1, strategy: str = "least_loaded"):
+        """
+        Parameters
+        ----------
+        client: pyrogram.Client
+            The client owning the sessions
+
+        size: int
+            Maximum sessions per data center
+
+        strategy: str
+            `least_loaded` or `round_robin`
+        """
+        self.client = client
+        self.size = max(1, size)
+        self.strategy = strategy
+        self._sessions: Dict[int, List[PooledSession]] = {}
+        self._next_index: Dict[int, int] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _get_lock(self, dc_id: int) -> asyncio.Lock:
+        lock = self._locks.get(dc_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[dc_id] = lock
+        return lock
+
+    async def _open_session(self, dc_id: int) -> Session:
+        """Start and authorize a media session to the data center"""
+        client = self.client
+        test_mode = await client.storage.test_mode()
+        is_home_dc = dc_id == await client.storage.dc_id()
+        session = Session(
+            client,
+            dc_id,
+            await client.storage.auth_key()
+            if is_home_dc
+            else await Auth(client, dc_id, test_mode).create(),
+            test_mode,
+            is_media=True,
+        )
+        await session.start()
+
+        if not is_home_dc:
+            try:
+                exported_auth = await client.invoke(
+                    pyrogram.raw.functions.auth.ExportAuthorization(dc_id=dc_id)
+                )
+                await session.invoke(
+                    pyrogram.raw.functions.auth.ImportAuthorization(
+                        id=exported_auth.id, bytes=exported_auth.bytes
+                    )
+                )
+            except Exception:
+                await session.stop()
+                raise
+
+        return session
+
+    def _pick(self, sessions: List[PooledSession], dc_id: int) -> PooledSession:
+        if self.strategy == "round_robin":
+            index = self._next_index.get(dc_id, 0) % len(sessions)
+            self._next_index[dc_id] = index + 1
+            return sessions[index]
+        return min(sessions, key=lambda item: item.in_flight)
+
+    async def acquire(self, dc_id: int) -> PooledSession:
+        """Get a session of the data center, opening one when needed"""
+        async with self._get_lock(dc_id):
+            sessions = self._sessions.setdefault(dc_id, [])
+
+            for pooled in [item for item in sessions if not item.healthy]:
+                sessions.remove(pooled)
+                logger.warning(
+                    f"Media session of dc {dc_id} failed {pooled.failures} times, reopening"
+                )
+                if pooled.in_flight == 0:
+                    await self._stop_session(pooled)
+
+            # 所有会话都在忙时才新开会话
+            if len(sessions) < self.size and all(item.in_flight for item in sessions):
+                pooled = PooledSession(dc_id, await self._open_session(dc_id))
+                sessions.append(pooled)
+            else:
+                pooled = self._pick(sessions, dc_id)
+
+            pooled.in_flight += 1
+            pooled.requests += 1
+            return pooled
+
+    async def release(self, pooled: PooledSession, failed: bool = False):
+        """Give the session back and record if the transfer failed"""
+        pooled.in_flight -= 1
+        if failed:
+            pooled.failures += 1
+        else:
+            pooled.failures = 0
+
+        if pooled.in_flight == 0 and pooled not in self._sessions.get(pooled.dc_id, []):
+            # 已被移出连接池 最后一个使用者负责关闭
+            await self._stop_session(pooled)
+
+    @staticmethod
+    async def _stop_session(pooled: PooledSession):
+        try:
+            await pooled.session.stop()
+        except Exception as e:
+            logger.warning(f"Stop media session of dc {pooled.dc_id} failed: {e}")
+
+    async def stop(self):
+        """Stop every session of the pool"""
+        sessions = [pooled for items in self._sessions.values() for pooled in items]
+        self._sessions.clear()
+        for pooled in sessions:
+            await self._stop_session(pooled)
+
+    def get_stats(self) -> dict:
+        """Load and health of every session, grouped by data center"""
+        return {
+            dc_id: [
+                {
+                    "in_flight": pooled.in_flight,
+                    "requests": pooled.requests,
+                    "failures": pooled.failures,
+                    "healthy": pooled.healthy,
+                }
+                for pooled in sessions
+            ]
+            for dc_id, sessions in self._sessions.items()
+        }
@@ -2,6 +2,7 @@ import math
 import os
 from enum import Enum
 from peewee import *
+from playhouse.migrate import SqliteMigrator, migrate
 from datetime import datetime
 from loguru import logger
 from utils import format
@@ -12,7 +13,18 @@ source_db = os.path.join(os.path.abspath("."), "downloaded.db")
 # copyfile(source_db, memory_db)
 # db = SqliteDatabase(memory_db)
 
-db = SqliteDatabase(source_db)
+# WAL 模式下读取不阻塞写入 写入由 DBWriter 批量提交
+db = SqliteDatabase(
+    source_db,
+    pragmas={
+        "journal_mode": "wal",
+        "synchronous": "normal",  # WAL 下只在检查点时 fsync
+        "cache_size": -64 * 1024,  # 64MB
+        "temp_store": "memory",
+        "mmap_size": 256 * 1024 * 1024,
+    },
+    timeout=10,
+)
 
 class UnknownField(object):
     def __init__(self, *_, **__): pass
@@ -95,6 +107,48 @@ def get_similar_rate(msg_dict1, db_results, sizerange_min):
     return similar
 
 
+def same_content(msg_dict: dict, record) -> bool:
+    """两条记录的内容摘要是否一致 任一方没有摘要或算法不同时返回None"""
+    hash1 = msg_dict.get('content_hash')
+    hash2 = getattr(record, 'content_hash', None)
+    if not hash1 or not hash2 or hash1.split(':', 1)[0] != hash2.split(':', 1)[0]:
+        return None
+    return hash1 == hash2
+
+
+def is_similar(msg_dict: dict, record, similar_min: float, sizerange_min: float) -> bool:
+    """record 是否与 msg_dict 等价 不包含自己 有内容摘要时以摘要为准 否则判断文件名是否接近"""
+    if record.chat_id == msg_dict.get('chat_id') and record.message_id == msg_dict.get('message_id'):  # 是自己
+        return False
+    content = same_content(msg_dict, record)
+    if content is not None:
+        return content
+    return get_similar_rate(msg_dict, record, sizerange_min) >= similar_min  # 名字高于相似度阈值
+
+
+def get_similar_records(msg_dict: dict, records: list, similar_min: float, sizerange_min: float,
+                        status: list = None) -> list:
+    """在尚未写入数据库的记录中找等价内容 条件与 Downloaded.get_similar_files 一致"""
+    status_acc = status or [1]
+    media_size_1 = math.floor(msg_dict.get('media_size') * (1 - sizerange_min * 10))
+    media_size_2 = math.floor(msg_dict.get('media_size') * (1 + sizerange_min * 10))
+    similar_file_list = []
+    for record in records:
+        if record.status not in status_acc:
+            continue
+        if same_content(msg_dict, record) is None:
+            # 没有内容摘要时 需要标题比较相似度
+            if not msg_dict.get('title') or not record.title or not record.filename:
+                continue
+            if record.msg_type != msg_dict.get('msg_type') and not (
+                    record.mime_type == msg_dict.get('mime_type')
+                    and media_size_1 <= (record.media_size or 0) <= media_size_2):
+                continue
+        if is_similar(msg_dict, record, similar_min, sizerange_min):
+            similar_file_list.append(record)
+    return similar_file_list
+
+
 
 class Downloaded(BaseModel):
     id = AutoField(primary_key=True, column_name='ID', null=True)
@@ -113,6 +167,8 @@ class Downloaded(BaseModel):
     msg_type = CharField(max_length=200, column_name='TYPE', null=True) #
     msg_link = CharField(max_length=200, column_name='LINK', null=True)  #
     status = IntegerField(column_name='STATUS') #
+    content_hash = CharField(max_length=80, column_name='CONTENT_HASH', null=True)  # <算法>:<摘要>
+    file_path = CharField(max_length=1000, column_name='FILE_PATH', null=True)  # 下载完成后的文件路径
 
     class Meta:
         table_name = 'Downloaded'
@@ -177,20 +233,108 @@ class Downloaded(BaseModel):
                         return 0
         return 0 #0为不存在 1未已完成 2为下载中 3 暂时未使用 4为等效已下载
 
+    def get_status_many(self, chat_id: int, message_ids: list) -> dict:
+        """多条消息的状态 {message_id: status} 没有记录的消息不在结果中"""
+        statuses = {}
+        # SQLite 单条语句的变量数有限 分批查询
+        for i in range(0, len(message_ids), 500):
+            query = Downloaded.select(Downloaded.message_id, Downloaded.status).where(
+                Downloaded.chat_id == chat_id, Downloaded.message_id.in_(message_ids[i:i + 500]))
+            statuses.update(query.tuples())
+        return statuses
+
+    def get_chat_statuses(self, chat_id: int) -> list:
+        """一个频道全部记录的 (message_id, status)"""
+        return list(Downloaded.select(Downloaded.message_id, Downloaded.status).where(
+            Downloaded.chat_id == chat_id).tuples())
+
     def insert_into_db(self, media_dict: dict):
         try:
-            db_status = self.getStatus(chat_id=media_dict.get('chat_id'), message_id=media_dict.get('message_id'))
-            if db_status == 0:  # 不存在记录则插入
-                self.msg_insert_to_db(media_dict)
-            else:  # 存在记录则更新
-                self.msg_update_to_db(media_dict)
-
+            return self.upsert_many([media_dict]) == 1
         except Exception as e:
             # pylint: disable = C0301
             logger.error(
                 f"[{e}].",
                 exc_info=True,
             )
+    @staticmethod
+    def _media_row(media_dict: dict) -> dict:
+        """insert_into_db 写入的字段"""
+        return {
+            Downloaded.chat_id: media_dict['chat_id'],
+            Downloaded.message_id: media_dict['message_id'],
+            Downloaded.filename: media_dict['filename'],
+            Downloaded.caption: media_dict['caption'],
+            Downloaded.title: media_dict['title'],
+            Downloaded.mime_type: media_dict['mime_type'],
+            Downloaded.media_size: media_dict['media_size'],
+            Downloaded.media_duration: media_dict['media_duration'],
+            Downloaded.media_addtime: media_dict['media_addtime'],
+            Downloaded.chat_username: media_dict['chat_username'] or '',
+            Downloaded.chat_title: media_dict['chat_title'],
+            Downloaded.addtime: datetime.now().strftime("%Y-%m-%d %H:%M"),
+            Downloaded.msg_type: media_dict['msg_type'],
+            Downloaded.msg_link: media_dict['msg_link'],
+            Downloaded.status: media_dict['status'],
+            Downloaded.content_hash: media_dict.get('content_hash') or None,
+            Downloaded.file_path: media_dict.get('file_fullname'),
+        }
+
+    def to_media_dict(self) -> dict:
+        """记录转为 _get_media_meta 格式的字典 用于经 DBWriter 更新记录"""
+        return {
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'filename': self.filename,
+            'caption': self.caption,
+            'title': self.title,
+            'mime_type': self.mime_type,
+            'media_size': self.media_size,
+            'media_duration': self.media_duration,
+            'media_addtime': self.media_addtime,
+            'chat_username': self.chat_username,
+            'chat_title': self.chat_title,
+            'msg_type': self.msg_type,
+            'msg_link': self.msg_link,
+            'status': self.status,
+            'content_hash': self.content_hash,
+            'file_fullname': self.file_path,
+        }
+
+    def upsert_many(self, media_dicts: list) -> int:
+        """
+        写入或更新多条记录 依赖 (CHAT_ID, MESSAGE_ID) 唯一索引 见 _migrate_v4
+        同一条消息出现多次时以最后一次为准 ADDTIME 保留首次写入的时间
+        CONTENT_HASH 为空时保留原值 出错时抛出异常
+
+        Parameters
+        ----------
+        media_dicts: list
+            _get_media_meta 的结果
+
+        Returns
+        -------
+        int
+            写入的条数
+        """
+        if not media_dicts:
+            return 0
+        rows = [self._media_row(media_dict) for media_dict in media_dicts]
+        update = {
+            field: getattr(EXCLUDED, field.column_name)
+            for field in rows[0]
+            if field.name not in ('chat_id', 'message_id', 'addtime', 'content_hash')
+        }
+        update[Downloaded.content_hash] = fn.COALESCE(EXCLUDED.CONTENT_HASH, Downloaded.content_hash)
+        with Downloaded._meta.database.atomic():
+            # SQLite 单条语句的变量数有限 分批写入
+            for i in range(0, len(rows), 50):
+                Downloaded.insert_many(rows[i:i + 50]).on_conflict(
+                    conflict_target=[Downloaded.chat_id, Downloaded.message_id],
+                    update=update,
+                ).execute()
+        return len(rows)
+
     def msg_insert_to_db(self, dictit :dict):
         if db.autoconnect == False:
             db.connect()
@@ -220,6 +364,8 @@ class Downloaded(BaseModel):
             downloaded.msg_type = dictit['msg_type']
             downloaded.msg_link = dictit['msg_link']
             downloaded.status = dictit['status']
+            downloaded.content_hash = dictit.get('content_hash')
+            downloaded.file_path = dictit.get('file_fullname')
             downloaded.save()
             # db.close()
             return True
@@ -254,6 +400,9 @@ class Downloaded(BaseModel):
                 downloaded.status = dictit['status']
                 downloaded.msg_type = dictit['msg_type']
                 downloaded.msg_link = dictit['msg_link']
+                if dictit.get('content_hash'):
+                    downloaded.content_hash = dictit['content_hash']
+                downloaded.file_path = dictit.get('file_fullname')
                 downloaded.save()
                 # db.close()
                 return True
@@ -327,18 +476,30 @@ class Downloaded(BaseModel):
             # if msgdict.get('msg_link') == 'https://t.me/TG672/2282':
             #     print ('debug')
 
+            # 判断依据Step1.1： 下载时算出的内容摘要一致的文件记录
+            result_hash = None
+            if msgdict.get('content_hash'):
+                result_hash = Downloaded.select().where(Downloaded.content_hash == msgdict.get('content_hash'),
+                                                        Downloaded.status.in_(status_acc))
+
             # 判断依据Step1.2： 找出类型一致 大小完全一致的文件记录
             result1 = Downloaded.select().where(Downloaded.mime_type == msgdict.get('mime_type'),
                                                    Downloaded.media_size== msgdict.get('media_size'),
                                                    Downloaded.status.in_(status_acc))
+            if result_hash is not None:
+                result1 = result_hash.union(result1)
 
             # 判断依据Step1.3： 找出类型一致 文件名非常像 大小差别在10倍允许值范围的文件记录
             media_size_1 = math.floor(msgdict.get('media_size') * (1 - sizerange_min * 10))
             media_size_2 = math.floor(msgdict.get('media_size') * (1 + sizerange_min * 10))
 
             if not msgdict.get('title') or msgdict.get('title') =='':
-                # 当文件标题不存在或为空时，无法进行相似度比较 返回空列表
-                return []
+                # 当文件标题不存在或为空时，无法进行相似度比较 只看内容摘要
+                if result_hash is None:
+                    return []
+                return [record for record in result_hash if same_content(msgdict, record)
+                        and not (record.chat_id == msgdict.get('chat_id')
+                                 and record.message_id == msgdict.get('message_id'))]
 
             file_core_name = re.sub(r"[-_~～]", ' ', msgdict.get('title', ''))
 
@@ -362,17 +523,8 @@ class Downloaded(BaseModel):
             if len(downloaded) > 20:
                 return []
             for record in downloaded:
-                if record.chat_id == msgdict.get('chat_id') and record.message_id == msgdict.get('message_id'): # 是自己
-                    # if record.status == 1:  # 如果是已完成状态 直接加入列表
-                    #     similar_file_list.append(record)
-                    # else:
-                    #     continue # 如果是未完成状态 则跳过
-                    continue
-                else: # 不是自己 判断文件名是否接近
-                    similar = get_similar_rate(msgdict, record, sizerange_min)
-                    if similar >= similar_min: # 名字高于相似度阈值
-                        similar_file_list.append(record)
-                        continue
+                if is_similar(msgdict, record, similar_min, sizerange_min):
+                    similar_file_list.append(record)
             # db.close()
             if similar_file_list and len(similar_file_list) >= 1:
                 return similar_file_list
@@ -389,6 +541,62 @@ class Downloaded(BaseModel):
             # db.close()
             return None
 
+    def ensure_content_hash_columns(self):
+        """给旧数据库补上 CONTENT_HASH 和 FILE_PATH 列及索引"""
+        if db.autoconnect == False:
+            db.connect()
+        try:
+            _add_content_hash_columns(Downloaded._meta.database)
+            return True
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return False
+
+    def get_files_by_hash(self, content_hash: str, status: list = None):
+        """找出内容摘要相同的记录"""
+        if not content_hash:
+            return []
+        if db.autoconnect == False:
+            db.connect()
+        if status is None or len(status) == 0:
+            status = [1]  # 只找完成下载的
+        try:
+            return list(Downloaded.select().where(Downloaded.content_hash == content_hash,
+                                                  Downloaded.status.in_(status)).order_by(Downloaded.id))
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return []
+
+    def get_hashes_by_path(self, file_paths: list) -> dict:
+        """文件路径对应的已保存内容摘要 {file_path: content_hash}"""
+        if not file_paths:
+            return {}
+        if db.autoconnect == False:
+            db.connect()
+        try:
+            query = Downloaded.select(Downloaded.file_path, Downloaded.content_hash).where(
+                Downloaded.file_path.in_(list(file_paths)), Downloaded.content_hash.is_null(False))
+            return {record.file_path: record.content_hash for record in query}
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return {}
+
+    def get_path_by_hash(self, content_hash: str, exclude_path: str = None):
+        """内容摘要对应的仍存在的文件路径 没有则返回None"""
+        for record in self.get_files_by_hash(content_hash):
+            if record.file_path and record.file_path != exclude_path and os.path.isfile(record.file_path):
+                return record.file_path
+        return None
+
     def get_last_read_message_id(self, chat_username: str):
         last_read_message_id = 1
         chat_username_qry = chat_username
@@ -471,6 +679,225 @@ class Downloaded(BaseModel):
 
 
 
+class MessageCache(BaseModel):
+    """扫描过的消息 重启后重试时不必再向Telegram请求"""
+    chat_id = IntegerField(column_name='CHAT_ID')
+    message_id = IntegerField(column_name='MESSAGE_ID')
+    media_type = CharField(max_length=20, column_name='MEDIA_TYPE', null=True)
+    file_id = CharField(max_length=200, column_name='FILE_ID', null=True)
+    file_unique_id = CharField(max_length=100, column_name='FILE_UNIQUE_ID', null=True)
+    file_name = CharField(max_length=200, column_name='FILE_NAME', null=True)
+    mime_type = CharField(max_length=200, column_name='MIME_TYPE', null=True)
+    media_size = IntegerField(column_name='MEDIA_SIZE', null=True)
+    media_duration = IntegerField(column_name='MEDIA_DURATION', null=True)
+    media_width = IntegerField(column_name='MEDIA_WIDTH', null=True)
+    media_height = IntegerField(column_name='MEDIA_HEIGHT', null=True)
+    caption = TextField(column_name='CAPTION', null=True)
+    message_date = IntegerField(column_name='MESSAGE_DATE', null=True)
+    raw = BlobField(column_name='RAW')  # 原始消息 用于重建完整消息
+    cached_at = IntegerField(column_name='CACHED_AT', index=True)
+
+    class Meta:
+        table_name = 'MessageCache'
+        primary_key = CompositeKey('chat_id', 'message_id')
+
+    def ensure_table(self):
+        """创建缓存表"""
+        database = MessageCache._meta.database
+        if database.autoconnect == False:
+            database.connect(reuse_if_open=True)
+        try:
+            database.create_tables([MessageCache], safe=True)
+            return True
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return False
+
+    def put_messages(self, rows: list):
+        """写入或覆盖缓存 rows 为 ScanMessage.to_cache 的结果"""
+        if not rows:
+            return 0
+        database = MessageCache._meta.database
+        try:
+            with database.atomic():
+                # SQLite 单条语句的变量数有限 分批写入
+                for i in range(0, len(rows), 50):
+                    MessageCache.insert_many(rows[i:i + 50]).on_conflict_replace().execute()
+            return len(rows)
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return 0
+
+    def get_messages(self, chat_id: int, message_ids: list) -> dict:
+        """缓存的原始消息 {message_id: raw}"""
+        if not message_ids:
+            return {}
+        try:
+            query = MessageCache.select(MessageCache.message_id, MessageCache.raw).where(
+                MessageCache.chat_id == chat_id, MessageCache.message_id.in_(list(message_ids)))
+            return {row.message_id: bytes(row.raw) for row in query}
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return {}
+
+    def forget(self, chat_id: int, message_id: int):
+        """文件引用过期后删除缓存 下次重新请求"""
+        try:
+            MessageCache.delete().where(MessageCache.chat_id == chat_id,
+                                        MessageCache.message_id == message_id).execute()
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+
+    def evict(self, max_age_days: float = 0, max_rows: int = 0):
+        """删除超过 max_age_days 天或超出 max_rows 条的最旧缓存 返回删除条数"""
+        removed = 0
+        try:
+            if max_age_days > 0:
+                expire_time = int(datetime.now().timestamp() - max_age_days * 86400)
+                removed += MessageCache.delete().where(MessageCache.cached_at < expire_time).execute()
+            if max_rows > 0:
+                extra = MessageCache.select().count() - max_rows
+                if extra > 0:
+                    cursor = MessageCache._meta.database.execute_sql(
+                        'DELETE FROM "MessageCache" WHERE rowid IN '
+                        '(SELECT rowid FROM "MessageCache" ORDER BY "CACHED_AT" LIMIT ?)', (extra,))
+                    removed += cursor.rowcount
+            return removed
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return removed
+
+
+def _add_content_hash_columns(database):
+    columns = [column.name for column in database.get_columns(Downloaded._meta.table_name)]
+    migrator = SqliteMigrator(database)
+    operations = []
+    if 'CONTENT_HASH' not in columns:
+        operations.append(migrator.add_column(Downloaded._meta.table_name, 'CONTENT_HASH',
+                                              CharField(max_length=80, null=True)))
+    if 'FILE_PATH' not in columns:
+        operations.append(migrator.add_column(Downloaded._meta.table_name, 'FILE_PATH',
+                                              CharField(max_length=1000, null=True)))
+    if operations:
+        migrate(*operations)
+    database.execute_sql('CREATE INDEX IF NOT EXISTS hashidx ON "Downloaded" ("CONTENT_HASH")')
+
+
+def _migrate_v1(database):
+    """CONTENT_HASH FILE_PATH 列"""
+    database.create_tables([Downloaded], safe=True)
+    _add_content_hash_columns(database)
+
+
+# 常用查询对应的组合索引
+DOWNLOADED_INDEXES = {
+    # getStatus getMsg insert_into_db
+    'idx_downloaded_chat_msg': '"CHAT_ID", "MESSAGE_ID"',
+    # getStatus getMsg 按用户名查找 retry_msg_insert_to_db
+    'idx_downloaded_username_msg': '"CHAT_USERNAME", "MESSAGE_ID"',
+    # get_last_read_message_id get2Down
+    'idx_downloaded_username_status_msg': '"CHAT_USERNAME", "STATUS", "MESSAGE_ID"',
+    # load_retry_msg_from_db get_all_message
+    'idx_downloaded_status_chat': '"STATUS", "CHAT_ID", "CHAT_USERNAME"',
+    # get_similar_files
+    'idx_downloaded_mime_size': '"MIME_TYPE", "MEDIA_SIZE"',
+}
+
+
+def _migrate_v2(database):
+    """组合索引及统计信息"""
+    for name, columns in DOWNLOADED_INDEXES.items():
+        start = datetime.now()
+        database.execute_sql(f'CREATE INDEX IF NOT EXISTS "{name}" ON "Downloaded" ({columns})')
+        logger.info(f"数据库索引 {name} 已创建 用时 {(datetime.now() - start).total_seconds():.1f}s")
+    # 只抽样统计 大库也能很快完成
+    database.execute_sql('PRAGMA analysis_limit = 1000')
+    database.execute_sql('ANALYZE')
+
+
+def _migrate_v3(database):
+    """消息缓存表"""
+    database.create_tables([MessageCache], safe=True)
+
+
+def _migrate_v4(database):
+    """(CHAT_ID, MESSAGE_ID) 去重及唯一索引"""
+    # 重复的记录保留已下载的 其次保留最新的
+    cursor = database.execute_sql(
+        'DELETE FROM "Downloaded" WHERE "ID" IN ('
+        ' SELECT "ID" FROM ('
+        '  SELECT "ID", ROW_NUMBER() OVER ('
+        '   PARTITION BY "CHAT_ID", "MESSAGE_ID" ORDER BY "STATUS" = 1 DESC, "ID" DESC'
+        '  ) AS "RANK" FROM "Downloaded"'
+        ' ) WHERE "RANK" > 1)'
+    )
+    logger.info(f"删除重复记录 {cursor.rowcount} 条")
+    # 唯一索引取代同列的 idx_downloaded_chat_msg 旧版数据库可能已有 indexids
+    database.execute_sql('DROP INDEX IF EXISTS "idx_downloaded_chat_msg"')
+    if not any(
+        index.unique and [column.upper() for column in index.columns] == ['CHAT_ID', 'MESSAGE_ID']
+        for index in database.get_indexes(Downloaded._meta.table_name)
+    ):
+        database.execute_sql(
+            'CREATE UNIQUE INDEX "uq_downloaded_chat_msg" ON "Downloaded" ("CHAT_ID", "MESSAGE_ID")'
+        )
+
+
+# 按顺序执行 版本号记录在 PRAGMA user_version
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4]
+
+
+def get_schema_version() -> int:
+    """当前数据库版本"""
+    database = Downloaded._meta.database
+    return database.execute_sql('PRAGMA user_version').fetchone()[0]
+
+
+def migrate_schema() -> bool:
+    """
+    升级数据库到最新版本 每个版本一个事务 中断后下次从未完成的版本继续
+
+    Returns
+    -------
+    bool
+        是否全部完成
+    """
+    database = Downloaded._meta.database
+    if database.autoconnect == False:
+        database.connect(reuse_if_open=True)
+    version = get_schema_version()
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        start = datetime.now()
+        logger.info(f"数据库升级到版本 {target}: {migration.__doc__}...")
+        try:
+            with database.atomic():
+                migration(database)
+                database.execute_sql(f'PRAGMA user_version = {target}')
+        except Exception as e:
+            logger.error(
+                f"[{e}].",
+                exc_info=True,
+            )
+            return False
+        logger.info(f"数据库版本 {target} 完成 用时 {(datetime.now() - start).total_seconds():.1f}s")
+    return True
+
+
 class SqliteSequence(BaseModel):
     name = BareField(null=True)
     seq = BareField(null=True)
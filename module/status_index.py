@@ -0,0 +1,124 @@
+"""In-memory status of the download records of each chat"""
+
+import asyncio
+import sys
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from module.language import _t
+
+# 每页记录的消息数 用到时才分配
+PAGE_SIZE = 1 << 12
+
+Loader = Callable[[int], Awaitable[Iterable[Tuple[int, int]]]]
+
+
+class StatusIndex:
+    """Download status of every message of the chats touched so far
+
+    A chat is loaded with one query the first time one of its messages
+    is looked up, then kept as pages of `PAGE_SIZE` bytes, one byte per
+    message id, allocated only for the id spans holding records. Statuses
+    committed by `DBWriter` are applied right away, so rescanning a chat
+    needs no query per message.
+    """
+
+    def __init__(self):
+        self._chats: Dict[int, Dict[int, bytearray]] = {}
+        self._counts: Dict[int, int] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        # 加载期间的写入 加载完成后补上
+        self._writes: Dict[int, List[Tuple[int, int]]] = {}
+
+    def is_loaded(self, chat_id: int) -> bool:
+        """If the chat is in the index"""
+        return chat_id in self._chats
+
+    async def load(self, chat_id: int, loader: Loader):
+        """
+        Load a chat once, concurrent calls wait for the same query.
+
+        Parameters
+        ----------
+        chat_id: int
+            Chat id
+
+        loader: Loader
+            Returns the (message_id, status) of the records of a chat
+        """
+        if chat_id in self._chats:
+            return
+        task = self._loading.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(chat_id, loader))
+            self._loading[chat_id] = task
+        await asyncio.shield(task)
+
+    async def _load(self, chat_id: int, loader: Loader):
+        self._writes[chat_id] = []
+        try:
+            rows = await loader(chat_id)
+            pages: Dict[int, bytearray] = {}
+            count = 0
+            for message_id, status in list(rows) + self._writes[chat_id]:
+                count += self._store(pages, message_id, status)
+            self._chats[chat_id] = pages
+            self._counts[chat_id] = count
+        finally:
+            self._writes.pop(chat_id, None)
+            self._loading.pop(chat_id, None)
+        logger.info(
+            f"{_t('Status index loaded')} {chat_id}: {self._counts[chat_id]}, "
+            f"{self.get_stats()['bytes'] / 1024 / 1024:.1f} MB"
+        )
+
+    @staticmethod
+    def _store(pages: Dict[int, bytearray], message_id: int, status: int) -> int:
+        """Store a status, the change of the record count"""
+        if message_id <= 0 or not 0 <= status < 256:
+            return 0
+        page_no, offset = divmod(message_id, PAGE_SIZE)
+        page = pages.get(page_no)
+        if page is None:
+            if not status:
+                return 0
+            page = pages[page_no] = bytearray(PAGE_SIZE)
+        old = page[offset]
+        page[offset] = status
+        return bool(status) - bool(old)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[int]:
+        """Status of a message, 0 without a record, None if not indexed"""
+        pages = self._chats.get(chat_id)
+        if pages is None or message_id <= 0:
+            return None
+        page_no, offset = divmod(message_id, PAGE_SIZE)
+        page = pages.get(page_no)
+        return page[offset] if page is not None else 0
+
+    def set(self, chat_id: int, message_id: int, status: int):
+        """Apply a written status, chats not loaded are skipped"""
+        if chat_id in self._writes:
+            self._writes[chat_id].append((message_id, status))
+            return
+        pages = self._chats.get(chat_id)
+        if pages is None:
+            return
+        self._counts[chat_id] += self._store(pages, message_id, status)
+
+    def forget(self, chat_id: int):
+        """Drop a chat, it is loaded again when touched"""
+        self._chats.pop(chat_id, None)
+        self._counts.pop(chat_id, None)
+
+    def get_stats(self) -> dict:
+        """Chats and records in the index and the memory used"""
+        return {
+            "chats": len(self._chats),
+            "records": sum(self._counts.values()),
+            "bytes": sum(
+                sys.getsizeof(pages) + sum(sys.getsizeof(page) for page in pages.values())
+                for pages in self._chats.values()
+            ),
+        }
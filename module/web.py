@@ -9,10 +9,14 @@ from flask_login import LoginManager, UserMixin, login_required, login_user
 
 import utils
 from module.app import Application
+from module.bandwidth import download_limiter, upload_limiter
 from module.download_stat import (
     DownloadState,
+    get_bandwidth_stat,
+    get_chat_queue_stat,
     get_download_result,
     get_download_state,
+    get_scan_progress,
     get_total_download_speed,
     set_download_state,
 )
@@ -147,13 +151,80 @@ def index():
 @login_required
 def get_download_speed():
     """Get download speed"""
+    upload_speed = get_bandwidth_stat().get("upload", {}).get("speed", 0)
     return (
         '{ "download_speed" : "'
         + format_byte(get_total_download_speed())
-        + '/s" , "upload_speed" : "0.00 B/s" } '
+        + '/s" , "upload_speed" : "'
+        + format_byte(upload_speed)
+        + '/s" } '
     )
 
 
+@_flask_app.route("/get_bandwidth_limit")
+@login_required
+def web_get_bandwidth_limit():
+    """Get bandwidth limits and transferred bytes"""
+    stat = get_bandwidth_stat()
+    result = {}
+    for limiter in (download_limiter, upload_limiter):
+        limits = limiter.get_stats()
+        result[limiter.direction] = {
+            "global": limits["global"],
+            "chats": {str(key): value for key, value in limits["chats"].items()},
+            "total_bytes": stat.get(limiter.direction, {}).get("total_bytes", 0),
+        }
+    return jsonify(result)
+
+
+@_flask_app.route("/set_bandwidth_limit", methods=["POST"])
+@login_required
+def web_set_bandwidth_limit():
+    """Override a bandwidth limit, `limit=auto` goes back to the config"""
+    if request.args.get("direction") == "upload":
+        limiter = upload_limiter
+    else:
+        limiter = download_limiter
+    limit = request.args.get("limit", "auto")
+    chat_id = request.args.get("chat_id")
+    if chat_id and chat_id.lstrip("-").isdigit():
+        chat_id = int(chat_id)
+
+    if not limiter.set_override(None if limit == "auto" else limit, chat_id or None):
+        return jsonify({"error": f"invalid limit {limit}"}), 400
+    limits = limiter.get_stats()
+    if chat_id:
+        return jsonify(limits["chats"][chat_id])
+    return jsonify(limits["global"])
+
+
+@_flask_app.route("/get_chat_queue_stat")
+@login_required
+def web_get_chat_queue_stat():
+    """Get scan progress, queue depth and served bytes of every chat"""
+    queue_stat = get_chat_queue_stat()
+    scan_progress = get_scan_progress()
+    result = []
+    for chat_id in list(dict.fromkeys([*scan_progress, *queue_stat])):
+        value = queue_stat.get(chat_id, {})
+        progress = scan_progress.get(chat_id, {})
+        result.append(
+            {
+                "chat": str(chat_id),
+                "scanned": progress.get("scanned", 0),
+                "scan_state": (
+                    "" if not progress else "done" if progress["finished"] else "scanning"
+                ),
+                "queued": value.get("queued", 0),
+                "in_flight": value.get("in_flight", 0),
+                "served_count": value.get("served_count", 0),
+                "served_bytes": format_byte(value.get("served_bytes", 0)),
+                "weight": value.get("weight", 1.0),
+            }
+        )
+    return jsonify(result)
+
+
 @_flask_app.route("/set_download_state", methods=["POST"])
 @login_required
 def web_set_download_state():
@@ -0,0 +1,86 @@
+"""Benchmark of scan-time message decoding.
+
+Compares `utils.parse_messages` with `decode_messages` on 10k messages
+of a typical channel, mostly text with some audio, video and photos.
+
+Run from the repository root::
+
+    python tests/module/benchmark_raw_message.py
+"""
+import asyncio
+import sys
+import time
+
+from pyrogram import raw, utils
+
+sys.path.insert(0, ".")  # Run from the repository root.
+from module.raw_message import decode_messages
+from tests.module.test_raw_message import MockClient, document, history, photo
+
+MESSAGES = 10000
+ROUNDS = 5
+
+
+def build_history(count: int):
+    medias = []
+    for idx in range(count):
+        kind = idx % 10
+        if kind == 0:
+            medias.append(
+                document(
+                    [
+                        raw.types.DocumentAttributeAudio(duration=200),
+                        raw.types.DocumentAttributeFilename(file_name=f"{idx}.mp3"),
+                    ],
+                    mime_type="audio/mpeg",
+                )
+            )
+        elif kind == 1:
+            medias.append(
+                document(
+                    [raw.types.DocumentAttributeVideo(duration=60, w=1280, h=720)],
+                    mime_type="video/mp4",
+                )
+            )
+        elif kind == 2:
+            medias.append(photo())
+        else:
+            medias.append(None)
+    return history(*medias)
+
+
+async def bench(name: str, decode):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await decode()
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<40} {best * 1000:8.1f} ms / {MESSAGES} messages")
+    return best
+
+
+async def main():
+    client = MockClient()
+    result = build_history(MESSAGES)
+
+    async def full():
+        await utils.parse_messages(client, result, replies=0)
+
+    async def scan():
+        decode_messages(client, result)
+
+    async def scan_and_parse_media():
+        # 通过过滤的媒体消息仍需完整解析
+        for message in decode_messages(client, result):
+            if message.audio or message.video or message.photo or message.document:
+                await message.parse()
+
+    full_time = await bench("parse_messages", full)
+    scan_time = await bench("decode_messages", scan)
+    both_time = await bench("decode_messages + parse media", scan_and_parse_media)
+    print(f"decode only: {full_time / scan_time:.1f}x faster")
+    print(f"decode + parse media: {full_time / both_time:.1f}x faster")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,6 +7,7 @@ from unittest import mock
 
 import module.app
 from module.app import Application, ChatDownloadConfig, DownloadStatus
+from module.get_chat_history_v2 import ScanRangeTracker
 
 sys.path.append("..")  # Adds higher directory to python modules path.
 
@@ -60,6 +61,28 @@ class AppTestCase(unittest.TestCase):
             app.app_data["chat"][0]["ids_to_retry"],
         )
 
+    def test_update_config_watermark(self):
+        app = Application("", "")
+        app.chat_download_config[123] = ChatDownloadConfig()
+        tracker = ScanRangeTracker([(6, 6)])
+        app.chat_download_config[123].node.scan_tracker = tracker
+        for message_id in (6, 8, 20):
+            tracker.on_read(0, message_id)
+        tracker.on_done(6)
+        tracker.on_done(20)
+        app.chat_download_config[123].node.download_status[
+            20
+        ] = DownloadStatus.SuccessDownload
+        app.config["chat"] = [{"chat_id": 123, "last_read_message_id": 5}]
+
+        app.update_config(False)
+        # message 8 is not done yet
+        self.assertEqual(app.config["chat"][0]["last_read_message_id"], 7)
+
+        tracker.on_done(8)
+        app.update_config(False)
+        self.assertEqual(app.config["chat"][0]["last_read_message_id"], 20)
+
     @mock.patch("__main__.__builtins__.open", new_callable=mock.mock_open)
     @mock.patch("module.app.yaml", autospec=True)
     def test_update_config(self, mock_yaml, mock_open):
@@ -69,3 +92,17 @@ class AppTestCase(unittest.TestCase):
         app.config["chat"] = [{"chat_id": 123, "last_read_message_id": 0}]
         app.update_config()
         mock_open.assert_called_with("data_test.yaml", "w", encoding="utf-8")
+
+    def test_get_download_segments(self):
+        app = Application("", "")
+        self.assertEqual(app.get_download_segments("video"), 1)
+
+        app.download_segments = {"video": 6, "audio": "2", "default": 3}
+        app.max_download_segments = 4
+        self.assertEqual(app.get_download_segments("video"), 4)
+        self.assertEqual(app.get_download_segments("audio"), 2)
+        self.assertEqual(app.get_download_segments("document"), 3)
+
+        app.download_segments = {"video": "bad", "photo": 0}
+        self.assertEqual(app.get_download_segments("video"), 1)
+        self.assertEqual(app.get_download_segments("photo"), 1)
@@ -0,0 +1,115 @@
+"""Unittest module for awaitable database access."""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from peewee import SqliteDatabase
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.async_db import AsyncDB
+from module.db_writer import DBWriter
+from module.sqlmodel import Downloaded, MessageCache, migrate_schema
+from module.status_index import StatusIndex
+from tests.module.test_sqlmodel import LEGACY_SCHEMA, _media_dict
+
+
+class AsyncDBTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = SqliteDatabase(os.path.join(self.temp_dir.name, "test.db"))
+        self.database.execute_sql(LEGACY_SCHEMA)
+        self.bind = self.database.bind_ctx([Downloaded, MessageCache])
+        self.bind.__enter__()
+        migrate_schema()
+        medias = [_media_dict(idx, None, None) for idx in range(1, 6)]
+        medias[1]["status"] = 2
+        other = _media_dict(1, None, None)
+        other["chat_id"] = 2
+        Downloaded().upsert_many(medias + [other])
+        self.db = AsyncDB()
+
+    def tearDown(self):
+        self.db.shutdown()
+        self.bind.__exit__(None, None, None)
+        self.database.close()
+        self.temp_dir.cleanup()
+
+    def test_get_status_batched(self):
+        async def run():
+            return await asyncio.gather(
+                *[self.db.get_status(1, message_id) for message_id in (1, 2, 2, 9)],
+                self.db.get_status(2, 1),
+                self.db.get_status(2, 2),
+            )
+
+        self.assertEqual(asyncio.run(run()), [1, 2, 2, 0, 1, 0])
+        # 每个频道一次查询
+        self.assertEqual(self.db.get_stats(), {"requests": 6, "queries": 2, "index_hits": 0})
+
+    def test_get_status_many(self):
+        async def run():
+            return await self.db.get_status_many(1, list(range(0, 1200)))
+
+        statuses = asyncio.run(run())
+        self.assertEqual(len(statuses), 1200)
+        self.assertEqual([statuses[i] for i in range(7)], [0, 1, 2, 1, 1, 1, 0])
+
+    def test_run_on_db_thread(self):
+        async def run():
+            return await self.db.run(threading.current_thread)
+
+        self.assertIsNot(asyncio.run(run()), threading.current_thread())
+
+        async def get_msg():
+            return await self.db.get_msg(1, 2, 2)
+
+        self.assertEqual(asyncio.run(get_msg()).message_id, 2)
+
+    def test_status_index(self):
+        self.db.status_index = StatusIndex()
+        writer = DBWriter(flush_interval=0, status_index=self.db.status_index)
+
+        async def run():
+            statuses = await asyncio.gather(
+                *[self.db.get_status(1, message_id) for message_id in (1, 2, 9)]
+            )
+            await writer.write(_media_dict(9, None, None))
+            statuses.append(await self.db.get_status(1, 9))
+            return statuses
+
+        self.assertEqual(asyncio.run(run()), [1, 2, 0, 1])
+        writer.stop()
+        # 整个频道只查询一次
+        self.assertEqual(self.db.get_stats(), {"requests": 0, "queries": 0, "index_hits": 4})
+        self.assertEqual(self.db.status_index.get_stats()["records"], 6)
+
+    def test_similar_files_not_committed(self):
+        writer = DBWriter(flush_interval=10)
+        self.db.writer = writer
+        medias = []
+        for message_id in (100, 101):
+            media = _media_dict(message_id, None, None)
+            media.update(filename="holiday.mkv", title="holiday", mime_type="mkv", media_size=999)
+            medias.append(media)
+
+        async def run():
+            before = await self.db.get_similar_files(medias[1], 0.9, 0.01, [1, 2])
+            # 第一条已决定下载 尚未写入数据库
+            writer.reserve({**medias[0], "status": 2})
+            reserved = await self.db.get_similar_files(medias[1], 0.9, 0.01, [1, 2])
+            writer.put({**medias[0], "status": 2})
+            queued = await self.db.get_similar_files(medias[1], 0.9, 0.01, [1, 2])
+            return before, reserved, queued
+
+        before, reserved, queued = asyncio.run(run())
+        self.assertEqual(before, [])
+        self.assertEqual([(file.message_id, file.status) for file in reserved], [(100, 2)])
+        self.assertEqual([(file.message_id, file.status) for file in queued], [(100, 2)])
+        writer.stop()
+        self.assertEqual(writer.get_pending(), [])
+        # 提交后从数据库读到
+        files = asyncio.run(self.db.get_similar_files(medias[1], 0.9, 0.01, [1, 2]))
+        self.assertEqual([file.message_id for file in files], [100])
@@ -0,0 +1,62 @@
+"""Unittest module for download worker autoscaler."""
+import asyncio
+import sys
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.autoscaler import WorkerAutoscaler
+
+MB = 1024 * 1024
+
+
+class WorkerAutoscalerTestCase(unittest.TestCase):
+    def test_scale_up_on_backlog(self):
+        scaler = WorkerAutoscaler(min_workers=2, max_workers=3)
+        self.assertEqual(scaler.decide(10 * MB, 0, 100), "queue backlog")
+        self.assertEqual(scaler.target, 3)
+        # the new worker helped, keep it; the upper bound is reached
+        self.assertIsNone(scaler.decide(12 * MB, 0, 100))
+        self.assertEqual(scaler.target, 3)
+
+    def test_retire_useless_worker(self):
+        scaler = WorkerAutoscaler(min_workers=2, max_workers=10, hold_rounds=2)
+        scaler.decide(10 * MB, 0, 100)
+        self.assertEqual(scaler.decide(10 * MB, 0, 100), "no throughput gain")
+        self.assertEqual(scaler.target, 2)
+        # held back for a while
+        self.assertIsNone(scaler.decide(10 * MB, 0, 100))
+        self.assertEqual(scaler.decide(10 * MB, 0, 100), "queue backlog")
+
+    def test_flood_wait_and_empty_queue(self):
+        scaler = WorkerAutoscaler(min_workers=1, max_workers=8)
+        scaler.target = 8
+        self.assertEqual(scaler.decide(MB, 3, 100), "FloodWait")
+        self.assertEqual(scaler.target, 6)
+        self.assertEqual(scaler.decide(MB, 0, 0), "queue empty")
+        self.assertEqual(scaler.target, 5)
+        scaler.target = 1
+        self.assertIsNone(scaler.decide(MB, 5, 0))
+
+    def test_workers_retire(self):
+        scaler = WorkerAutoscaler(min_workers=3, max_workers=3)
+        retired = []
+
+        async def worker(idx):
+            while True:
+                if scaler.should_retire():
+                    retired.append(idx)
+                    return
+                await asyncio.sleep(0.01)
+
+        async def run():
+            counter = iter(range(10))
+            scaler.start(asyncio.get_running_loop(), lambda: worker(next(counter)))
+            self.assertEqual(len(scaler.tasks), 3)
+            scaler.target = 1
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(retired), 2)
+            self.assertEqual(len(scaler.tasks), 1)
+            scaler.stop()
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
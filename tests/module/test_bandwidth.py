@@ -0,0 +1,108 @@
+"""Unittest module for bandwidth limiter."""
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.bandwidth import (
+    BandwidthLimiter,
+    TokenBucket,
+    limit_progress,
+    parse_rate,
+    parse_schedule,
+    scheduled_rate,
+)
+from module.download_stat import get_bandwidth_stat
+
+
+class BandwidthTestCase(unittest.TestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("2MB"), 2 * 1024 * 1024)
+        self.assertEqual(parse_rate("512KB/s"), 512 * 1024)
+        self.assertEqual(parse_rate(1000), 1000)
+        self.assertEqual(parse_rate("0"), 0)
+        self.assertEqual(parse_rate(""), 0)
+        self.assertIsNone(parse_rate("fast"))
+
+    def test_schedule(self):
+        ranges = parse_schedule(
+            [
+                {"start": "09:00", "end": "18:00", "download": "1MB"},
+                {"start": "23:00", "end": "06:00", "download": 0, "upload": "1KB"},
+                {"start": "bad", "end": "06:00", "download": "1MB"},
+            ],
+            "download",
+        )
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(scheduled_rate(ranges, 5, datetime(2024, 1, 1, 10)), 1024 * 1024)
+        self.assertEqual(scheduled_rate(ranges, 5, datetime(2024, 1, 1, 2)), 0)
+        self.assertEqual(scheduled_rate(ranges, 5, datetime(2024, 1, 1, 20)), 5)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1000)
+        self.assertEqual(bucket.reserve(1000), 0)
+        # the next 500 bytes are in debt
+        self.assertAlmostEqual(bucket.reserve(500), 0.5, places=1)
+        self.assertEqual(TokenBucket(rate=0).reserve(10**9), 0)
+
+    def test_consume_waits_for_chat_limit(self):
+        limiter = BandwidthLimiter("download")
+        limiter.configure_chat(1, 10000)
+
+        async def run():
+            start = time.monotonic()
+            await limiter.consume(10000, 2)  # other chat is not limited
+            await limiter.consume(10000, 1)
+            await limiter.consume(2000, 1)
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.15)
+        self.assertGreaterEqual(get_bandwidth_stat()["download"]["total_bytes"], 22000)
+
+    def test_override(self):
+        limiter = BandwidthLimiter("upload")
+        limiter.configure("1MB")
+        self.assertTrue(limiter.set_override("2MB"))
+        self.assertEqual(limiter.get_limit(), 2 * 1024 * 1024)
+        self.assertFalse(limiter.set_override("fast"))
+        limiter.set_override(None)
+        self.assertEqual(limiter.get_limit(), 1024 * 1024)
+        self.assertEqual(limiter.get_stats()["global"]["limit"], 1024 * 1024)
+
+    def test_override_from_other_thread(self):
+        limiter = BandwidthLimiter("download")
+        limiter.configure("1MB")
+
+        def set_overrides():
+            for chat_id in range(2000):
+                limiter.set_override("2MB", chat_id)
+
+        thread = threading.Thread(target=set_overrides)
+        thread.start()
+        while thread.is_alive():
+            limiter._next_refresh = 0.0
+            limiter._refresh()
+            limiter.get_stats()
+        thread.join()
+        self.assertEqual(len(limiter.get_stats()["chats"]), 2000)
+        self.assertEqual(limiter.get_limit(1999), 2 * 1024 * 1024)
+
+    def test_limit_progress(self):
+        limiter = BandwidthLimiter("upload")
+        reported = []
+
+        async def progress(current, total, name):
+            reported.append((current, total, name))
+
+        async def run():
+            callback = limit_progress(limiter, None, progress)
+            await callback(100, 300, "a")
+            await callback(300, 300, "a")
+
+        before = get_bandwidth_stat().get("upload", {}).get("total_bytes", 0)
+        asyncio.run(run())
+        self.assertEqual(reported, [(100, 300, "a"), (300, 300, "a")])
+        self.assertEqual(get_bandwidth_stat()["upload"]["total_bytes"] - before, 300)
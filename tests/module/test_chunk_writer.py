@@ -0,0 +1,71 @@
+"""Unittest module for chunk writer."""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.chunk_writer import ChunkWriter
+from utils.download_storage import DownloadStorage
+
+
+class RecordStorage(DownloadStorage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = []
+
+    def write_chunks(self, start_id, chunks):
+        self.writes.append((start_id, len(chunks)))
+        return super().write_chunks(start_id, chunks)
+
+
+class ChunkWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.part_file = os.path.join(self.temp_dir.name, "1.part")
+        self.data = os.urandom(10 * 1024)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _chunk(self, chunk_id):
+        return self.data[chunk_id * 1024 : (chunk_id + 1) * 1024]
+
+    def test_write_and_coalesce(self):
+        storage = RecordStorage(self.part_file, 10 * 1024, chunk_size=1024)
+        storage.open()
+
+        async def run():
+            writer = ChunkWriter(storage, max_pending=16)
+            # chunks of two segments arrive interleaved
+            for chunk_id in (0, 5, 1, 6, 2, 7, 3, 8, 4, 9):
+                await writer.put(chunk_id, self._chunk(chunk_id))
+            await writer.close()
+
+        asyncio.run(run())
+        storage.close()
+
+        self.assertTrue(storage.is_complete())
+        self.assertLess(len(storage.writes), 10)
+        with open(self.part_file, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_write_error(self):
+        storage = DownloadStorage(self.part_file, 10 * 1024, chunk_size=1024)
+        storage.open()
+
+        async def run():
+            writer = ChunkWriter(storage, max_pending=1)
+            await writer.put(0, b"short")
+            for chunk_id in range(1, 4):
+                try:
+                    await writer.put(chunk_id, self._chunk(chunk_id))
+                except IOError:
+                    break
+            with self.assertRaises(IOError):
+                await writer.close()
+
+        asyncio.run(run())
+        storage.close()
+        self.assertFalse(storage.manifest.is_done(0))
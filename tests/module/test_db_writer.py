@@ -0,0 +1,145 @@
+"""Unittest module for batched database writer."""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+from peewee import SqliteDatabase
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.db_writer import DBWriter
+from module.sqlmodel import Downloaded, MessageCache, migrate_schema
+from module.status_index import StatusIndex
+from tests.module.test_sqlmodel import LEGACY_SCHEMA, _media_dict
+
+
+class DBWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = SqliteDatabase(
+            os.path.join(self.temp_dir.name, "test.db"), pragmas={"journal_mode": "wal"}
+        )
+        self.database.execute_sql(LEGACY_SCHEMA)
+        self.bind = self.database.bind_ctx([Downloaded, MessageCache])
+        self.bind.__enter__()
+        migrate_schema()
+
+    def tearDown(self):
+        self.bind.__exit__(None, None, None)
+        self.database.close()
+        self.temp_dir.cleanup()
+
+    def test_batch(self):
+        writer = DBWriter(batch_size=50, flush_interval=10)
+        futures = [writer.put(_media_dict(idx, None, None)) for idx in range(1, 121)]
+        writer.stop()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(Downloaded.select().count(), 120)
+        stats = writer.get_stats()
+        self.assertEqual(stats["records"], 120)
+        self.assertEqual(stats["commits"], 3)
+
+    def test_write_waits_for_commit(self):
+        writer = DBWriter(batch_size=100, flush_interval=0.05)
+
+        async def run():
+            first = _media_dict(1, None, None)
+            first["status"] = 2
+            writer.put(first)
+            first["status"] = 1  # 排队时已复制
+            await writer.write(_media_dict(2, None, None))
+            return Downloaded.select().count()
+
+        self.assertEqual(asyncio.run(run()), 2)
+        self.assertEqual(Downloaded().getStatus(chat_id=1, message_id=1), 2)
+        writer.flush()
+        self.assertEqual(writer.get_stats()["commits"], 1)
+        writer.stop()
+
+    def test_failed_batch(self):
+        def write_records(records):
+            Downloaded().upsert_many(records)
+            if any(record["message_id"] == 2 for record in records):
+                raise ValueError("bad record")
+
+        writer = DBWriter(batch_size=10, flush_interval=10, write_records=write_records)
+        futures = [writer.put(_media_dict(idx, None, None)) for idx in range(1, 4)]
+        writer.stop()
+        # 整批回滚后逐条重试 只丢弃出错的记录
+        self.assertEqual([future.result() for future in futures], [True, False, True])
+        self.assertEqual([record.message_id for record in Downloaded.select()], [1, 3])
+        self.assertEqual(writer.get_stats()["records"], 2)
+        self.assertEqual(writer.get_pending(), [])
+
+    def test_invalid_record(self):
+        writer = DBWriter(batch_size=10, flush_interval=10)
+        futures = [writer.put(_media_dict(1, None, None)), writer.put({})]
+        writer.stop()
+        self.assertEqual([future.result() for future in futures], [True, False])
+        self.assertEqual(Downloaded.select().count(), 1)
+
+    def test_status_index_after_commit(self):
+        status_index = StatusIndex()
+
+        async def load(chat_id):
+            return []
+
+        async def run():
+            await status_index.load(1, load)
+            writer = DBWriter(flush_interval=10, status_index=status_index)
+            writer.put(_media_dict(1, None, None))
+            writer.put({"chat_id": 1, "message_id": 2, "status": 2})
+            # 提交前不更新
+            statuses = [status_index.get(1, 1), writer.get_pending_status(1, 1)]
+            writer.flush()
+            await asyncio.sleep(0)
+            statuses += [status_index.get(1, 1), status_index.get(1, 2)]
+            writer.stop()
+            return statuses
+
+        self.assertEqual(asyncio.run(run()), [0, 1, 1, 0])
+
+    def test_call(self):
+        def fail():
+            Downloaded().upsert_many([_media_dict(3, None, None)])
+            raise ValueError("bad write")
+
+        writer = DBWriter(batch_size=10, flush_interval=10)
+        writer.put(_media_dict(1, None, None))
+        # 在之前排队的记录之后执行
+        count = writer.call(Downloaded.select().count)
+        failed = writer.call(fail)
+        upserted = writer.call(Downloaded().upsert_many, [_media_dict(2, None, None)])
+        writer.stop()
+        self.assertEqual(count.result(), 1)
+        self.assertIsInstance(failed.exception(), ValueError)
+        self.assertEqual(upserted.result(), 1)
+        # 出错的调用单独回滚
+        self.assertEqual([record.message_id for record in Downloaded.select()], [1, 2])
+
+    def test_release_reservation(self):
+        writer = DBWriter(batch_size=10, flush_interval=10)
+        writer.reserve({**_media_dict(1, None, None), "status": 2})
+        writer.reserve({**_media_dict(2, None, None), "status": 2})
+        writer.put(_media_dict(2, None, None))
+        writer.release(1, 1)
+        # 已排队的记录不受影响
+        writer.release(1, 2)
+        self.assertEqual([record["message_id"] for record in writer.get_pending()], [2])
+        self.assertIsNone(writer.get_pending_status(1, 1))
+        writer.stop()
+        self.assertEqual(writer.get_pending(), [])
+        self.assertEqual([record.message_id for record in Downloaded.select()], [2])
+
+    def test_update_from_record(self):
+        record = _media_dict(1, "crc32:0000abcd", "/a.mp4")
+        record["status"] = 2
+        Downloaded().upsert_many([record])
+        msg = Downloaded.get(chat_id=1, message_id=1)
+        writer = DBWriter(batch_size=10, flush_interval=10)
+        writer.put({**msg.to_media_dict(), "status": 5})
+        writer.stop()
+        msg = Downloaded.get(chat_id=1, message_id=1)
+        self.assertEqual((msg.status, msg.content_hash, msg.file_path), (5, "crc32:0000abcd", "/a.mp4"))
+        self.assertEqual(Downloaded.select().count(), 1)
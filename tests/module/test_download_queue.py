@@ -0,0 +1,170 @@
+"""Unittest module for download queue."""
+import asyncio
+import sys
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.download_queue import (
+    DownloadQueue,
+    FairSharePolicy,
+    FifoPolicy,
+    PriorityPolicy,
+    QueueEntry,
+    SchedulePolicy,
+    create_policy,
+)
+
+MB = 1024 * 1024
+
+
+class DownloadQueueTestCase(unittest.TestCase):
+    def test_fifo(self):
+        async def run():
+            queue = DownloadQueue(policy=FifoPolicy())
+            for item in ("a", "b", "c"):
+                await queue.put(item, size=MB)
+            return [await queue.get() for _ in range(3)]
+
+        self.assertEqual(asyncio.run(run()), ["a", "b", "c"])
+
+    def test_create_policy(self):
+        # 默认保持加入顺序
+        self.assertIsInstance(create_policy("fifo"), FifoPolicy)
+        self.assertIsInstance(create_policy(""), FifoPolicy)
+        self.assertIsInstance(create_policy("priority"), PriorityPolicy)
+        self.assertIsInstance(create_policy("fair"), FairSharePolicy)
+
+    def test_policy_is_abstract(self):
+        with self.assertRaises(TypeError):
+            SchedulePolicy()
+
+    def test_priority_classes(self):
+        async def run():
+            queue = DownloadQueue(policy=PriorityPolicy(seconds_per_mb=1.0))
+            await queue.put("big", size=2048 * MB)
+            await queue.put("small", size=MB)
+            await queue.put("chat priority", size=2048 * MB, priority=5)
+            await queue.put("bot", size=2048 * MB, interactive=True)
+            self.assertEqual(queue.qsize(), 4)
+            return [await queue.get() for _ in range(4)]
+
+        self.assertEqual(
+            asyncio.run(run()), ["bot", "chat priority", "small", "big"]
+        )
+
+    def test_aging(self):
+        policy = PriorityPolicy(seconds_per_mb=1.0)
+        big = QueueEntry("big", size=100 * MB)
+        big.enqueue_time -= 200  # waited long enough to outrank new small files
+        small = QueueEntry("small", size=MB)
+        policy.push(small)
+        policy.push(big)
+        self.assertEqual(policy.pop().item, "big")
+
+    def test_maxsize_backpressure(self):
+        async def run():
+            queue = DownloadQueue(maxsize=1)
+            await queue.put("a")
+            put_task = asyncio.ensure_future(queue.put("b"))
+            await asyncio.sleep(0.01)
+            self.assertFalse(put_task.done())
+            self.assertEqual(await queue.get(), "a")
+            await asyncio.wait_for(put_task, 1)
+            return await queue.get()
+
+        self.assertEqual(asyncio.run(run()), "b")
+
+    def test_set_policy_keeps_items(self):
+        async def run():
+            queue = DownloadQueue(policy=FifoPolicy())
+            await queue.put("big", size=100 * MB)
+            await queue.put("small", size=MB)
+            queue.set_policy(create_policy("priority"))
+            return [await queue.get() for _ in range(2)]
+
+        self.assertEqual(asyncio.run(run()), ["small", "big"])
+
+
+class FairSharePolicyTestCase(unittest.TestCase):
+    def test_interleave_by_bytes(self):
+        policy = FairSharePolicy(quantum=4 * MB)
+        for i in range(6):
+            policy.push(QueueEntry(f"a{i}", size=4 * MB, chat_id="a"))
+        policy.push(QueueEntry("b0", size=4 * MB, chat_id="b"))
+        policy.push(QueueEntry("b1", size=4 * MB, chat_id="b"))
+        order = [policy.pop().item for _ in range(4)]
+        # chat b is not starved by the files queued before it
+        self.assertEqual(order, ["a0", "b0", "a1", "b1"])
+        self.assertEqual(policy.get_stats()["b"]["served_bytes"], 8 * MB)
+        self.assertEqual(policy.get_stats()["a"]["queued"], 4)
+
+    def test_weight(self):
+        policy = FairSharePolicy(quantum=MB)
+        policy.set_chat_share("a", weight=3)
+        for i in range(6):
+            policy.push(QueueEntry(f"a{i}", size=MB, chat_id="a"))
+            policy.push(QueueEntry(f"b{i}", size=MB, chat_id="b"))
+        order = [policy.pop().item for _ in range(8)]
+        self.assertEqual(order, ["a0", "a1", "a2", "b0", "a3", "a4", "a5", "b1"])
+
+    def test_large_file_gets_turn(self):
+        policy = FairSharePolicy(quantum=MB)
+        policy.push(QueueEntry("big", size=3 * MB, chat_id="a"))
+        for i in range(4):
+            policy.push(QueueEntry(f"b{i}", size=MB, chat_id="b"))
+        order = [policy.pop().item for _ in range(5)]
+        self.assertEqual(order, ["b0", "b1", "big", "b2", "b3"])
+
+    def test_max_in_flight(self):
+        async def run():
+            policy = FairSharePolicy()
+            policy.set_chat_share("a", max_in_flight=1)
+            queue = DownloadQueue(policy=policy)
+            await queue.put("a0", chat_id="a")
+            await queue.put("a1", chat_id="a")
+            entry = await queue.get_entry()
+            self.assertFalse(policy.ready())
+            get_task = asyncio.ensure_future(queue.get())
+            await asyncio.sleep(0.01)
+            self.assertFalse(get_task.done())
+            await queue.task_done(entry)
+            return await asyncio.wait_for(get_task, 1)
+
+        self.assertEqual(asyncio.run(run()), "a1")
+
+    def test_maxsize_per_chat(self):
+        async def run():
+            queue = DownloadQueue(maxsize=2, policy=FairSharePolicy(), chat_maxsize=1)
+            await queue.put("a0", chat_id="a")
+            # another chat is not held back by the full chat
+            await asyncio.wait_for(queue.put("b0", chat_id="b"), 1)
+            put_task = asyncio.ensure_future(queue.put("a1", chat_id="a"))
+            # the queue is full for every chat
+            other_task = asyncio.ensure_future(queue.put("c0", chat_id="c"))
+            await asyncio.sleep(0.01)
+            self.assertFalse(put_task.done())
+            self.assertFalse(other_task.done())
+            self.assertEqual(await queue.get(), "a0")
+            await asyncio.wait_for(put_task, 1)
+            self.assertFalse(other_task.done())
+            other_task.cancel()
+            return queue.qsize()
+
+        self.assertEqual(asyncio.run(run()), 2)
+
+    def test_interactive_lane(self):
+        policy = FairSharePolicy(quantum=MB)
+        policy.set_chat_share("bot", max_in_flight=1)
+        for i in range(3):
+            policy.push(QueueEntry(f"a{i}", size=MB, chat_id="a"))
+            policy.push(QueueEntry(f"b{i}", size=MB, chat_id="b"))
+        policy.push(QueueEntry("busy", size=MB, chat_id="bot"))
+        self.assertEqual(policy.pop().item, "a0")
+        # 机器人任务不等待轮转 也不受会话并发上限限制
+        policy.push(QueueEntry("bot0", size=100 * MB, chat_id="bot", interactive=True))
+        policy.push(QueueEntry("bot1", size=MB, chat_id="bot", interactive=True))
+        self.assertEqual(policy.pending("bot"), 3)
+        order = [policy.pop().item for _ in range(4)]
+        self.assertEqual(order[:2], ["bot0", "bot1"])
+        self.assertEqual(policy.get_stats()["bot"]["in_flight"], 2)
+        self.assertEqual(len(policy), 4)
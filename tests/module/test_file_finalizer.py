@@ -0,0 +1,55 @@
+"""Unittest module for file finalizer."""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.file_finalizer import FileFinalizer
+from utils.download_storage import DownloadStorage
+
+
+class FileFinalizerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.part_file = os.path.join(self.temp_dir.name, "1.part")
+        self.output_file = os.path.join(self.temp_dir.name, "out", "file.bin")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_finalize_part_file(self):
+        with open(self.part_file, "wb") as f:
+            f.write(b"data")
+        finalizer = FileFinalizer(1)
+
+        async def run():
+            return await finalizer.submit(self.part_file, 4, self.output_file, hash_algorithm="crc32")
+
+        self.assertEqual(asyncio.run(run()), "crc32:adf3f363")
+        self.assertTrue(os.path.exists(self.output_file))
+        self.assertFalse(os.path.exists(self.part_file))
+        finalizer.shutdown()
+
+    def test_finalize_storage(self):
+        storage = DownloadStorage(self.part_file, 2048, chunk_size=1024)
+        storage.open()
+        storage.write_chunk(0, b"a" * 1024)
+        storage.close()
+        finalizer = FileFinalizer(1)
+
+        async def run():
+            return await finalizer.submit(self.part_file, 2048, self.output_file, storage)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+        self.assertFalse(os.path.exists(self.output_file))
+
+        storage.open()
+        storage.write_chunk(1, b"b" * 1024)
+        storage.close()
+        asyncio.run(run())
+        with open(self.output_file, "rb") as f:
+            self.assertEqual(f.read(), b"a" * 1024 + b"b" * 1024)
+        finalizer.shutdown()
@@ -0,0 +1,86 @@
+"""Unittest module for chunk pacing."""
+import asyncio
+import sys
+import time
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.download_stat import get_chunk_rate
+from module.flow_control import ChunkPacer, FloodWaitBackoff
+
+
+class ChunkPacerTestCase(unittest.TestCase):
+    def test_additive_increase(self):
+        pacer = ChunkPacer(initial_rate=1.0, max_rate=3.0, increase=1.0)
+        pacer.on_success(1)
+        self.assertAlmostEqual(pacer.get_rate(1), 2.0)
+        pacer.on_success(1)
+        self.assertAlmostEqual(pacer.get_rate(1), 2.5)
+        for _ in range(10):
+            pacer.on_success(1)
+        self.assertEqual(pacer.get_rate(1), 3.0)
+        self.assertEqual(get_chunk_rate()[1], 3.0)
+
+    def test_multiplicative_decrease_per_dc(self):
+        pacer = ChunkPacer(initial_rate=4.0, min_rate=1.5, decrease=0.5)
+        pacer.on_flood_wait(2, 0)
+        self.assertEqual(pacer.get_rate(2), 2.0)
+        pacer.on_flood_wait(2, 0)
+        self.assertEqual(pacer.get_rate(2), 1.5)
+        # other data centers are not affected
+        self.assertEqual(pacer.get_rate(4), 4.0)
+
+    def test_acquire_spaces_requests(self):
+        pacer = ChunkPacer(initial_rate=20.0, max_rate=20.0)
+
+        async def acquire_all():
+            start = time.monotonic()
+            for _ in range(3):
+                await pacer.acquire(5)
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(acquire_all())
+        self.assertGreaterEqual(elapsed, 0.09)
+
+    def test_flood_wait_holds_dc(self):
+        pacer = ChunkPacer(initial_rate=20.0, max_rate=20.0)
+
+        async def acquire_after_flood_wait():
+            pacer.on_flood_wait(3, 0.2)
+            start = time.monotonic()
+            await pacer.acquire(3)
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(acquire_after_flood_wait()), 0.19)
+
+    def test_configure(self):
+        pacer = ChunkPacer()
+        pacer.configure(initial_rate=50.0, max_rate=10.0)
+        self.assertEqual(pacer.get_rate(1), 10.0)
+
+
+class FloodWaitBackoffTestCase(unittest.TestCase):
+    def test_shared_wait(self):
+        backoff = FloodWaitBackoff()
+
+        async def run():
+            await backoff.wait()  # nothing pending
+            backoff.on_flood_wait(0.1)
+            backoff.on_flood_wait(0.05)  # shorter wait does not shorten the hold
+            start = time.monotonic()
+            await asyncio.gather(backoff.wait(), backoff.wait())
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(run()), 0.09)
+        self.assertEqual(backoff.flood_wait_count, 2)
+
+    def test_request_rate(self):
+        backoff = FloodWaitBackoff(rate=20)
+
+        async def run():
+            start = time.monotonic()
+            await asyncio.gather(*[backoff.wait() for _ in range(4)])
+            return time.monotonic() - start
+
+        # the fourth request waits for three slots of 50ms
+        self.assertGreaterEqual(asyncio.run(run()), 0.14)
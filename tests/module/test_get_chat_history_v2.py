@@ -0,0 +1,168 @@
+"""Unittest module for get_chat_history_v2."""
+import asyncio
+import sys
+import unittest
+from unittest import mock
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module import get_chat_history_v2 as history
+
+
+class MockMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+
+
+class MockHistory:
+    """History of messages 1..count, with deleted ids left out"""
+
+    def __init__(self, count, deleted=()):
+        self.ids = [i for i in range(1, count + 1) if i not in deleted]
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_chunk(self, *, limit, offset, from_message_id, reverse, max_id=0, **_):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if reverse:
+            ids = [i for i in self.ids if i >= max(from_message_id, 1)]
+        else:
+            ids = [i for i in reversed(self.ids) if not from_message_id or i < from_message_id]
+        ids = [i for i in ids if not max_id or i < max_id]
+        return [MockMessage(i) for i in ids[offset : offset + limit]]
+
+
+class GetChatHistoryV2TestCase(unittest.TestCase):
+    def _read(self, mock_history, **kwargs):
+        async def run():
+            with mock.patch.object(history, "get_chunk_v2", mock_history.get_chunk):
+                return [
+                    message.id
+                    async for message in history.get_chat_history_v2(None, 1, **kwargs)
+                ]
+
+        return asyncio.run(run())
+
+    def test_read_ahead_same_messages(self):
+        for read_ahead in (0, 1, 2):
+            mock_history = MockHistory(350, deleted={5, 150})
+            ids = self._read(mock_history, reverse=True, read_ahead=read_ahead)
+            self.assertEqual(ids, mock_history.ids)
+            # two pages ahead are requested at the same time
+            self.assertEqual(mock_history.max_in_flight, max(1, read_ahead))
+
+        mock_history = MockHistory(250)
+        self.assertEqual(
+            self._read(mock_history, read_ahead=2), list(reversed(mock_history.ids))
+        )
+
+    def test_search_filter(self):
+        self.assertIsInstance(
+            history.get_search_filter({"document"}), history.raw.types.InputMessagesFilterDocument
+        )
+        self.assertIsInstance(
+            history.get_search_filter(["video", "photo"]),
+            history.raw.types.InputMessagesFilterPhotoVideo,
+        )
+        self.assertIsNone(history.get_search_filter({"audio", "document"}))
+        self.assertIsNone(history.get_search_filter(None))
+
+        search_filter = history.get_search_filter({"audio"})
+        filters = []
+
+        async def get_chunk(**kwargs):
+            filters.append(kwargs["search_filter"])
+            return []
+
+        async def run():
+            with mock.patch.object(history, "get_chunk_v2", get_chunk):
+                async for _ in history.get_chat_history_v2(
+                    None, 1, reverse=True, search_filter=search_filter
+                ):
+                    pass
+
+        asyncio.run(run())
+        self.assertEqual(filters, [search_filter])
+
+    def test_limit_cancels_read_ahead(self):
+        mock_history = MockHistory(1000)
+        ids = self._read(mock_history, reverse=True, limit=150, read_ahead=2)
+        self.assertEqual(ids, list(range(1, 151)))
+        self.assertLessEqual(mock_history.requests, 4)
+
+
+class ChatHistoryParallelTestCase(unittest.TestCase):
+    def test_split_id_range(self):
+        self.assertEqual(history.split_id_range(1, 10, 3), [(1, 4), (5, 8), (9, 10)])
+        self.assertEqual(history.split_id_range(1, 10, 4, min_size=5), [(1, 5), (6, 10)])
+        self.assertEqual(history.split_id_range(11, 10, 4), [])
+
+    def _read(self, mock_history, ranges, ordered):
+        tracker = history.ScanRangeTracker(ranges)
+
+        async def run():
+            ids = []
+            with mock.patch.object(history, "get_chunk_v2", mock_history.get_chunk):
+                async for message in history.get_chat_history_parallel(
+                    None, 1, ranges, ordered=ordered, buffer=50, tracker=tracker
+                ):
+                    ids.append(message.id)
+                    tracker.on_done(message.id)
+            return ids
+
+        return asyncio.run(run()), tracker
+
+    def test_ordered_merge(self):
+        mock_history = MockHistory(1000, deleted={300, 301})
+        ranges = history.split_id_range(1, 1000, 4)
+        ids, tracker = self._read(mock_history, ranges, ordered=True)
+        self.assertEqual(ids, mock_history.ids)
+        self.assertGreater(mock_history.max_in_flight, 1)
+        self.assertEqual(tracker.watermark(), 1000)
+
+    def test_relaxed_merge(self):
+        mock_history = MockHistory(1000)
+        ranges = history.split_id_range(501, 1000, 2)
+        ids, _ = self._read(mock_history, ranges, ordered=False)
+        self.assertNotEqual(ids, sorted(ids))
+        self.assertEqual(sorted(ids), list(range(501, 1001)))
+
+    def test_tracker_watermark(self):
+        tracker = history.ScanRangeTracker([(1, 10), (11, 20)])
+        for idx, message_id in ((1, 12), (0, 3), (0, 5), (0, 7)):
+            tracker.on_read(idx, message_id)
+        tracker.on_done(12)
+        tracker.on_done(3)
+        tracker.on_done(7)
+        # message 5 of the first range is still pending
+        self.assertEqual(tracker.watermark(), 4)
+        tracker.on_done(5)
+        self.assertEqual(tracker.watermark(), 7)
+        tracker.on_exhausted(0)
+        self.assertEqual(tracker.watermark(), 12)
+
+    def test_tracker_single_range(self):
+        tracker = history.ScanRangeTracker([(101, 101)])
+
+        async def messages():
+            for message_id in (101, 102, 104, 105):
+                yield MockMessage(message_id)
+
+        async def run():
+            ids = []
+            async for message in history.track_history(messages(), tracker):
+                ids.append(message.id)
+            return ids
+
+        self.assertEqual(tracker.watermark(), 100)
+        self.assertEqual(asyncio.run(run()), [101, 102, 104, 105])
+        for message_id in (101, 104, 105):
+            tracker.on_done(message_id)
+        # 102 is still pending, later ids are done already
+        self.assertEqual(tracker.watermark(), 101)
+        tracker.on_done(102)
+        self.assertEqual(tracker.watermark(), 105)
@@ -0,0 +1,67 @@
+"""Unittest module for message refresher."""
+import asyncio
+import sys
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.message_refresher import MessageRefresher
+
+
+class MockClient:
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    async def get_messages(self, chat_id, message_ids):
+        self.calls.append((chat_id, list(message_ids)))
+        await asyncio.sleep(0)
+        if self.error:
+            raise self.error
+        return [f"{chat_id}:{message_id}" for message_id in message_ids]
+
+
+class MessageRefresherTestCase(unittest.TestCase):
+    def test_coalesce_per_chat(self):
+        client = MockClient()
+        refresher = MessageRefresher(window=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                refresher.refresh(client, 1, 10),
+                refresher.refresh(client, 1, 11),
+                refresher.refresh(client, 1, 10),
+                refresher.refresh(client, 2, 10),
+            )
+
+        self.assertEqual(asyncio.run(run()), ["1:10", "1:11", "1:10", "2:10"])
+        self.assertEqual(sorted(client.calls), [(1, [10, 11]), (2, [10])])
+
+    def test_full_batch_sent_at_once(self):
+        client = MockClient()
+        refresher = MessageRefresher(window=10, max_batch=2)
+
+        async def run():
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    refresher.refresh(client, 1, 1), refresher.refresh(client, 1, 2)
+                ),
+                1,
+            )
+
+        self.assertEqual(asyncio.run(run()), ["1:1", "1:2"])
+        self.assertEqual(client.calls, [(1, [1, 2])])
+
+    def test_error_reaches_every_waiter(self):
+        client = MockClient(error=ValueError("expired"))
+        refresher = MessageRefresher(window=0.01)
+
+        async def run():
+            return await asyncio.gather(
+                refresher.refresh(client, 1, 1),
+                refresher.refresh(client, 1, 2),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(item, ValueError) for item in results))
+        self.assertEqual(len(client.calls), 1)
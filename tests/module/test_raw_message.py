@@ -0,0 +1,134 @@
+"""Unittest module for scan-time raw message decoder."""
+import asyncio
+import sys
+import unittest
+from io import BytesIO
+
+from pyrogram import raw
+from pyrogram.client import Cache
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.pyrogram_extension import set_meta_data
+from module.raw_message import ScanMessage, decode_messages
+from utils.meta_data import MetaData
+
+CHANNEL_ID = 777
+USER_ID = 42
+
+
+class MockClient:
+    message_cache = Cache(100)
+
+
+def document(attributes, mime_type="application/zip", size=1000):
+    return raw.types.MessageMediaDocument(
+        document=raw.types.Document(
+            id=1,
+            access_hash=2,
+            file_reference=b"ref",
+            date=0,
+            mime_type=mime_type,
+            size=size,
+            dc_id=1,
+            attributes=attributes,
+        )
+    )
+
+
+def photo():
+    return raw.types.MessageMediaPhoto(
+        photo=raw.types.Photo(
+            id=1,
+            access_hash=2,
+            file_reference=b"ref",
+            date=0,
+            dc_id=1,
+            sizes=[
+                raw.types.PhotoSize(type="m", w=320, h=240, size=5000),
+                raw.types.PhotoSizeProgressive(type="y", w=1280, h=960, sizes=[100, 20000]),
+            ],
+        )
+    )
+
+
+def history(*medias):
+    """GetHistory result with one message per media, read back like from the wire"""
+    messages = [
+        raw.types.Message(
+            id=idx + 1,
+            peer_id=raw.types.PeerChannel(channel_id=CHANNEL_ID),
+            from_id=raw.types.PeerUser(user_id=USER_ID),
+            date=1700000000 + idx,
+            message=f"caption {idx}",
+            media=media,
+            grouped_id=5 if idx % 2 else None,
+            reply_to=raw.types.MessageReplyHeader(reply_to_msg_id=1) if idx else None,
+        )
+        for idx, media in enumerate(medias)
+    ]
+    messages.append(raw.types.MessageEmpty(id=len(medias) + 1))
+    result = raw.types.messages.ChannelMessages(
+        pts=0,
+        count=len(messages),
+        messages=messages,
+        chats=[
+            raw.types.Channel(
+                id=CHANNEL_ID,
+                title="channel",
+                photo=raw.types.ChatPhotoEmpty(),
+                date=0,
+                access_hash=3,
+                username="channel",
+            )
+        ],
+        users=[raw.types.User(id=USER_ID, username="user", first_name="user")],
+        topics=[],
+    )
+    return raw.core.TLObject.read(BytesIO(result.write()))
+
+
+class RawMessageTestCase(unittest.TestCase):
+    def test_same_meta_data_as_full_message(self):
+        result = history(
+            document(
+                [
+                    raw.types.DocumentAttributeAudio(duration=30),
+                    raw.types.DocumentAttributeFilename(file_name="a.mp3"),
+                ],
+                mime_type="audio/mpeg",
+            ),
+            document(
+                [raw.types.DocumentAttributeVideo(duration=60, w=1920, h=1080)],
+                mime_type="video/x-unknown",
+            ),
+            photo(),
+            document([raw.types.DocumentAttributeFilename(file_name="b.pdf")], "application/pdf"),
+            document([raw.types.DocumentAttributeAudio(duration=3, voice=True)], "audio/ogg"),
+            document([raw.types.DocumentAttributeAnimated()], "video/mp4"),
+            None,
+        )
+
+        async def run():
+            for message in decode_messages(MockClient(), result):
+                full = await message.parse()
+                for attr in ("id", "empty", "audio", "video", "photo", "document"):
+                    self.assertEqual(
+                        bool(getattr(message, attr)), bool(getattr(full, attr)), (message.id, attr)
+                    )
+                self.assertEqual(message.media_group_id, full.media_group_id)
+
+                if message.empty:
+                    continue
+                scan_meta, full_meta = MetaData(), MetaData()
+                set_meta_data(scan_meta, message)
+                set_meta_data(full_meta, full)
+                self.assertEqual(scan_meta.data(), full_meta.data(), message.id)
+
+        asyncio.run(run())
+
+    def test_decode_order(self):
+        messages = decode_messages(MockClient(), history(photo(), None))
+        self.assertTrue(all(isinstance(message, ScanMessage) for message in messages))
+        self.assertEqual([message.id for message in messages], [1, 2, 3])
+        self.assertEqual(messages[0].photo.file_size, 20000)
+        self.assertIsNone(messages[1].caption)
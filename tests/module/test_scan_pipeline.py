@@ -0,0 +1,74 @@
+"""Unittest module for scan pipeline."""
+import asyncio
+import sys
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.scan_pipeline import ScanPipeline
+
+
+async def _source(items, read):
+    for item in items:
+        read.append(item)
+        yield item
+
+
+class ScanPipelineTestCase(unittest.TestCase):
+    def test_order_and_drop(self):
+        output = []
+
+        async def keep_even(item):
+            return item if item % 2 == 0 else None
+
+        async def double(item):
+            return item * 2
+
+        async def collect(item):
+            output.append(item)
+
+        async def run():
+            await ScanPipeline(
+                _source(range(10), []), [keep_even, double, collect], prefetch=3, buffer=2
+            ).run()
+
+        asyncio.run(run())
+        self.assertEqual(output, [0, 4, 8, 12, 16])
+
+    def test_prefetch_while_blocked(self):
+        read = []
+
+        async def run():
+            event = asyncio.Event()
+
+            async def passthrough(item):
+                return item
+
+            async def blocked(item):
+                await event.wait()
+
+            task = asyncio.ensure_future(
+                ScanPipeline(
+                    _source(range(100), read), [passthrough, blocked], prefetch=5, buffer=1
+                ).run()
+            )
+            await asyncio.sleep(0.05)
+            # paging went on up to the buffers while the last stage waits
+            self.assertGreater(len(read), 5)
+            self.assertLess(len(read), 100)
+            event.set()
+            await asyncio.wait_for(task, 1)
+
+        asyncio.run(run())
+        self.assertEqual(len(read), 100)
+
+    def test_error_stops_pipeline(self):
+        async def fail(item):
+            if item == 3:
+                raise ValueError("bad message")
+            return item
+
+        async def run():
+            await ScanPipeline(_source(range(1000), []), [fail], prefetch=2).run()
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
@@ -0,0 +1,140 @@
+"""Unittest module for media session pool."""
+import asyncio
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from pyrogram.errors import FloodWait
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.pyrogram_extension import HookClient
+from module.session_pool import MAX_SESSION_FAILURES, MediaSessionPool
+
+
+class MockSession:
+    def __init__(self, dc_id):
+        self.dc_id = dc_id
+        self.stopped = False
+
+    async def stop(self):
+        self.stopped = True
+
+    async def invoke(self, query, sleep_threshold=10):
+        # 与 pyrogram Session.invoke 一致 不超过 sleep_threshold 的等待在内部完成
+        if 3 > sleep_threshold >= 0:
+            raise FloodWait(value=3)
+        return None
+
+
+class MockMediaSessionPool(MediaSessionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self.opened = []
+
+    async def _open_session(self, dc_id):
+        session = MockSession(dc_id)
+        self.opened.append(session)
+        return session
+
+
+class MediaSessionPoolTestCase(unittest.TestCase):
+    def test_open_lazily_least_loaded(self):
+        pool = MockMediaSessionPool(size=2)
+
+        async def run():
+            first = await pool.acquire(1)
+            await pool.release(first)
+            # idle session is reused
+            second = await pool.acquire(1)
+            self.assertIs(second, first)
+            # busy session, open a new one
+            third = await pool.acquire(1)
+            self.assertIsNot(third, first)
+            # pool is full, the least loaded one is used
+            fourth = await pool.acquire(1)
+            self.assertEqual(len(pool.opened), 2)
+            await pool.release(third)
+            await pool.release(fourth)
+            fifth = await pool.acquire(1)
+            self.assertIs(fifth, third)
+            self.assertEqual(
+                [item["in_flight"] for item in pool.get_stats()[1]], [1, 1]
+            )
+
+        asyncio.run(run())
+
+    def test_round_robin(self):
+        pool = MockMediaSessionPool(size=2, strategy="round_robin")
+
+        async def run():
+            first = await pool.acquire(2)
+            second = await pool.acquire(2)
+            third = await pool.acquire(2)
+            fourth = await pool.acquire(2)
+            self.assertIsNot(first, second)
+            self.assertEqual({id(third), id(fourth)}, {id(first), id(second)})
+            # other data centers have their own sessions
+            other = await pool.acquire(4)
+            self.assertEqual(other.dc_id, 4)
+
+        asyncio.run(run())
+
+    def test_unhealthy_session_replaced(self):
+        pool = MockMediaSessionPool(size=1)
+
+        async def run():
+            pooled = await pool.acquire(1)
+            await pool.release(pooled, failed=True)
+            for _ in range(MAX_SESSION_FAILURES - 1):
+                await pool.acquire(1)
+                await pool.release(pooled, failed=True)
+            self.assertFalse(pooled.healthy)
+
+            replacement = await pool.acquire(1)
+            self.assertIsNot(replacement, pooled)
+            self.assertTrue(pooled.session.stopped)
+
+            await pool.stop()
+            self.assertTrue(replacement.session.stopped)
+
+        asyncio.run(run())
+
+
+class HookClientGetFileTestCase(unittest.TestCase):
+    def test_flood_wait_raised(self):
+        client = HookClient.__new__(HookClient)
+        client._get_file_location = lambda file_id: None
+        pool = MockMediaSessionPool(size=1)
+
+        async def run():
+            client.get_file_semaphore = asyncio.Semaphore(1)
+            client.media_session_pool = pool
+            # 即使是很短的 FloodWait 也交给调用方处理
+            with self.assertRaises(FloodWait):
+                async for _ in client.get_file(SimpleNamespace(dc_id=1), limit=1):
+                    pass
+
+        asyncio.run(run())
+        self.assertEqual(pool.get_stats()[1][0]["in_flight"], 0)
+
+    def test_error_raised(self):
+        client = HookClient.__new__(HookClient)
+        client._get_file_location = lambda file_id: None
+        pool = MockMediaSessionPool(size=1)
+
+        async def invoke(self, query, sleep_threshold=10):
+            raise ConnectionError("connection lost")
+
+        async def run():
+            client.get_file_semaphore = asyncio.Semaphore(1)
+            client.media_session_pool = pool
+            # 出错时不能像正常结束一样返回截断的数据
+            with mock.patch.object(MockSession, "invoke", new=invoke):
+                with self.assertRaises(ConnectionError):
+                    async for _ in client.get_file(SimpleNamespace(dc_id=1), limit=1):
+                        pass
+
+        asyncio.run(run())
+        stats = pool.get_stats()[1][0]
+        self.assertEqual((stats["in_flight"], stats["failures"]), (0, 1))
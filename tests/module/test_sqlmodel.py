@@ -0,0 +1,229 @@
+"""Unittest module for sqlmodel."""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from peewee import SqliteDatabase
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.raw_message import decode_messages, load_message
+from module.sqlmodel import (
+    DOWNLOADED_INDEXES,
+    MIGRATIONS,
+    Downloaded,
+    MessageCache,
+    get_schema_version,
+    migrate_schema,
+)
+from tests.module.test_raw_message import MockClient, history, photo
+
+LEGACY_SCHEMA = """CREATE TABLE "Downloaded" (
+  "ID" integer PRIMARY KEY AUTOINCREMENT NOT NULL,
+  "CHAT_USERNAME" varchar(200),
+  "CHAT_ID" integer NOT NULL,
+  "MESSAGE_ID" integer NOT NULL,
+  "FILENAME" varchar(200) NOT NULL,
+  "CAPTION" varchar(200),
+  "TITLE" varchar(200),
+  "MIME_TYPE" varchar(200),
+  "MEDIA_SIZE" integer,
+  "MEDIA_DURATION" integer,
+  "MEDIA_ADDTIME" varchar(200),
+  "CHAT_TITLE" varchar(200),
+  "ADDTIME" varchar(200),
+  "STATUS" integer NOT NULL,
+  "TYPE" varchar(200),
+  "LINK" varchar(200)
+)"""
+
+
+def _media_dict(message_id, content_hash, file_fullname):
+    return {
+        "chat_id": 1,
+        "message_id": message_id,
+        "filename": "a.mp4",
+        "caption": "",
+        "title": "a",
+        "mime_type": "mp4",
+        "media_size": 10,
+        "media_duration": 1,
+        "media_addtime": "2024-01-01 00:00",
+        "chat_username": "chan",
+        "chat_title": "Chan",
+        "msg_type": "video",
+        "msg_link": f"https://t.me/chan/{message_id}",
+        "status": 1,
+        "content_hash": content_hash,
+        "file_fullname": file_fullname,
+    }
+
+
+class DownloadedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = SqliteDatabase(os.path.join(self.temp_dir.name, "test.db"))
+        self.database.execute_sql(LEGACY_SCHEMA)
+        self.bind = self.database.bind_ctx([Downloaded, MessageCache])
+        self.bind.__enter__()
+
+    def tearDown(self):
+        self.bind.__exit__(None, None, None)
+        self.database.close()
+        self.temp_dir.cleanup()
+
+    def test_content_hash(self):
+        db = Downloaded()
+        self.assertTrue(db.ensure_content_hash_columns())
+        columns = [column.name for column in self.database.get_columns("Downloaded")]
+        self.assertIn("CONTENT_HASH", columns)
+        self.assertIn("FILE_PATH", columns)
+        # running it again is a no-op
+        self.assertTrue(db.ensure_content_hash_columns())
+        self.assertTrue(migrate_schema())
+
+        first_file = os.path.join(self.temp_dir.name, "a.mp4")
+        with open(first_file, "wb") as f:
+            f.write(b"a")
+        db.insert_into_db(_media_dict(1, "crc32:0000abcd", first_file))
+        db.insert_into_db(_media_dict(2, "crc32:0000abcd", "/not/exist.mp4"))
+        db.insert_into_db(_media_dict(3, "crc32:ffff0000", first_file))
+
+        self.assertEqual(
+            [record.message_id for record in db.get_files_by_hash("crc32:0000abcd")], [1, 2]
+        )
+        self.assertEqual(db.get_path_by_hash("crc32:0000abcd"), first_file)
+        self.assertIsNone(db.get_path_by_hash("crc32:0000abcd", first_file))
+        self.assertEqual(db.get_files_by_hash(None), [])
+
+    def test_similar_files_by_hash(self):
+        self.assertTrue(migrate_schema())
+        db = Downloaded()
+        first = _media_dict(1, "crc32:0000abcd", None)
+        first["title"] = "Some Movie 2024"
+        other = _media_dict(2, "crc32:ffff0000", None)
+        other["title"] = "Some Movie 2024"
+        renamed = _media_dict(3, "crc32:0000abcd", None)
+        renamed["title"] = "unrelated name"
+        renamed["media_size"] = 99
+        db.upsert_many([first, other, renamed])
+
+        # 摘要一致即相似 摘要不同即使同名也不相似
+        similar = db.get_similar_files(first, 0.9, 0.01, [1])
+        self.assertEqual([record.message_id for record in similar], [3])
+        # 没有摘要时仍按文件名判断
+        first["content_hash"] = None
+        similar = db.get_similar_files(first, 0.9, 0.01, [1])
+        self.assertEqual([record.message_id for record in similar], [2])
+
+    def test_migrate_schema(self):
+        self.assertEqual(get_schema_version(), 0)
+        self.assertTrue(migrate_schema())
+        self.assertEqual(get_schema_version(), len(MIGRATIONS))
+        indexes = {index.name for index in self.database.get_indexes("Downloaded")}
+        self.assertTrue(set(DOWNLOADED_INDEXES) - {"idx_downloaded_chat_msg"} <= indexes)
+        self.assertIn("uq_downloaded_chat_msg", indexes)
+        self.assertIn("CONTENT_HASH", [c.name for c in self.database.get_columns("Downloaded")])
+        self.assertTrue(self.database.table_exists("MessageCache"))
+        # already up to date
+        self.assertTrue(migrate_schema())
+
+        plan = self.database.execute_sql(
+            'EXPLAIN QUERY PLAN SELECT MAX("MESSAGE_ID") FROM "Downloaded" '
+            'WHERE "CHAT_USERNAME" = ? AND "STATUS" = 1',
+            ("chan",),
+        ).fetchall()
+        self.assertIn("idx_downloaded_username_status_msg", str(plan))
+
+
+    def test_deduplicate(self):
+        columns = '"CHAT_ID", "MESSAGE_ID", "CHAT_USERNAME", "STATUS", "FILENAME"'
+        for row in [(1, 1, 2), (1, 1, 1), (1, 1, 2), (1, 2, 2), (1, 2, 3), (2, 1, 2)]:
+            self.database.execute_sql(
+                f'INSERT INTO "Downloaded" ({columns}) VALUES (?, ?, "chan", ?, "a.mp4")', row
+            )
+        self.assertTrue(migrate_schema())
+        rows = self.database.execute_sql(
+            'SELECT "ID", "CHAT_ID", "MESSAGE_ID", "STATUS" FROM "Downloaded" ORDER BY "ID"'
+        ).fetchall()
+        # 保留已下载的 其次保留最新的
+        self.assertEqual(rows, [(2, 1, 1, 1), (5, 1, 2, 3), (6, 2, 1, 2)])
+
+    def test_upsert_many(self):
+        self.assertTrue(migrate_schema())
+        db = Downloaded()
+        first = _media_dict(1, "crc32:0000abcd", "/a.mp4")
+        first["status"] = 2
+        self.assertTrue(db.insert_into_db(first))
+        Downloaded.update(addtime="2024-01-01 00:00").where(Downloaded.message_id == 1).execute()
+
+        medias = [_media_dict(idx, None, None) for idx in range(1, 121)]
+        medias[1]["status"] = 2
+        medias.append(_media_dict(2, None, "/b.mp4"))
+        self.assertEqual(db.upsert_many(medias), 121)
+
+        self.assertEqual(Downloaded.select().count(), 120)
+        record = Downloaded.get(chat_id=1, message_id=1)
+        self.assertEqual(record.status, 1)
+        self.assertEqual(record.content_hash, "crc32:0000abcd")  # 没有新的摘要时保留
+        self.assertIsNone(record.file_path)
+        self.assertEqual(record.addtime, "2024-01-01 00:00")  # 保留首次写入的时间
+        # 同一批中的重复消息以最后一条为准
+        record = Downloaded.get(chat_id=1, message_id=2)
+        self.assertEqual((record.status, record.file_path), (1, "/b.mp4"))
+
+
+class MessageCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database = SqliteDatabase(os.path.join(self.temp_dir.name, "test.db"))
+        self.bind = self.database.bind_ctx([MessageCache])
+        self.bind.__enter__()
+        self.cache = MessageCache()
+        self.assertTrue(self.cache.ensure_table())
+
+    def tearDown(self):
+        self.bind.__exit__(None, None, None)
+        self.database.close()
+        self.temp_dir.cleanup()
+
+    def _rows(self, count):
+        client = MockClient()
+
+        async def run():
+            messages = decode_messages(client, history(*[photo() for _ in range(count)]))
+            return [message.to_cache(await message.parse()) for message in messages[:count]]
+
+        return asyncio.run(run())
+
+    def test_round_trip(self):
+        rows = self._rows(3)
+        self.assertEqual(self.cache.put_messages(rows), 3)
+        # written again, replaced
+        self.assertEqual(self.cache.put_messages(rows), 3)
+        chat_id = rows[0]["chat_id"]
+        self.assertEqual(rows[0]["media_type"], "photo")
+        self.assertTrue(rows[0]["file_unique_id"])
+
+        cached = self.cache.get_messages(chat_id, [1, 3, 9])
+        self.assertEqual(sorted(cached), [1, 3])
+        message = load_message(MockClient(), cached[3])
+        self.assertEqual((message.id, message.chat_id), (3, chat_id))
+        self.assertEqual(message.photo.file_size, 20000)
+        full = asyncio.run(message.parse())
+        self.assertEqual(full.chat.username, "channel")
+
+        self.cache.forget(chat_id, 3)
+        self.assertEqual(sorted(self.cache.get_messages(chat_id, [1, 3])), [1])
+
+    def test_evict(self):
+        rows = self._rows(5)
+        for idx, row in enumerate(rows):
+            row["cached_at"] = int(time.time()) - (5 - idx) * 86400
+        self.cache.put_messages(rows)
+        # older than 3.5 days: messages 1, 2, 3
+        self.assertEqual(self.cache.evict(max_age_days=2.5), 3)
+        self.assertEqual(self.cache.evict(max_rows=1), 1)
+        self.assertEqual(sorted(self.cache.get_messages(rows[0]["chat_id"], range(1, 6))), [5])
@@ -0,0 +1,70 @@
+"""Unittest module for in-memory download status index."""
+import asyncio
+import sys
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from module.status_index import PAGE_SIZE, StatusIndex
+
+
+class StatusIndexTestCase(unittest.TestCase):
+    def test_load_once(self):
+        index = StatusIndex()
+        loads = []
+
+        async def loader(chat_id):
+            loads.append(chat_id)
+            await asyncio.sleep(0.01)
+            # 加载期间写入的状态
+            index.set(chat_id, 3, 2)
+            index.set(chat_id, 1, 1)
+            return [(1, 2), (5, 3), (0, 1)]
+
+        async def run():
+            await asyncio.gather(*[index.load(-100, loader) for _ in range(3)])
+
+        self.assertIsNone(index.get(-100, 1))
+        asyncio.run(run())
+        self.assertEqual(loads, [-100])
+        self.assertEqual([index.get(-100, i) for i in range(1, 7)], [1, 0, 2, 0, 3, 0])
+        self.assertIsNone(index.get(-100, 0))
+        self.assertEqual(index.get_stats()["records"], 3)
+
+    def test_set(self):
+        index = StatusIndex()
+
+        async def loader(_):
+            return [(2, 1)]
+
+        index.set(-100, 1, 1)  # 未加载的频道不记录
+        asyncio.run(index.load(-100, loader))
+        self.assertEqual(index.get(-100, 1), 0)
+        index.set(-100, 1000, 2)
+        index.set(-100, 2, 5)
+        self.assertEqual((index.get(-100, 1000), index.get(-100, 2)), (2, 5))
+        stats = index.get_stats()
+        self.assertEqual((stats["chats"], stats["records"]), (1, 2))
+        self.assertGreater(stats["bytes"], PAGE_SIZE)
+
+        index.forget(-100)
+        self.assertFalse(index.is_loaded(-100))
+        self.assertEqual(index.get_stats()["bytes"], 0)
+
+    def test_large_ids(self):
+        index = StatusIndex()
+
+        async def loader(_):
+            return [(50_000_000, 1), (50_000_001, 2)]
+
+        asyncio.run(index.load(-100, loader))
+        index.set(-100, 2_000_000_000, 1)
+        self.assertEqual(
+            [index.get(-100, i) for i in (1, 49_999_999, 50_000_000, 50_000_001, 2_000_000_000)],
+            [0, 0, 1, 2, 1],
+        )
+        stats = index.get_stats()
+        self.assertEqual(stats["records"], 3)
+        # 只分配用到的页
+        self.assertLess(stats["bytes"], 4 * PAGE_SIZE)
+        index.set(-100, 50_000_000, 0)
+        self.assertEqual(index.get_stats()["records"], 2)
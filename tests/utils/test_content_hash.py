@@ -0,0 +1,57 @@
+"""Unittest module for content hash."""
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from utils.content_hash import StreamHasher, hash_file, verify_file_hash
+from utils.download_storage import DownloadStorage
+
+
+class ContentHashTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, "1.part")
+        self.data = os.urandom(10 * 1024 + 100)
+        with open(self.file_path, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_hash_file(self):
+        self.assertEqual(
+            hash_file(self.file_path, "sha256"),
+            f"sha256:{hashlib.sha256(self.data).hexdigest()}",
+        )
+        self.assertEqual(
+            hash_file(self.file_path, "crc32"), f"crc32:{zlib.crc32(self.data):08x}"
+        )
+        self.assertTrue(verify_file_hash(self.file_path, hash_file(self.file_path, "crc32")))
+        self.assertFalse(verify_file_hash(self.file_path, "crc32:00000000"))
+        self.assertFalse(verify_file_hash(self.file_path, None))
+        with self.assertRaises(ValueError):
+            StreamHasher("md4", 1024)
+
+    def test_stream_hasher_out_of_order(self):
+        hasher = StreamHasher("sha256", 1024)
+        chunks = [self.data[i : i + 1024] for i in range(0, len(self.data), 1024)]
+        hasher.update_chunks(0, chunks[0:2])
+        hasher.update_chunks(5, chunks[5:7])  # other segment, read back later
+        hasher.update_chunks(1, chunks[1:4])  # overlaps the hashed prefix
+        self.assertEqual(hasher.next_chunk_id, 4)
+        self.assertEqual(
+            hasher.finish(self.file_path), f"sha256:{hashlib.sha256(self.data).hexdigest()}"
+        )
+
+    def test_storage_content_hash(self):
+        part_file = os.path.join(self.temp_dir.name, "2.part")
+        chunks = [self.data[i : i + 1024] for i in range(0, len(self.data), 1024)]
+        with DownloadStorage(part_file, len(self.data), 1024, hash_algorithm="crc32") as storage:
+            storage.write_chunks(6, chunks[6:])
+            storage.write_chunks(0, chunks[:6])
+        output_file = os.path.join(self.temp_dir.name, "file.bin")
+        self.assertEqual(storage.finalize(output_file), f"crc32:{zlib.crc32(self.data):08x}")
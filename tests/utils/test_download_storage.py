@@ -0,0 +1,189 @@
+"""Unittest module for download storage."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..")  # Adds higher directory to python modules path.
+from utils.download_storage import (
+    MANIFEST_SUFFIX,
+    ChunkManifest,
+    DownloadStorage,
+    load_missing_ranges,
+)
+
+
+class DownloadStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.part_file = os.path.join(self.temp_dir.name, "sub", "1.part")
+        self.data = bytes(range(256)) * 40  # 10240 bytes
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _chunk(self, chunk_id, chunk_size=1024):
+        return self.data[chunk_id * chunk_size : (chunk_id + 1) * chunk_size]
+
+    def test_preallocate_and_positional_write(self):
+        with DownloadStorage(self.part_file, 10000, chunk_size=1024) as storage:
+            self.assertEqual(os.path.getsize(self.part_file), 10000)
+            self.assertEqual(storage.chunk_count, 10)
+            self.assertEqual(storage.missing_ranges(), [(0, 9)])
+
+            self.assertTrue(storage.write_chunk(3, self._chunk(3)))
+            self.assertTrue(storage.write_chunk(9, self.data[9216:10000]))
+            # wrong length or out of range chunks are refused
+            self.assertFalse(storage.write_chunk(4, b"short"))
+            self.assertFalse(storage.write_chunk(10, self._chunk(0)))
+
+            self.assertEqual(storage.missing_ranges(), [(0, 2), (4, 8)])
+            self.assertEqual(storage.downloaded_bytes(), 1024 + 784)
+            self.assertFalse(storage.is_complete())
+
+        manifest = ChunkManifest.load(self.part_file + MANIFEST_SUFFIX)
+        self.assertEqual(manifest.done_ids(), [3, 9])
+        self.assertEqual(load_missing_ranges(self.part_file, 10000, 1024), [(0, 2), (4, 8)])
+
+    def test_resume_and_finalize(self):
+        with DownloadStorage(self.part_file, 10000, chunk_size=1024) as storage:
+            for chunk_id in range(5):
+                storage.write_chunk(chunk_id, self._chunk(chunk_id))
+
+        with DownloadStorage(self.part_file, 10000, chunk_size=1024) as storage:
+            self.assertEqual(storage.missing_ranges(), [(5, 9)])
+            for chunk_id in range(5, 9):
+                storage.write_chunk(chunk_id, self._chunk(chunk_id))
+            storage.write_chunk(9, self.data[9216:10000])
+            self.assertTrue(storage.is_complete())
+
+        output_file = os.path.join(self.temp_dir.name, "out", "file.bin")
+        storage.finalize(output_file)
+        with open(output_file, "rb") as f:
+            self.assertEqual(f.read(), self.data[:10000])
+        self.assertFalse(os.path.exists(self.part_file))
+        self.assertFalse(os.path.exists(self.part_file + MANIFEST_SUFFIX))
+
+    def test_directory_removed(self):
+        with DownloadStorage(self.part_file, 1024, chunk_size=1024) as storage:
+            storage.write_chunk(0, self._chunk(0))
+        storage.finalize(os.path.join(self.temp_dir.name, "out", "a.bin"))
+        shutil.rmtree(os.path.dirname(self.part_file))
+        shutil.rmtree(os.path.join(self.temp_dir.name, "out"))
+
+        # 运行中被删除的目录重新创建
+        with DownloadStorage(self.part_file, 1024, chunk_size=1024) as storage:
+            storage.write_chunk(0, self._chunk(0))
+        storage.finalize(os.path.join(self.temp_dir.name, "out", "b.bin"))
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir.name, "out", "b.bin")))
+
+    def test_finalize_incomplete(self):
+        storage = DownloadStorage(self.part_file, 10000, chunk_size=1024)
+        storage.open()
+        with self.assertRaises(ValueError):
+            storage.finalize(os.path.join(self.temp_dir.name, "file.bin"))
+
+    def test_manifest_mismatch_restarts(self):
+        with DownloadStorage(self.part_file, 10000, chunk_size=1024) as storage:
+            storage.write_chunk(0, self._chunk(0))
+
+        with DownloadStorage(self.part_file, 5000, chunk_size=1024) as storage:
+            self.assertEqual(storage.missing_ranges(), [(0, 4)])
+            self.assertEqual(os.path.getsize(self.part_file), 5000)
+
+    def test_import_chunk_dir(self):
+        chunk_dir = os.path.join(self.temp_dir.name, "sub", "1_chunk")
+        os.makedirs(chunk_dir)
+        for chunk_id in (0, 1, 4):
+            with open(os.path.join(chunk_dir, f"{chunk_id:08d}"), "wb") as f:
+                f.write(self._chunk(chunk_id))
+        # incomplete chunk and pyrogram temp file are ignored
+        with open(os.path.join(chunk_dir, "00000002"), "wb") as f:
+            f.write(b"partial")
+        with open(os.path.join(chunk_dir, "00000003.temp"), "wb") as f:
+            f.write(self._chunk(3))
+
+        with DownloadStorage(self.part_file, 10000, chunk_size=1024) as storage:
+            self.assertEqual(storage.import_chunk_dir(chunk_dir), 3)
+            self.assertEqual(storage.missing_ranges(), [(2, 3), (5, 9)])
+
+        self.assertFalse(os.path.exists(chunk_dir))
+        with open(self.part_file, "rb") as f:
+            self.assertEqual(f.read(2048), self.data[:2048])
+
+    def test_manifest_saved_in_batches(self):
+        storage = DownloadStorage(self.part_file, 10000, chunk_size=1024, save_bytes=2048)
+        storage.open()
+        storage.write_chunk(0, self._chunk(0))
+        # 未到保存间隔 断点记录还没有这个块
+        self.assertEqual(load_missing_ranges(self.part_file, 10000, 1024), [(0, 9)])
+        storage.write_chunk(1, self._chunk(1))
+        self.assertEqual(load_missing_ranges(self.part_file, 10000, 1024), [(2, 9)])
+        storage.write_chunk(2, self._chunk(2))
+        storage.close()
+        self.assertEqual(load_missing_ranges(self.part_file, 10000, 1024), [(3, 9)])
+
+    def test_write_chunks(self):
+        with DownloadStorage(self.part_file, 10000, chunk_size=1024) as storage:
+            self.assertTrue(
+                storage.write_chunks(7, [self._chunk(7), self._chunk(8), self.data[9216:10000]])
+            )
+            # a short chunk in the middle refuses the whole write
+            self.assertFalse(storage.write_chunks(0, [self._chunk(0), b"short"]))
+            self.assertFalse(storage.write_chunks(9, [self.data[9216:10000], b"x"]))
+            self.assertEqual(storage.missing_ranges(), [(0, 6)])
+
+        with open(self.part_file, "rb") as f:
+            f.seek(7 * 1024)
+            self.assertEqual(f.read(), self.data[7 * 1024 : 10000])
+
+
+class ChunkManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.manifest_path = os.path.join(self.temp_dir.name, "1.part" + MANIFEST_SUFFIX)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_missing_ranges(self):
+        manifest = ChunkManifest(37 * 1024, chunk_size=1024)
+        self.assertEqual(manifest.missing_ranges(), [(0, 36)])
+        for chunk_id in list(range(8, 24)) + [3, 36]:
+            manifest.set_done(chunk_id)
+        manifest.set_done(3)
+        self.assertEqual(manifest.done_count, 18)
+        self.assertEqual(manifest.missing_ranges(), [(0, 2), (4, 7), (24, 35)])
+
+        for chunk_id in range(37):
+            manifest.set_done(chunk_id)
+        self.assertTrue(manifest.is_complete())
+        self.assertEqual(manifest.missing_ranges(), [])
+
+    def test_save_and_load(self):
+        manifest = ChunkManifest(10 * 1024 + 1, chunk_size=1024)
+        manifest.set_done(0)
+        manifest.set_done(10)
+        manifest.save(self.manifest_path)
+
+        loaded = ChunkManifest.load(self.manifest_path)
+        self.assertTrue(loaded.matches(10 * 1024 + 1, 1024))
+        self.assertEqual(loaded.done_ids(), [0, 10])
+        self.assertEqual(loaded.missing_ranges(), [(1, 9)])
+
+    def test_load_corrupt(self):
+        self.assertIsNone(ChunkManifest.load(self.manifest_path))
+
+        manifest = ChunkManifest(10 * 1024, chunk_size=1024)
+        manifest.set_done(1)
+        manifest.save(self.manifest_path)
+        with open(self.manifest_path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"\xff")
+        self.assertIsNone(ChunkManifest.load(self.manifest_path))
+
+        with open(self.manifest_path, "wb") as f:
+            f.write(b"TMDM")
+        self.assertIsNone(ChunkManifest.load(self.manifest_path))
+
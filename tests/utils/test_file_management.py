@@ -1,4 +1,5 @@
 """Unittest module for media downloader."""
+import errno
 import os
 import sys
 import tempfile
@@ -8,7 +9,13 @@ from pathlib import Path
 import mock
 
 sys.path.append("..")  # Adds higher directory to python modules path.
-from utils.file_management import get_next_name, manage_duplicate_file
+from utils.content_hash import hash_file
+from utils.file_management import (
+    copy_file,
+    get_next_name,
+    manage_duplicate_file,
+    move_file,
+)
 
 
 class FileManagementTestCase(unittest.TestCase):
@@ -35,6 +42,82 @@ class FileManagementTestCase(unittest.TestCase):
         result1 = manage_duplicate_file(self.test_file_copy_1)
         self.assertEqual(result1, self.test_file_copy_1)
 
+    def test_manage_duplicate_file_with_hash(self):
+        with open(self.test_file_copy_2, "w") as f:
+            f.write("dummy file")
+        crc32 = hash_file(self.test_file, "crc32")
+        sha256 = hash_file(self.test_file, "sha256")
+        # 已保存的摘要不同时不读取旧文件
+        with mock.patch("utils.file_management.filecmp.cmp") as mock_cmp:
+            self.assertEqual(
+                manage_duplicate_file(
+                    self.test_file_copy_2, crc32, {self.test_file: "crc32:00000000"}
+                ),
+                self.test_file_copy_2,
+            )
+            # sha256 一致即可删除
+            self.assertEqual(
+                manage_duplicate_file(self.test_file_copy_2, sha256, {self.test_file: sha256}),
+                self.test_file,
+            )
+            mock_cmp.assert_not_called()
+        self.assertFalse(os.path.exists(self.test_file_copy_2))
+
+    def test_manage_duplicate_file_crc32_collision(self):
+        with open(self.test_file_copy_2, "w") as f:
+            f.write("dummy filf")
+        crc32 = hash_file(self.test_file_copy_2, "crc32")
+        # crc32 一致但内容不同 不删除
+        self.assertEqual(
+            manage_duplicate_file(self.test_file_copy_2, crc32, {self.test_file: crc32}),
+            self.test_file_copy_2,
+        )
+        self.assertTrue(os.path.exists(self.test_file_copy_2))
+        os.remove(self.test_file_copy_2)
+
     def tearDown(self):
         os.remove(self.test_file)
         os.remove(self.test_file_copy_1)
+
+
+class CopyFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.temp_dir.name, "src.bin")
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_copy_file(self):
+        dst = os.path.join(self.temp_dir.name, "dst.bin")
+        copy_file(self.src, dst)
+        with open(dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(os.path.exists(self.src))
+
+    @mock.patch("utils.file_management.COPY_BLOCK_SIZE", 1024 * 1024)
+    def test_copy_file_fallback(self):
+        dst = os.path.join(self.temp_dir.name, "dst.bin")
+        with mock.patch("utils.file_management._kernel_copy", return_value=False):
+            copy_file(self.src, dst)
+        with open(dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_move_file_cross_device(self):
+        dst = os.path.join(self.temp_dir.name, "dst.bin")
+        real_replace = os.replace
+
+        def replace(src, target):
+            if src == self.src:
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return real_replace(src, target)
+
+        with mock.patch("utils.file_management.os.replace", side_effect=replace):
+            move_file(self.src, dst)
+        self.assertFalse(os.path.exists(self.src))
+        self.assertFalse(os.path.exists(dst + ".temp"))
+        with open(dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
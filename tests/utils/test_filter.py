@@ -448,3 +448,30 @@ class FilterTestCase(unittest.TestCase):
         download_filter.set_debug(True)
         filter_exec(download_filter, "caption == r'.*高桥.*'")
         filter_exec(download_filter, "caption == r'.*高桥.*'")
+
+    def test_implied_media_types(self):
+        download_filter = Filter()
+        media_types = ["audio", "document", "photo", "video"]
+        self.assertEqual(
+            download_filter.implied_media_types(
+                "media_type == 'audio' && file_size > 10MB no_jap_kor", media_types
+            ),
+            {"audio"},
+        )
+        self.assertEqual(
+            download_filter.implied_media_types(
+                "(media_type == 'video' or media_type == 'photo') and id > 10", media_types
+            ),
+            {"photo", "video"},
+        )
+        # any media type can match the caption
+        self.assertEqual(
+            download_filter.implied_media_types(
+                "media_type == 'audio' || caption == r'.*live.*'", media_types
+            ),
+            set(media_types),
+        )
+        self.assertEqual(download_filter.implied_media_types("", media_types), set(media_types))
+        # arithmetic and unknown names are not analysed
+        self.assertIsNone(download_filter.implied_media_types("file_size / 2 > 10", media_types))
+        self.assertIsNone(download_filter.implied_media_types("unknown == 1", media_types))
@@ -12,6 +12,7 @@ from utils.format import (
     format_byte,
     get_byte_from_str,
     replace_date_time,
+    split_missing_ranges,
     truncate_filename,
     validate_title,
 )
@@ -167,6 +168,35 @@ class FormatTestCase(unittest.TestCase):
         self.assertEqual(progress_bar, "███████████████░░░░░")
 
 
+class TestSplitMissingRanges(unittest.TestCase):
+    def test_split_missing_ranges(self):
+        self.assertEqual(split_missing_ranges([(0, 99)], 1), [(0, 99)])
+        self.assertEqual(
+            split_missing_ranges([(0, 99)], 4),
+            [(0, 24), (25, 49), (50, 74), (75, 99)],
+        )
+        self.assertEqual(
+            split_missing_ranges([(0, 1), (10, 29)], 3),
+            [(0, 1), (10, 19), (20, 29)],
+        )
+        # more ranges than segments stay untouched
+        self.assertEqual(
+            split_missing_ranges([(0, 1), (5, 6), (9, 9)], 2),
+            [(0, 1), (5, 6), (9, 9)],
+        )
+        # single chunks can not be split
+        self.assertEqual(split_missing_ranges([(7, 7)], 4), [(7, 7)])
+        self.assertEqual(split_missing_ranges([], 4), [])
+
+    def test_split_missing_ranges_cover_same_chunks(self):
+        missing = [(3, 17), (40, 41), (60, 140)]
+        result = split_missing_ranges(missing, 8)
+        self.assertEqual(len(result), 8)
+        covered = [i for start, end in result for i in range(start, end + 1)]
+        expected = [i for start, end in missing for i in range(start, end + 1)]
+        self.assertEqual(covered, expected)
+
+
 class TestTruncateFilename(unittest.TestCase):
     def test_truncate_filename(self):
         test_cases = [
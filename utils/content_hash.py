@@ -0,0 +1,95 @@
+"""Content hash of downloaded files"""
+
+import hashlib
+import zlib
+from typing import List, Optional
+
+HASH_ALGORITHMS = ("crc32", "sha256")
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class _Crc32:
+    """crc32 with the `update`/`hexdigest` interface of hashlib"""
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data: bytes):
+        """Add data to the checksum"""
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self) -> str:
+        """Checksum as 8 hex digits"""
+        return f"{self._value:08x}"
+
+
+class StreamHasher:
+    """Hash a file while its chunks are written
+
+    Chunks are hashed as long as they arrive in order. Whatever was
+    written out of order, by another segment or before a resume, is read
+    back from the file once in `finish`.
+    """
+
+    def __init__(self, algorithm: str, chunk_size: int):
+        """
+        Parameters
+        ----------
+        algorithm: str
+            `crc32` (fast, not cryptographic) or `sha256`
+
+        chunk_size: int
+            Size of every chunk except the last one
+        """
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+        self.next_chunk_id = 0
+        self._hash = _Crc32() if algorithm == "crc32" else hashlib.sha256()
+
+    def update_chunks(self, start_id: int, chunks: List[bytes]):
+        """Hash the chunks if they continue the hashed prefix"""
+        if start_id > self.next_chunk_id or start_id + len(chunks) <= self.next_chunk_id:
+            return
+        for data in chunks[self.next_chunk_id - start_id :]:
+            self._hash.update(data)
+            self.next_chunk_id += 1
+
+    def finish(self, file_path: str) -> str:
+        """Hash the rest of the file and return the content hash"""
+        with open(file_path, "rb") as f:
+            f.seek(self.next_chunk_id * self.chunk_size)
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                self._hash.update(block)
+        return f"{self.algorithm}:{self._hash.hexdigest()}"
+
+
+def hash_file(file_path: str, algorithm: str) -> str:
+    """
+    Content hash of a file, read in blocks.
+
+    Parameters
+    ----------
+    file_path: str
+        The file to hash
+
+    algorithm: str
+        `crc32` or `sha256`
+
+    Returns
+    -------
+    str
+        `<algorithm>:<hex digest>`
+    """
+    return StreamHasher(algorithm, READ_BLOCK_SIZE).finish(file_path)
+
+
+def verify_file_hash(file_path: str, content_hash: Optional[str]) -> bool:
+    """Check the file against a content hash from `hash_file`"""
+    if not content_hash or ":" not in content_hash:
+        return False
+    algorithm = content_hash.split(":", 1)[0]
+    if algorithm not in HASH_ALGORITHMS:
+        return False
+    return hash_file(file_path, algorithm) == content_hash
@@ -0,0 +1,415 @@
+"""Preallocated download file written chunk by chunk at its offset"""
+
+import os
+import shutil
+import struct
+import zlib
+from typing import List, Optional, Tuple
+
+from utils.content_hash import StreamHasher
+from utils.file_management import move_file
+
+CHUNK_SIZE = 1024 * 1024
+MANIFEST_SUFFIX = ".manifest"
+# 写入这么多字节后落盘并保存一次断点记录
+MANIFEST_SAVE_BYTES = 16 * 1024 * 1024
+
+# magic, version, file_size, chunk_size, chunk_count, crc32 of the bitmap
+_MANIFEST_HEADER = struct.Struct("<4sBQIII")
+_MANIFEST_MAGIC = b"TMDM"
+_MANIFEST_VERSION = 1
+
+
+def ensure_dir(directory: str):
+    """Create the directory if missing, it may be removed while running"""
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+class ChunkManifest:
+    """Bitmap of the finished chunks of one download
+
+    Bit `chunk_id` is set once the chunk is on disk. The bitmap is stored
+    next to the partial file with a small header and a crc32, so a 4 GB
+    file with 1 MB chunks needs a 512 byte bitmap and resume state is read
+    back with a single file read.
+    """
+
+    def __init__(self, file_size: int, chunk_size: int = CHUNK_SIZE):
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.chunk_count = (file_size + chunk_size - 1) // chunk_size
+        self.bitmap = bytearray((self.chunk_count + 7) // 8)
+        self.done_count = 0
+
+    @classmethod
+    def load(cls, manifest_path: str) -> Optional["ChunkManifest"]:
+        """Read a manifest, None if it is missing or corrupt"""
+        try:
+            with open(manifest_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) < _MANIFEST_HEADER.size:
+            return None
+        magic, version, file_size, chunk_size, chunk_count, crc = _MANIFEST_HEADER.unpack_from(data)
+        bitmap = data[_MANIFEST_HEADER.size :]
+        if (
+            magic != _MANIFEST_MAGIC
+            or version != _MANIFEST_VERSION
+            or file_size <= 0
+            or chunk_size <= 0
+        ):
+            return None
+
+        manifest = cls(file_size, chunk_size)
+        if (
+            chunk_count != manifest.chunk_count
+            or len(bitmap) != len(manifest.bitmap)
+            or zlib.crc32(bitmap) != crc
+        ):
+            return None
+
+        manifest.bitmap[:] = bitmap
+        # 屏蔽最后一个字节中超出块数的位
+        extra_bits = len(bitmap) * 8 - manifest.chunk_count
+        if extra_bits:
+            manifest.bitmap[-1] &= 0xFF >> extra_bits
+        manifest.done_count = sum(bin(byte).count("1") for byte in manifest.bitmap)
+        return manifest
+
+    def save(self, manifest_path: str):
+        """Write the manifest atomically"""
+        header = _MANIFEST_HEADER.pack(
+            _MANIFEST_MAGIC,
+            _MANIFEST_VERSION,
+            self.file_size,
+            self.chunk_size,
+            self.chunk_count,
+            zlib.crc32(self.bitmap),
+        )
+        temp_path = f"{manifest_path}.temp"
+        with open(temp_path, "wb") as f:
+            f.write(header + self.bitmap)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, manifest_path)
+
+    def matches(self, file_size: int, chunk_size: int) -> bool:
+        """If the manifest describes a file of this layout"""
+        return self.file_size == file_size and self.chunk_size == chunk_size
+
+    def is_done(self, chunk_id: int) -> bool:
+        """If the chunk is already on disk"""
+        return bool(self.bitmap[chunk_id >> 3] & (1 << (chunk_id & 7)))
+
+    def set_done(self, chunk_id: int):
+        """Mark the chunk as on disk"""
+        if not self.is_done(chunk_id):
+            self.bitmap[chunk_id >> 3] |= 1 << (chunk_id & 7)
+            self.done_count += 1
+
+    def done_ids(self) -> List[int]:
+        """Sorted ids of the finished chunks"""
+        return [chunk_id for chunk_id in range(self.chunk_count) if self.is_done(chunk_id)]
+
+    def is_complete(self) -> bool:
+        """If every chunk is on disk"""
+        return self.done_count == self.chunk_count
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        """Inclusive (start_id, end_id) ranges of chunks still to download"""
+        missing_ranges = []
+        start_id = None
+        chunk_id = 0
+        while chunk_id < self.chunk_count:
+            byte = self.bitmap[chunk_id >> 3]
+            # 整字节全部完成或全部缺失时按字节跳过
+            if chunk_id & 7 == 0 and chunk_id + 8 <= self.chunk_count and byte in (0, 0xFF):
+                if byte == 0xFF and start_id is not None:
+                    missing_ranges.append((start_id, chunk_id - 1))
+                    start_id = None
+                elif byte == 0 and start_id is None:
+                    start_id = chunk_id
+                chunk_id += 8
+                continue
+
+            if byte & (1 << (chunk_id & 7)):
+                if start_id is not None:
+                    missing_ranges.append((start_id, chunk_id - 1))
+                    start_id = None
+            elif start_id is None:
+                start_id = chunk_id
+            chunk_id += 1
+
+        if start_id is not None:
+            missing_ranges.append((start_id, self.chunk_count - 1))
+        return missing_ranges
+
+
+def load_missing_ranges(
+    file_path: str, file_size: int, chunk_size: int = CHUNK_SIZE
+) -> Optional[List[Tuple[int, int]]]:
+    """Missing chunk ranges of a partial file, read from its manifest only
+    without opening the file, `[]` once the download is complete
+
+    Parameters
+    ----------
+    file_path: str
+        Path of the partial file
+
+    file_size: int
+        Final size of the file
+
+    chunk_size: int
+        Size of every chunk except the last one
+
+    Returns
+    -------
+    Optional[List[Tuple[int, int]]]
+        Inclusive (start_id, end_id) ranges, None if the manifest is
+        missing, corrupt or describes a different file
+    """
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) != file_size:
+        return None
+    manifest = ChunkManifest.load(f"{file_path}{MANIFEST_SUFFIX}")
+    if manifest is None or not manifest.matches(file_size, chunk_size):
+        return None
+    return manifest.missing_ranges()
+
+
+class DownloadStorage:
+    """One in-flight download.
+
+    The file is preallocated to its final size and every chunk is written
+    at `chunk_id * chunk_size` with a positional write, so finishing the
+    download needs no merge. Finished chunks are kept in a sidecar
+    `ChunkManifest` next to the file, which is all that resume needs.
+    The manifest is saved every `save_bytes` written bytes and on close,
+    always after the data file is synced, so it never lists a chunk that
+    is not on disk.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        file_size: int,
+        chunk_size: int = CHUNK_SIZE,
+        preallocate: str = "sparse",
+        hash_algorithm: str = None,
+        save_bytes: int = MANIFEST_SAVE_BYTES,
+    ):
+        """
+        Parameters
+        ----------
+        file_path: str
+            Path of the partial file
+
+        file_size: int
+            Final size of the file
+
+        chunk_size: int
+            Size of every chunk except the last one
+
+        preallocate: str
+            `sparse` only sets the file size, `fallocate` also reserves
+            the disk blocks where the platform supports it
+
+        hash_algorithm: str
+            Content hash computed while chunks are written, `crc32`,
+            `sha256` or None for no hash
+
+        save_bytes: int
+            Bytes written between two saves of the manifest
+        """
+        if file_size <= 0 or chunk_size <= 0:
+            raise ValueError(f"Invalid file size {file_size} or chunk size {chunk_size}")
+
+        self.file_path = file_path
+        self.manifest_path = f"{file_path}{MANIFEST_SUFFIX}"
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.chunk_count = (file_size + chunk_size - 1) // chunk_size
+        self.preallocate = preallocate
+        self.manifest = ChunkManifest(file_size, chunk_size)
+        self.hasher = StreamHasher(hash_algorithm, chunk_size) if hash_algorithm else None
+        self.content_hash: Optional[str] = None
+        self.save_bytes = save_bytes
+        self._unsaved_bytes = 0
+        self._fd: Optional[int] = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def chunk_length(self, chunk_id: int) -> int:
+        """Expected length of the chunk"""
+        if chunk_id == self.chunk_count - 1:
+            return self.file_size - chunk_id * self.chunk_size
+        return self.chunk_size
+
+    def open(self):
+        """Open and preallocate the file, load resume state"""
+        ensure_dir(os.path.dirname(self.file_path))
+
+        is_new = not os.path.isfile(self.file_path)
+        self._fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0))
+
+        manifest = None if is_new else ChunkManifest.load(self.manifest_path)
+        if manifest is not None and manifest.matches(self.file_size, self.chunk_size):
+            self.manifest = manifest
+        else:
+            # 没有可信的断点记录 从头开始
+            self.manifest = ChunkManifest(self.file_size, self.chunk_size)
+            os.ftruncate(self._fd, 0)
+
+        if os.fstat(self._fd).st_size != self.file_size:
+            self._allocate()
+
+        self.manifest.save(self.manifest_path)
+
+    def close(self):
+        """Save the manifest and close the file"""
+        if self._fd is not None:
+            try:
+                self.sync()
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+    def sync(self):
+        """Flush the written chunks to disk, then save the manifest"""
+        if self._fd is None or not self._unsaved_bytes:
+            return
+        os.fsync(self._fd)
+        self.manifest.save(self.manifest_path)
+        self._unsaved_bytes = 0
+
+    def _allocate(self):
+        if self.preallocate == "fallocate" and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self._fd, 0, self.file_size)
+                return
+            except OSError:
+                pass  # 文件系统不支持 退回稀疏文件
+        os.ftruncate(self._fd, self.file_size)
+
+    def _pwrite(self, buffers: List[bytes], offset: int) -> int:
+        if hasattr(os, "pwritev"):
+            return os.pwritev(self._fd, buffers, offset)
+        data = b"".join(buffers)
+        if hasattr(os, "pwrite"):
+            return os.pwrite(self._fd, data, offset)
+        os.lseek(self._fd, offset, os.SEEK_SET)
+        return os.write(self._fd, data)
+
+    def write_chunk(self, chunk_id: int, data: bytes) -> bool:
+        """Write one chunk at its offset and record it as done"""
+        return self.write_chunks(chunk_id, [data])
+
+    def write_chunks(self, start_id: int, chunks: List[bytes]) -> bool:
+        """Write consecutive chunks with one positional write
+
+        Parameters
+        ----------
+        start_id: int
+            Id of the first chunk
+
+        chunks: List[bytes]
+            Data of chunk `start_id`, `start_id + 1`, ...
+
+        Returns
+        -------
+        bool
+            False if a chunk has a wrong length or the write is short
+        """
+        if not chunks or start_id < 0 or start_id + len(chunks) > self.chunk_count:
+            return False
+        for chunk_id, data in enumerate(chunks, start_id):
+            if len(data) != self.chunk_length(chunk_id):
+                return False
+
+        total = sum(len(data) for data in chunks)
+        if self._pwrite(chunks, start_id * self.chunk_size) != total:
+            return False
+
+        for chunk_id in range(start_id, start_id + len(chunks)):
+            self.manifest.set_done(chunk_id)
+        if self.hasher:
+            self.hasher.update_chunks(start_id, chunks)
+        self._unsaved_bytes += total
+        if self._unsaved_bytes >= self.save_bytes:
+            self.sync()
+        return True
+
+    def downloaded_bytes(self) -> int:
+        """Bytes already written"""
+        done_count = self.manifest.done_count
+        if done_count and self.manifest.is_done(self.chunk_count - 1):
+            return (done_count - 1) * self.chunk_size + self.chunk_length(self.chunk_count - 1)
+        return done_count * self.chunk_size
+
+    def is_complete(self) -> bool:
+        """If every chunk has been written"""
+        return self.manifest.is_complete()
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        """Inclusive (start_id, end_id) ranges of chunks still to download"""
+        return self.manifest.missing_ranges()
+
+    def import_chunk_dir(self, chunk_dir: str) -> int:
+        """Copy complete chunks of the old `<message_id>_chunk` layout
+
+        The old layout stored every chunk as its own file named by the
+        8 digit chunk id. Complete chunks are written into this file and
+        the directory is removed afterwards.
+
+        Returns
+        -------
+        int
+            The number of imported chunks
+        """
+        imported = 0
+        for file_name in sorted(os.listdir(chunk_dir)):
+            if not file_name.isdigit():
+                continue
+            chunk_id = int(file_name)
+            if not 0 <= chunk_id < self.chunk_count or self.manifest.is_done(chunk_id):
+                continue
+            chunk_path = os.path.join(chunk_dir, file_name)
+            if os.path.getsize(chunk_path) != self.chunk_length(chunk_id):
+                continue
+            with open(chunk_path, "rb") as f:
+                if self.write_chunk(chunk_id, f.read()):
+                    imported += 1
+
+        # 导入的块落盘后才删除旧目录
+        self.sync()
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return imported
+
+    def finalize(self, output_file: str) -> Optional[str]:
+        """Move the finished file to its destination and drop the manifest
+
+        Returns
+        -------
+        Optional[str]
+            The content hash, None if no hash algorithm is set
+        """
+        self.close()
+        if not self.is_complete() or os.path.getsize(self.file_path) != self.file_size:
+            raise ValueError(f"Download of '{self.file_path}' is not complete")
+
+        if self.hasher:
+            self.content_hash = self.hasher.finish(self.file_path)
+
+        ensure_dir(os.path.dirname(output_file))
+
+        move_file(self.file_path, output_file)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        return self.content_hash
@@ -1,8 +1,14 @@
 """Utility functions to handle downloaded files."""
+import errno
+import filecmp
 import glob
 import os
 import pathlib
-from hashlib import md5
+import shutil
+from typing import Optional
+
+# 每次内核复制的最大字节数
+COPY_BLOCK_SIZE = 64 * 1024 * 1024
 
 
 def get_next_name(file_path: str) -> str:
@@ -40,25 +46,21 @@ def get_next_name(file_path: str) -> str:
     )
 
 
-def manage_duplicate_file(file_path: str):
+def find_duplicate_candidates(file_path: str) -> list:
     """
-    Check if a file is duplicate.
-
-    Compare the md5 of files with copy name pattern
-    and remove if the md5 hash is same.
+    Files with copy name pattern and the same size as the file.
 
     Parameters
     ----------
     file_path: str
         Absolute path of the file for which duplicates needs to
-        be managed.
+        be found.
 
     Returns
     -------
-    str
-        Absolute path of the duplicate managed file.
+    list
+        Absolute paths of the candidates, the file itself excluded.
     """
-    # pylint: disable = R1732
     posix_path = pathlib.Path(file_path)
     file_base_name: str = "".join(posix_path.stem.split("-copy")[0])
     name_pattern: str = f"{posix_path.parent}/{file_base_name}*"
@@ -69,10 +71,135 @@ def manage_duplicate_file(file_path: str):
     )
     if file_path in old_files:
         old_files.remove(file_path)
-    current_file_md5: str = md5(open(file_path, "rb").read()).hexdigest()
-    for old_file_path in old_files:
-        old_file_md5: str = md5(open(old_file_path, "rb").read()).hexdigest()
-        if current_file_md5 == old_file_md5:
+    current_file_size: int = os.path.getsize(file_path)
+    return [
+        old_file_path
+        for old_file_path in old_files
+        if os.path.getsize(old_file_path) == current_file_size
+    ]
+
+
+def manage_duplicate_file(
+    file_path: str, content_hash: Optional[str] = None, stored_hashes: dict = None
+):
+    """
+    Check if a file is duplicate.
+
+    Candidates come from `find_duplicate_candidates`. A candidate whose
+    stored content hash differs from the one of the file is skipped
+    without reading it. The file is only removed on a `sha256` match or
+    after a byte by byte comparison, a `crc32` match alone is not enough.
+
+    Parameters
+    ----------
+    file_path: str
+        Absolute path of the file for which duplicates needs to
+        be managed.
+
+    content_hash: Optional[str]
+        Content hash of the file computed while it was downloaded.
+
+    stored_hashes: dict
+        Content hash of the candidates by path, as stored in the database.
+
+    Returns
+    -------
+    str
+        Absolute path of the duplicate managed file.
+    """
+    algorithm = content_hash.split(":", 1)[0] if content_hash else None
+    for old_file_path in find_duplicate_candidates(file_path):
+        stored_hash = (stored_hashes or {}).get(old_file_path)
+        if algorithm and stored_hash and stored_hash.split(":", 1)[0] == algorithm:
+            if stored_hash != content_hash:
+                continue
+            if algorithm == "sha256":
+                os.remove(file_path)
+                return old_file_path
+        # 没有可信的摘要 逐字节比较后才删除
+        if filecmp.cmp(file_path, old_file_path, shallow=False):
             os.remove(file_path)
             return old_file_path
     return file_path
+
+
+def _kernel_copy(src_fd: int, dst_fd: int, size: int) -> bool:
+    """Copy with `copy_file_range` or `sendfile`, False if neither works"""
+    for copy_func in ("copy_file_range", "sendfile"):
+        if not hasattr(os, copy_func):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                count = min(COPY_BLOCK_SIZE, size - offset)
+                if copy_func == "copy_file_range":
+                    copied = os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+                else:
+                    copied = os.sendfile(dst_fd, src_fd, offset, count)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            # 目标文件系统不支持 换下一种方式从头复制
+            os.ftruncate(dst_fd, 0)
+            os.lseek(dst_fd, 0, os.SEEK_SET)
+            continue
+        if offset == size:
+            return True
+    return False
+
+
+def copy_file(src: str, dst: str):
+    """
+    Copy a file with the kernel copy paths where available.
+
+    `os.copy_file_range` and `os.sendfile` keep the data inside the
+    kernel, `shutil.copyfileobj` is used when neither is supported.
+
+    Parameters
+    ----------
+    src: str
+        Path of the file to copy
+
+    dst: str
+        Path of the copy
+    """
+    size = os.path.getsize(src)
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        if not _kernel_copy(src_file.fileno(), dst_file.fileno(), size):
+            dst_file.seek(0)
+            dst_file.truncate()
+            shutil.copyfileobj(src_file, dst_file, COPY_BLOCK_SIZE)
+    shutil.copystat(src, dst)
+
+    if os.path.getsize(dst) != size:
+        os.remove(dst)
+        raise IOError(f"Copy '{src}' to '{dst}' is incomplete")
+
+
+def move_file(src: str, dst: str):
+    """
+    Move a file, rename on the same file system and copy otherwise.
+
+    Parameters
+    ----------
+    src: str
+        Path of the file to move
+
+    dst: str
+        Destination path
+    """
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # 跨文件系统 先复制到临时文件 完整后再改名
+    temp_dst = f"{dst}.temp"
+    copy_file(src, temp_dst)
+    os.replace(temp_dst, dst)
+    os.remove(src)
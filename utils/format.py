@@ -2,7 +2,6 @@
 
 import math
 import os
-import time
 import regex as re
 import shutil
 import unicodedata
@@ -610,135 +609,33 @@ def guess_media_type(file_name_ext: str):
         return "default"
     return media_type
 
-def find_missing_files(folder_path, max_number):
-    missing_ranges = []
-    max_file_number = max_number -1
-    if not os.path.exists(folder_path):
-        missing_ranges = [(0,max_file_number)]
-        return missing_ranges
-    # Create a set to store existing file names
-    all_files = set()
-
-    # Iterate through the range of file names
-    for i in range(max_number):
-        all_files.add(f"{i:08d}")
-
-    # Read the existing file names from the folder
-    existing_files = set(os.listdir(folder_path))
-
-    missing_files = all_files - existing_files
-    for existing_file in existing_files:
-        if os.path.getsize(os.path.join(folder_path, existing_file)) < 1024 * 1024:
-            missing_files.add(existing_file)
-
-    # Group consecutive missing file names
-    if missing_files is None or len(missing_files) == 0:  # 没有缺失文件
-        return [(max_file_number,max_file_number)]
-    else:
-        start_range = None
-        max_range = int(max(missing_files))
-        for file_name in sorted(missing_files):
-            cursor_idx = int(file_name)
-            if start_range is None:  # 第一个元素
-                start_range = cursor_idx
-                if cursor_idx == max_range:  # 是最后一个元素
-                    missing_ranges.append((start_range, max_range))
-                prev_one = cursor_idx
-            elif cursor_idx != prev_one + 1:  # 不连续了
-                missing_ranges.append((start_range, prev_one))
-                start_range = cursor_idx
-                if cursor_idx == max_range:  # 是最后一个元素
-                    missing_ranges.append((start_range, cursor_idx))
-                prev_one = cursor_idx
-            else:  # 连续
-                if cursor_idx == max_range:  # 是最后一个元素
-                    missing_ranges.append((start_range, cursor_idx))
-                prev_one = cursor_idx
-
-        return missing_ranges
-
-def merge_files_cat(folder_path, output_file ):
-    os.system(f"cat '{folder_path}'/* > {output_file}")
-
-def merge_files_shutil(folder_path, output_file):
-    # 验证路径是否存在
-    if not os.path.isdir(folder_path):
-        raise ValueError(f"指定的文件夹路径不存在: {folder_path}")
-
-    # 获取文件夹中的所有文件
-    try:
-        file_list = os.listdir(folder_path)
-    except Exception as e:
-        print(f"指定的文件夹中不存在文件: {e}")
-
-    # 当文件列表中只有一个文件时，执行文件复制操作
-    if len(file_list) == 1:
-        # 构建源文件的完整路径
-        source_file = os.path.join(folder_path, file_list[0])
-        # 执行文件复制，将唯一文件内容复制到输出文件
-        shutil.copy(source_file, output_file)
-        # 结束函数执行，确保不会继续处理
-        return
-
-    file_list.sort()  # 确保文件按照一致的顺序合并
-
-    # 确认输出文件存在再删除
-    if os.path.exists(output_file) and os.path.isfile(output_file):
-        try:
-            # 删除文件
-            os.remove(output_file)
-            print(f"File {output_file} has been removed.")
-        except PermissionError:
-            print(f"Permission denied: Cannot remove file {output_file}.")
-        except Exception as e:
-            print(f"An error occurred while removing the file: {e}")
-
-        time.sleep(1)
-
-    if not os.path.exists(output_file):
-        try:
-            with open(output_file, 'ab') as output_file:
-                for file_name in file_list:
-                    file_path = os.path.join(folder_path, file_name)
-                    # 验证文件路径是否在指定文件夹内
-                    if not os.path.realpath(file_path).startswith(os.path.realpath(folder_path)):
-                        raise ValueError(f"无效的文件路径: {file_path}")
-
-                    with open(file_path, 'rb') as source:
-                        shutil.copyfileobj(source, output_file)
-        except Exception as e:
-            # 清理部分写入的数据
-            if os.path.exists(output_file):
-                os.remove(output_file)
-            raise RuntimeError(f"合并文件时发生错误: {e}")
-
-def merge_files_write(folder_path, output_file, batch_size=1000):
-    # 获取文件夹中的所有文件
-    files = os.listdir(folder_path)
-    files.sort()  # 确保文件按照一致的顺序合并
-
-    if os.path.exists(output_file):
-        os.remove(output_file)
-
-    with open(output_file, 'ab') as output_file:
-        for file_name in files:
-            file_path = os.path.join(folder_path, file_name)
-            with open(file_path, 'rb') as source:
-                output_file.write(source.read())
-
-
-def get_folder_files_size(folder_path):
-    files_size = []
-    total_size = 0
-    files_count = 0
-    for dirpath, dirnames, filenames in os.walk(folder_path):
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            file_size = os.path.getsize(file_path)
-            if file_size < 1024 * 1024:
-                files_size.append((filename,file_size))
-            total_size += file_size
-            files_count += 1
-    return files_count, total_size, files_size
 
+def split_missing_ranges(missing_ranges, segments: int):
+    """Split missing chunk ranges into at most `segments` disjoint ranges
 
+    The largest range is halved until there are enough ranges to feed
+    every segment, so the result covers exactly the same chunk ids.
+
+    Parameters
+    ----------
+    missing_ranges: list
+        Inclusive (start_id, end_id) chunk ranges, see `DownloadStorage.missing_ranges`
+
+    segments: int
+        The number of segments that download at the same time
+
+    Returns
+    -------
+    list
+        Inclusive (start_id, end_id) chunk ranges sorted by start_id
+    """
+    ranges = [(int(start), int(end)) for start, end in missing_ranges if end >= start]
+    while 0 < len(ranges) < segments:
+        largest = max(ranges, key=lambda item: item[1] - item[0])
+        start, end = largest
+        if end == start:  # 已经无法再拆分
+            break
+        middle = (start + end) // 2
+        ranges.remove(largest)
+        ranges.extend([(start, middle), (middle + 1, end)])
+    return sorted(ranges)